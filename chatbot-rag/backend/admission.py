@@ -0,0 +1,184 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Tuple
+
+logger = logging.getLogger("RAG_ADMISSION")
+
+# ------------------------------------------------------------------------------
+# Config
+# ------------------------------------------------------------------------------
+# Generations allowed to run at once (per API worker)
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "2"))
+# Requests allowed to wait for a slot; beyond this new work is rejected at once
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "8"))
+# Longest a request may wait for a slot before it is shed
+ADMISSION_QUEUE_TIMEOUT_S = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_S", "10"))
+# Service-time estimate used before anything has been measured
+ADMISSION_INITIAL_SERVICE_S = float(os.getenv("ADMISSION_INITIAL_SERVICE_S", "2.0"))
+
+# Lower value = served first
+PRIORITY_STREAM = 0
+PRIORITY_CHAT = 1
+
+
+class Overloaded(Exception):
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Bounds in-flight generations and keeps a short priority queue with deadlines.
+
+    Requests that can't be served in time are rejected fast instead of queueing
+    unbounded work: 429 when the queue is full, 503 when the predicted or actual
+    wait exceeds the deadline. Retry-After is derived from the observed service
+    time. Must be used from a single event loop (one per API worker).
+    """
+
+    def __init__(
+        self,
+        max_inflight: int = ADMISSION_MAX_INFLIGHT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        queue_timeout_s: float = ADMISSION_QUEUE_TIMEOUT_S,
+    ):
+        self.max_inflight = max(1, max_inflight)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout_s = queue_timeout_s
+
+        self._inflight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._service_s = ADMISSION_INITIAL_SERVICE_S
+
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+
+    # --------------------------------------------------------------------------
+    # Estimates
+    # --------------------------------------------------------------------------
+    def _queued(self) -> int:
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    def predicted_wait_s(self, ahead: int) -> float:
+        if self._inflight < self.max_inflight and ahead == 0:
+            return 0.0
+        return self._service_s * (ahead + 1) / self.max_inflight
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.predicted_wait_s(self._queued())))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "inflight": self._inflight,
+            "queued": self._queued(),
+            "max_inflight": self.max_inflight,
+            "max_queue": self.max_queue,
+            "service_time_s": round(self._service_s, 3),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "expired": self.expired,
+        }
+
+    # --------------------------------------------------------------------------
+    # Admission
+    # --------------------------------------------------------------------------
+    def check(self, priority: int = PRIORITY_CHAT) -> None:
+        """Fast pre-check (raises Overloaded) for callers that must answer before queueing."""
+        ahead = sum(1 for p, _, fut in self._waiters if not fut.done() and p <= priority)
+        if self._inflight < self.max_inflight and ahead == 0:
+            return
+        if self._queued() >= self.max_queue and not self._lower_priority_waiter(priority):
+            self.rejected += 1
+            raise Overloaded(429, self.retry_after(), "queue full")
+        if self.predicted_wait_s(ahead) > self.queue_timeout_s:
+            self.rejected += 1
+            raise Overloaded(503, self.retry_after(), "predicted wait exceeds deadline")
+
+    def _lower_priority_waiter(self, priority: int) -> bool:
+        return any(p > priority and not fut.done() for p, _, fut in self._waiters)
+
+    def _shed_one_below(self, priority: int) -> None:
+        # Newest waiter of the lowest priority makes room for more important work
+        victims = [w for w in self._waiters if w[0] > priority and not w[2].done()]
+        if not victims:
+            return
+        victim = max(victims, key=lambda w: (w[0], w[1]))
+        self.rejected += 1
+        victim[2].set_exception(Overloaded(503, self.retry_after(), "shed for higher-priority request"))
+
+    async def acquire(self, priority: int = PRIORITY_CHAT) -> None:
+        if self._inflight < self.max_inflight and not self._queued():
+            self._inflight += 1
+            self.admitted += 1
+            return
+
+        if self._queued() >= self.max_queue:
+            if not self._lower_priority_waiter(priority):
+                self.rejected += 1
+                raise Overloaded(429, self.retry_after(), "queue full")
+            self._shed_one_below(priority)
+
+        ahead = sum(1 for p, _, fut in self._waiters if not fut.done() and p <= priority)
+        if self.predicted_wait_s(ahead) > self.queue_timeout_s:
+            self.rejected += 1
+            raise Overloaded(503, self.retry_after(), "predicted wait exceeds deadline")
+
+        if len(self._waiters) > 2 * max(1, self.max_queue):
+            self._waiters = [w for w in self._waiters if not w[2].done()]
+            heapq.heapify(self._waiters)
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                # Slot was handed over just as the deadline hit; give it back
+                self._release_slot()
+            else:
+                fut.cancel()
+            self.expired += 1
+            raise Overloaded(503, self.retry_after(), "queue deadline exceeded")
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                self._release_slot()
+            else:
+                fut.cancel()
+            raise
+        self.admitted += 1
+
+    def _release_slot(self) -> None:
+        # Hand the slot straight to the best live waiter, else free it
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._inflight -= 1
+
+    def release(self, service_s: float) -> None:
+        self._service_s = 0.8 * self._service_s + 0.2 * max(0.0, service_s)
+        self._release_slot()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_CHAT):
+        await self.acquire(priority)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - t0)
+
+
+admission = AdmissionController()
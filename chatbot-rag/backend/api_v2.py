@@ -1,19 +1,34 @@
 ﻿import os
+import hmac
 import logging
 import json
+import asyncio
 import chain_v2 # The core module
+from contextlib import asynccontextmanager
 from typing import Optional
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
 from dotenv import load_dotenv
+from admission import admission, Overloaded, PRIORITY_CHAT, PRIORITY_STREAM
+from deadline import Deadline, RequestCancelled
+import metrics
+import profiling
 
 # Import auth logic
 from auth import (
     create_user, authenticate_user, create_access_token, 
-    generate_verification_code, send_verification_email, verify_code, load_users
+    generate_verification_code, store_verification_code, mail_verification_code, discard_verification_code, verify_code, user_exists,
+    authenticate_user_async, create_user_async, PasswordPoolBusy, password_pool_stats,
+    verify_access_token, revoke_token, TokenInvalid, token_cache_stats,
+    check_verification_rate, RateLimited
 )
+from code_store import get_code_store
+from mailer import mailer, MailQueueFull
+from conversation import memory
+from negative_cache import negative_cache
 
 load_dotenv()
 
@@ -22,14 +37,126 @@ logger = logging.getLogger('api_v2')
 
 app = FastAPI(title='RAG Chatbot – V2')
 
+# Seconds to wait after startup before the model warm-up thread begins
+WARMUP_DELAY_S = float(os.getenv("WARMUP_DELAY_S", "0.5"))
+# Shared secret for /admin/* (X-Admin-Token); admin endpoints are off when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# How often a running chat request checks whether its client went away
+DISCONNECT_POLL_S = float(os.getenv("DISCONNECT_POLL_S", "0.25"))
+CLIENT_DISCONNECTED = "client disconnected"
+# REQUIRE_AUTH=1: /api/chat* need a bearer token. Otherwise a token is optional
+# (anonymous chat still works) but an invalid one is rejected.
+REQUIRE_AUTH = os.getenv("REQUIRE_AUTH", "0") == "1"
+
 # --- INITIALIZATION ---
-# This runs once when the script starts to ensure the chain is ready
+# Startup returns immediately so uvicorn can bind its port; the embeddings,
+# index and LLMs load on a background thread (see chain_v2.state.phase).
 @app.on_event("startup")
 async def startup_event():
     logger.info("🚀 Starting up API server...")
-    # This updates the rag_chain inside the chain_v2 module
-    chain_v2.initialize_global_vars()
-    logger.info("✅ RAG chain initialized and ready for requests.")
+    asyncio.get_running_loop().call_later(WARMUP_DELAY_S, chain_v2.start_background_warmup)
+    profiling.install_signal_handler()
+    get_code_store().start_sweeper()
+    await mailer.start()
+    logger.info("⏳ RAG warm-up scheduled in %.1fs; /health reports progress.", WARMUP_DELAY_S)
+
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await mailer.stop()
+
+def _require_ready():
+    """503 with Retry-After while the chain is still warming up (or failed)."""
+    st = chain_v2.state
+    if st.ready and chain_v2.rag_chain is not None:
+        return
+    raise HTTPException(
+        status_code=503,
+        detail=f"RAG system not ready (phase={st.phase})",
+        headers={"Retry-After": "5"},
+    )
+
+
+def _overloaded(e: Overloaded) -> HTTPException:
+    logger.warning("🚦 [Admission] Rejected (%s): %s", e.status_code, e.reason)
+    return HTTPException(
+        status_code=e.status_code,
+        detail=f"Server busy ({e.reason}); retry later",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+async def _cancel_on_disconnect(request: Request, deadline: Deadline) -> None:
+    while not deadline.done:
+        if await request.is_disconnected():
+            deadline.cancel(CLIENT_DISCONNECTED)
+            return
+        await asyncio.sleep(DISCONNECT_POLL_S)
+
+
+@asynccontextmanager
+async def _request_deadline(request: Request):
+    """
+    Deadline (REQUEST_TIMEOUT_S) for one chat request, cancelled when the client
+    disconnects or the handler exits early, so the worker thread running the
+    chain stops at its next check instead of generating for nobody.
+    """
+    deadline = Deadline()
+    watcher = asyncio.create_task(_cancel_on_disconnect(request, deadline))
+    try:
+        yield deadline
+    finally:
+        deadline.cancel("request finished")
+        watcher.cancel()
+
+
+def _bearer_token(request: Request) -> Optional[str]:
+    header = request.headers.get("authorization", "")
+    scheme, _, token = header.partition(" ")
+    if scheme.lower() == "bearer" and token.strip():
+        return token.strip()
+    # EventSource can't set headers, so the stream endpoint also takes ?access_token=
+    return request.query_params.get("access_token") or None
+
+def _verified_claims(token: str) -> dict:
+    try:
+        return verify_access_token(token)
+    except TokenInvalid as e:
+        raise HTTPException(status_code=401, detail=f"Invalid token: {e}", headers={"WWW-Authenticate": "Bearer"})
+
+def current_user(request: Request) -> dict:
+    """Dependency: the verified token claims ({'sub', 'role', 'exp'}); 401 without a valid token."""
+    token = _bearer_token(request)
+    if token is None:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    return _verified_claims(token)
+
+def chat_user(request: Request) -> Optional[dict]:
+    """Dependency for chat endpoints: like current_user, but None for anonymous callers unless REQUIRE_AUTH."""
+    if REQUIRE_AUTH or _bearer_token(request) is not None:
+        return current_user(request)
+    return None
+
+def _cancelled(e: RequestCancelled) -> HTTPException:
+    logger.info("⏹️ [Chat] Stopped early: %s", e.reason)
+    if e.reason.startswith(CLIENT_DISCONNECTED):
+        # Nobody is listening; 499 only shows up in access logs
+        return HTTPException(status_code=499, detail="Client closed request")
+    return HTTPException(status_code=504, detail="Request deadline exceeded")
+
+# --- METRICS ---
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    t0 = asyncio.get_running_loop().time()
+    response = await call_next(request)
+    # Route template (not the raw path) keeps label cardinality bounded;
+    # for streams this is time to response headers.
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.HTTP_SECONDS.observe(
+        asyncio.get_running_loop().time() - t0, route=route, status=response.status_code
+    )
+    return response
 
 # --- CORS ---
 app.add_middleware(
@@ -73,46 +200,118 @@ def health():
     """Checks the live state of the module-level variables."""
     return {
         "ok": True,
+        "pid": os.getpid(),
+        **chain_v2.state.snapshot(),
         "initialized": chain_v2.state.initialized,
         "model_loaded": chain_v2.state.model_loaded,
         "rag_chain_is_none": chain_v2.rag_chain is None,
         "retriever_is_none": chain_v2.retriever is None,
-        "vectorstore_is_none": chain_v2.vectorstore is None
+        "vectorstore_is_none": chain_v2.vectorstore is None,
+        "cpu_pools": chain_v2.resources.describe(),
+        "admission": admission.stats(),
+        "password_pool": password_pool_stats(),
+        "token_cache": token_cache_stats(),
+        "mail": mailer.queue_stats(),
+        "sessions": memory.stats(),
+    }
+
+@app.get('/metrics')
+def prometheus_metrics():
+    """Stage latency histograms and counters in Prometheus text format."""
+    adm = admission.stats()
+    gauges = {
+        "rag_ready": 1.0 if chain_v2.state.ready else 0.0,
+        "rag_admission_inflight": adm["inflight"],
+        "rag_admission_queued": adm["queued"],
+        "rag_admission_service_seconds": adm["service_time_s"],
+        "rag_password_ops_pending": password_pool_stats()["pending"],
+        "rag_negative_cache_entries": len(negative_cache),
     }
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+def _require_admin(token: Optional[str]) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+@app.post('/admin/profile')
+async def admin_profile(
+    seconds: float = Query(profiling.PROFILE_SECONDS, gt=0, le=profiling.PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(profiling.PROFILE_INTERVAL_MS, ge=1, le=1000),
+    torch: bool = Query(False, description="also trace generations with torch.profiler"),
+    wait: bool = Query(True, description="block until the profile is written"),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """Sample this worker's Python stacks for `seconds` and write speedscope/flamegraph files."""
+    _require_admin(x_admin_token)
+    try:
+        session = profiling.start(seconds=seconds, interval_ms=interval_ms, torch_ops=torch)
+    except profiling.ProfileBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not wait:
+        return {"pid": os.getpid(), "status": "started", "seconds": session.seconds, "base": session.base}
+    await asyncio.to_thread(session.done.wait)
+    return {"pid": os.getpid(), "status": "done", **session.result}
 
 @app.post('/api/chat')
-async def chat(req: ChatRequest):
+async def chat(req: ChatRequest, request: Request, user: Optional[dict] = Depends(chat_user)):
+    _require_ready()
     try:
-        # Access through the module to see the initialized object
-        if chain_v2.rag_chain is None:
-            raise HTTPException(status_code=503, detail="RAG system not initialized")
-        
-        # Invoke the chain
-        answer = chain_v2.rag_chain.invoke(req.question)
+        async with _request_deadline(request) as deadline:
+            async with admission.slot(PRIORITY_CHAT):
+                # Invoke the chain off the event loop
+                answer = await run_in_threadpool(
+                    chain_v2.rag_chain.invoke, req.question, deadline, user["sub"] if user else None
+                )
         return {"answer": answer}
+    except Overloaded as e:
+        raise _overloaded(e)
+    except RequestCancelled as e:
+        raise _cancelled(e)
     except Exception as e:
         logger.error(f"Chat error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal chatbot error: {str(e)}")
 
 @app.get('/api/chat/stream')
-async def chat_stream(question: str = Query(...)):
+async def chat_stream(request: Request, question: str = Query(...), user: Optional[dict] = Depends(chat_user)):
+    # Shed before the stream opens so overflow gets a real 429/503 status;
+    # once open, the session waits with stream priority.
+    try:
+        admission.check(PRIORITY_STREAM)
+    except Overloaded as e:
+        raise _overloaded(e)
+
     async def event_generator():
         try:
             logger.info(f"🔍 [Stream] Question: {question}")
             
             # Use module-level reference
-            if chain_v2.rag_chain is None:
-                logger.error("❌ [Stream] RAG chain is None!")
-                yield f"data: {json.dumps({'type': 'error', 'message': 'RAG system not initialized'})}\n\n"
+            if not chain_v2.state.ready or chain_v2.rag_chain is None:
+                logger.error("❌ [Stream] RAG chain not ready (phase=%s)", chain_v2.state.phase)
+                msg = f'RAG system not ready (phase={chain_v2.state.phase})'
+                yield f"data: {json.dumps({'type': 'error', 'message': msg})}\n\n"
                 return
             
             logger.info("🤖 [Stream] Generating response via BitNet...")
-            # LangChain .invoke() call
-            answer = chain_v2.rag_chain.invoke(question)
+            # Starlette cancels this generator on disconnect; leaving the block
+            # cancels the deadline, which stops the chain's worker thread too.
+            async with _request_deadline(request) as deadline:
+                async with admission.slot(PRIORITY_STREAM):
+                    answer = await run_in_threadpool(
+                        chain_v2.rag_chain.invoke, question, deadline, user["sub"] if user else None
+                    )
             
             yield f"data: {json.dumps({'type': 'token', 'text': str(answer)})}\n\n"
             yield f"data: {json.dumps({'type': 'done'})}\n\n"
             
+        except Overloaded as e:
+            logger.warning("🚦 [Stream] Shed after opening: %s", e.reason)
+            yield f"data: {json.dumps({'type': 'error', 'message': 'Server busy; retry later', 'retry_after': e.retry_after})}\n\n"
+        except RequestCancelled as e:
+            logger.info("⏹️ [Stream] Stopped early: %s", e.reason)
+            yield f"data: {json.dumps({'type': 'error', 'message': 'Request cancelled: ' + e.reason})}\n\n"
         except Exception as e:
             logger.error(f"💥 [Stream] Error: {str(e)}", exc_info=True)
             yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
@@ -120,28 +319,65 @@ async def chat_stream(question: str = Query(...)):
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 # --- AUTH ENDPOINTS (Kept as is) ---
+def _mail_queue_full() -> HTTPException:
+    return HTTPException(status_code=503, detail='Mail queue full; retry shortly', headers={'Retry-After': '5'})
+
 @app.post('/api/send-verification-code')
-async def send_code(req: SendCodeRequest):
-    users = load_users()
-    if req.email in users: raise HTTPException(status_code=400, detail='Email registered')
+async def send_code(req: SendCodeRequest, request: Request):
+    # Refuse before spending rate-limit tokens or storing a code nobody will receive
+    if mailer.full(): raise _mail_queue_full()
+    # The code store and user lookups are blocking SQLite calls (BEGIN IMMEDIATE
+    # can wait out busy_timeout), so they run on the threadpool, not the loop.
+    try:
+        await run_in_threadpool(check_verification_rate, req.email, request.client.host if request.client else None)
+    except RateLimited as e:
+        logger.warning("🚦 [Auth] %s", e)
+        raise HTTPException(status_code=429, detail='Too many code requests', headers={'Retry-After': str(max(1, int(e.retry_after + 0.999)))})
+    if await run_in_threadpool(user_exists, req.email): raise HTTPException(status_code=400, detail='Email registered')
     code = generate_verification_code(req.email)
-    send_verification_email(req.email, code)
+    await run_in_threadpool(store_verification_code, req.email, code)
+    try:
+        mail_verification_code(req.email, code)
+    except MailQueueFull:
+        await run_in_threadpool(discard_verification_code, req.email)
+        raise _mail_queue_full()
     return {'message': 'Sent'}
 
 @app.post('/api/verify-code')
 async def verify_v_code(req: VerifyCodeRequest):
-    if not verify_code(req.email, req.code): raise HTTPException(status_code=400, detail='Invalid')
+    if not await run_in_threadpool(verify_code, req.email, req.code): raise HTTPException(status_code=400, detail='Invalid')
     return {'message': 'Verified'}
 
+def _password_busy(e: PasswordPoolBusy) -> HTTPException:
+    logger.warning("🚦 [Auth] Password pool saturated: %s", e)
+    return HTTPException(status_code=503, detail="Too many sign-ins right now; retry shortly", headers={"Retry-After": "2"})
+
 @app.post('/api/register')
 async def register(user: UserRegister):
-    if not create_user(user.email, user.password, user.role): raise HTTPException(status_code=400)
+    try:
+        created = await create_user_async(user.email, user.password, user.role)
+    except PasswordPoolBusy as e:
+        raise _password_busy(e)
+    if not created: raise HTTPException(status_code=400)
     access_token = create_access_token(data={'sub': user.email, 'role': user.role})
     return {'access_token': access_token, 'token_type': 'bearer', 'email': user.email, 'role': user.role}
 
 @app.post('/api/login', response_model=Token)
 async def login(user: UserLogin):
-    auth_user = authenticate_user(user.email, user.password)
+    try:
+        auth_user = await authenticate_user_async(user.email, user.password)
+    except PasswordPoolBusy as e:
+        raise _password_busy(e)
     if not auth_user: raise HTTPException(status_code=401)
     access_token = create_access_token(data={'sub': user.email, 'role': auth_user['role']})
-    return {'access_token': access_token, 'token_type': 'bearer', 'email': user.email, 'role': auth_user['role']}
\ No newline at end of file
+    return {'access_token': access_token, 'token_type': 'bearer', 'email': user.email, 'role': auth_user['role']}
+
+@app.post('/api/logout')
+async def logout(request: Request, claims: dict = Depends(current_user)):
+    await run_in_threadpool(revoke_token, _bearer_token(request))
+    return {'message': 'Logged out'}
+
+@app.get('/api/me')
+async def me(claims: dict = Depends(current_user)):
+    return {'email': claims['sub'], 'role': claims.get('role', 'user')}
+
@@ -1,11 +1,24 @@
 from passlib.context import CryptContext
-import json
 import os
+import time
 import random
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Dict, Any, Tuple
 from jose import JWTError, jwt
 from dotenv import load_dotenv
+from user_store import get_user_store
+from code_store import get_code_store, check_rate, RateLimited, VERIFICATION_CODE_TTL_S
+from revocation_store import get_revocation_store
+from mailer import mailer
+from metrics import TOKEN_CACHE_HITS, TOKEN_CACHE_MISSES
+
+logger = logging.getLogger("RAG_AUTH")
 
 # Load variables from .env file if it exists
 load_dotenv()
@@ -15,13 +28,32 @@ load_dotenv()
 SECRET_KEY = os.getenv("JWT_SECRET", "fallback-key-for-dev")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
-USERS_FILE = "users.json"
+# Verified tokens kept decoded (keyed by digest) so a session's repeat requests
+# skip the HMAC check and JSON decode; entries still honour their own `exp`.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+# Revocations are shared through SQLite (revocation_store). A cache miss asks
+# the table directly; cache hits use a local mirror refreshed at most this often,
+# so a logout on another worker takes effect here within REVOCATION_SYNC_S.
+REVOCATION_SYNC_S = float(os.getenv("REVOCATION_SYNC_S", "2"))
 
 # Initialize CryptContext for secure password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-# Temporary storage for verification codes
-verification_codes = {}
+# bcrypt costs ~100-300ms of CPU per hash/verify. The async endpoints run it on
+# this small pool (bcrypt releases the GIL, so threads run it in parallel) and
+# shed load once PASSWORD_MAX_PENDING operations are queued, so a login storm
+# can use at most PASSWORD_WORKERS cores and never blocks the event loop.
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", "2"))
+PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", "32"))
+_password_pool = ThreadPoolExecutor(max_workers=max(1, PASSWORD_WORKERS), thread_name_prefix="bcrypt")
+_password_pending = 0
+_password_lock = threading.Lock()
+
+
+class PasswordPoolBusy(Exception):
+    """Too many password operations queued; the caller should answer 503."""
+
+# Verification codes live in code_store (SQLite, shared by workers, with TTLs)
 
 # --- 2. VERIFICATION HELPERS ---
 
@@ -29,19 +61,39 @@ def generate_verification_code(email: str = None):
     """Generates a random 6-digit code."""
     return str(random.randint(100000, 999999))
 
+def check_verification_rate(email: str, ip: Optional[str] = None):
+    """Per-email and per-IP token buckets; raises RateLimited when either is empty."""
+    check_rate(email, ip)
+
+def store_verification_code(email: str, code: str):
+    """Saves the code with its TTL. Blocking SQLite write: keep it off the event loop."""
+    get_code_store().put(email, code)
+
+def mail_verification_code(email: str, code: str):
+    """Queues the email (see mailer.py); returns without waiting for delivery."""
+    mailer.send(
+        email,
+        "Your Teen Zen verification code",
+        f"Your verification code is {code}. It expires in {int(VERIFICATION_CODE_TTL_S // 60)} minutes.",
+    )
+
+def discard_verification_code(email: str):
+    """Drops a stored code whose email could not be queued."""
+    get_code_store().discard(email)
+
 def send_verification_email(email: str, code: str):
-    """Stores the code and prints it to the terminal for development."""
-    verification_codes[email] = code
-    print(f"\n[EMAIL SIMULATION] To: {email} | Code: {code}\n")
+    """Stores the code and queues the email; returns without waiting for delivery."""
+    store_verification_code(email, code)
+    try:
+        mail_verification_code(email, code)
+    except Exception:
+        discard_verification_code(email)
+        raise
     return True
 
 def verify_code(email: str, code: str):
-    """Checks if the provided code matches the one stored."""
-    stored_code = verification_codes.get(email)
-    if stored_code and stored_code == code:
-        del verification_codes[email]
-        return True
-    return False
+    """Checks if the provided code matches the one stored (and has not expired)."""
+    return get_code_store().check(email, code)
 
 # --- 3. PASSWORD HELPERS ---
 
@@ -55,52 +107,183 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 # --- 4. DATA PERSISTENCE ---
 
+# Users live in user_store (SQLite by default); these two are kept for scripts.
+
 def load_users():
-    """Loads users from the JSON file."""
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'r') as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return {}
-    return {}
+    """Returns every user keyed by email (full scan; request paths use user_exists)."""
+    return get_user_store().all_users()
 
 def save_users(users):
-    """Saves the user dictionary to the JSON file."""
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=2)
+    """Writes the given users into the store (insert or update each)."""
+    store = get_user_store()
+    for email, user in users.items():
+        store.upsert({"email": email, **user})
+
+def user_exists(email: str) -> bool:
+    """Indexed lookup by email."""
+    return get_user_store().exists(email)
 
 # --- 5. CORE AUTH LOGIC ---
 
 def create_user(email: str, password: str, role: str = "user"):
-    """Validates and saves a new user to users.json."""
-    users = load_users()
-    if email in users:
+    """Validates and saves a new user; None if the email is already registered."""
+    store = get_user_store()
+    if store.exists(email):
         return None
-    
-    users[email] = {
+
+    # The insert is atomic: of two racing registrations exactly one wins
+    created = store.create({
         "email": email,
         "hashed_password": get_password_hash(password),
         "role": role,
         "created_at": datetime.now().isoformat()
-    }
-    save_users(users)
+    })
+    if not created:
+        return None
     return {"email": email, "role": role}
 
 def authenticate_user(email: str, password: str):
     """Checks credentials for login."""
-    users = load_users()
-    if email not in users:
+    user = get_user_store().get(email)
+    if user is None:
         return None
-    
-    user = users[email]
+
     if not verify_password(password, user["hashed_password"]):
         return None
     return {"email": email, "role": user["role"]}
 
+# --- 6. ASYNC WRAPPERS (bcrypt off the event loop) ---
+
+async def _run_password_op(fn, *args):
+    global _password_pending
+    with _password_lock:
+        if _password_pending >= PASSWORD_MAX_PENDING:
+            raise PasswordPoolBusy(f"{_password_pending} password operations pending")
+        _password_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_password_pool, fn, *args)
+    finally:
+        with _password_lock:
+            _password_pending -= 1
+
+async def authenticate_user_async(email: str, password: str):
+    """authenticate_user() on the bcrypt pool; raises PasswordPoolBusy when saturated."""
+    return await _run_password_op(authenticate_user, email, password)
+
+async def create_user_async(email: str, password: str, role: str = "user"):
+    """create_user() on the bcrypt pool; raises PasswordPoolBusy when saturated."""
+    return await _run_password_op(create_user, email, password, role)
+
+def password_pool_stats():
+    return {"workers": max(1, PASSWORD_WORKERS), "pending": _password_pending, "max_pending": PASSWORD_MAX_PENDING}
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Generates a JWT token for the session."""
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
\ No newline at end of file
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+# --- 7. TOKEN VERIFICATION ---
+
+class TokenInvalid(Exception):
+    """Missing, malformed, expired, revoked or wrongly signed access token."""
+
+_token_cache: "OrderedDict[bytes, Tuple[Dict[str, Any], float]]" = OrderedDict()
+# digest -> exp; local mirror of revocation_store, entries drop out once the token would have expired anyway
+_revoked: Dict[bytes, float] = {}
+_revoked_cursor = 0
+_revoked_synced_at = 0.0
+_token_lock = threading.Lock()
+_token_hits = 0
+_token_misses = 0
+
+def _token_digest(token: str) -> bytes:
+    return hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+
+def _sync_revocations(now: float) -> None:
+    """Pull revocations made by any process since the last sync into _revoked."""
+    global _revoked_cursor, _revoked_synced_at
+    if now - _revoked_synced_at < REVOCATION_SYNC_S:
+        return
+    _revoked_synced_at = now
+    try:
+        rows, cursor = get_revocation_store().since(_revoked_cursor)
+    except Exception as e:
+        logger.warning("⚠️ [Auth] Revocation sync failed: %s", e)
+        return
+    with _token_lock:
+        for digest, exp in rows:
+            _revoked[digest] = exp
+            _token_cache.pop(digest, None)
+        _revoked_cursor = max(_revoked_cursor, cursor)
+        for d in [d for d, exp in _revoked.items() if exp <= now]:
+            del _revoked[d]
+
+def verify_access_token(token: str) -> Dict[str, Any]:
+    """Returns the token's claims; raises TokenInvalid. Cached after the first full check."""
+    global _token_hits, _token_misses
+    if not token:
+        raise TokenInvalid("missing token")
+    digest = _token_digest(token)
+    now = time.time()
+    _sync_revocations(now)
+    with _token_lock:
+        if digest in _revoked:
+            raise TokenInvalid("token revoked")
+        hit = _token_cache.get(digest)
+        if hit is not None:
+            claims, exp = hit
+            if exp > now:
+                _token_cache.move_to_end(digest)
+                _token_hits += 1
+                TOKEN_CACHE_HITS.inc()
+                return dict(claims)
+            del _token_cache[digest]
+
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError as e:
+        raise TokenInvalid(str(e))
+    if not claims.get("sub"):
+        raise TokenInvalid("token has no subject")
+    exp = float(claims.get("exp") or now + ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+    # Not in the mirror yet; the shared table is authoritative
+    if get_revocation_store().is_revoked(digest):
+        with _token_lock:
+            _revoked[digest] = exp
+        raise TokenInvalid("token revoked")
+
+    with _token_lock:
+        _token_misses += 1
+        TOKEN_CACHE_MISSES.inc()
+        # Re-check: the token may have been revoked while it was being decoded
+        if digest in _revoked:
+            raise TokenInvalid("token revoked")
+        if TOKEN_CACHE_SIZE > 0:
+            _token_cache[digest] = (claims, exp)
+            _token_cache.move_to_end(digest)
+            while len(_token_cache) > TOKEN_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+    return dict(claims)
+
+def revoke_token(token: str) -> bool:
+    """Rejects this token from now on, in every process sharing the database. False if it was not valid anyway."""
+    try:
+        claims = verify_access_token(token)
+    except TokenInvalid:
+        return False
+    digest = _token_digest(token)
+    now = time.time()
+    exp = float(claims.get("exp") or now + ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+    get_revocation_store().revoke(digest, exp)
+    with _token_lock:
+        _token_cache.pop(digest, None)
+        _revoked[digest] = exp
+        for d in [d for d, e in _revoked.items() if e <= now]:
+            del _revoked[d]
+    return True
+
+def token_cache_stats():
+    return {"size": len(_token_cache), "hits": _token_hits, "misses": _token_misses, "revoked": len(_revoked)}
+
@@ -0,0 +1,366 @@
+"""
+Per-component speed / peak-memory micro-benchmarks for modeling_bitnet.
+
+    python benchmarks/bench_bitnet.py --preset small --seqs 1,512,2048 --out bitnet.json
+    python benchmarks/bench_bitnet.py --compare before.json after.json
+
+Times BitLinear, BitnetRMSNorm, BitnetRotaryEmbedding, BitnetMLP,
+BitnetAttention and a full BitnetDecoderLayer at decode (seq=1, attending
+over a --context token KV cache) and prefill shapes. Modules are built from a
+randomly initialised BitnetConfig, so no weights are downloaded; "3b" uses the
+real per-layer sizes of bitnet_b1_58-3b. Each case reports median / mean / p90
+time over --repeat runs (after --warmup) and the peak memory one forward pass
+adds on top of the module and its inputs. Peak memory is probed in a fresh
+child process per case (VmHWM with malloc's mmap threshold pinned low on CPU,
+max_memory_allocated on CUDA) so allocator reuse in the timing process can't
+hide it; --no-memory skips the probes.
+"""
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import importlib
+import ctypes
+import statistics
+import subprocess
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+import torch
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_DIR = os.path.join(BACKEND_DIR, "models", "bitnet_b1_58-3b")
+MB = 1024 * 1024
+
+PRESETS: Dict[str, Dict[str, Any]] = {
+    "tiny": {"hidden_size": 256, "intermediate_size": 688, "num_attention_heads": 4},
+    "small": {"hidden_size": 1024, "intermediate_size": 2752, "num_attention_heads": 16},
+    "3b": {"hidden_size": 3200, "intermediate_size": 8640, "num_attention_heads": 32},
+}
+COMPONENTS = ("bitlinear", "rmsnorm", "rotary", "mlp", "attention", "decoder_layer")
+
+
+def _load_bitnet():
+    """Import the model directory (not a valid package name) as package `bitnet_model`."""
+    name = "bitnet_model"
+    pkg = sys.modules.get(name)
+    if pkg is None:
+        # The directory has no __init__.py; a bare package module is all its relative imports need
+        pkg = types.ModuleType(name)
+        pkg.__path__ = [MODEL_DIR]
+        sys.modules[name] = pkg
+        for sub in ("configuration_bitnet", "utils_quant", "modeling_bitnet"):
+            setattr(pkg, sub, importlib.import_module(f"{name}.{sub}"))
+    return pkg
+
+
+def make_config(preset: str, max_positions: int):
+    bitnet = _load_bitnet()
+    sizes = PRESETS[preset]
+    cfg = bitnet.configuration_bitnet.BitnetConfig(
+        vocab_size=32002,
+        num_hidden_layers=1,
+        num_key_value_heads=sizes["num_attention_heads"],
+        max_position_embeddings=max_positions,
+        rms_norm_eps=1e-5,
+        **sizes,
+    )
+    # Eager attention: the path the CPU service actually runs
+    cfg._attn_implementation = "eager"
+    return cfg
+
+
+# ------------------------------------------------------------------------------
+# Peak memory
+# ------------------------------------------------------------------------------
+def _vm_kb(field: str) -> Optional[int]:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _pin_mmap_threshold() -> None:
+    # Every tensor buffer above 64 KiB gets its own mapping and is unmapped on
+    # free, so RSS follows live tensors and VmHWM is a true peak. Probe only:
+    # the extra mmap/munmap calls would distort timings.
+    try:
+        libc = ctypes.CDLL("libc.so.6")
+        M_TRIM_THRESHOLD, M_MMAP_THRESHOLD = -1, -3
+        libc.mallopt(M_MMAP_THRESHOLD, 64 * 1024)
+        libc.mallopt(M_TRIM_THRESHOLD, 64 * 1024)
+    except OSError:
+        pass
+
+
+def _reset_peak(device: str) -> Optional[int]:
+    if device == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        return torch.cuda.memory_allocated()
+    try:
+        # "5" resets VmHWM (peak RSS) to the current RSS (Linux >= 4.0)
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return None
+    rss = _vm_kb("VmRSS")
+    return rss * 1024 if rss is not None else None
+
+
+def _peak_delta(device: str, base: Optional[int]) -> Optional[int]:
+    if base is None:
+        return None
+    if device == "cuda":
+        torch.cuda.synchronize()
+        return torch.cuda.max_memory_allocated() - base
+    hwm = _vm_kb("VmHWM")
+    return max(0, hwm * 1024 - base) if hwm is not None else None
+
+
+# ------------------------------------------------------------------------------
+# Cases: each builds (module, setup) where setup() returns fresh forward kwargs
+# ------------------------------------------------------------------------------
+def _causal_mask(q_len: int, kv_len: int, dtype, device) -> torch.Tensor:
+    mask = torch.full((q_len, kv_len), torch.finfo(dtype).min, dtype=dtype, device=device)
+    mask = torch.triu(mask, diagonal=kv_len - q_len + 1)
+    return mask[None, None, :, :]
+
+
+def _kv_cache(cfg, context: int, batch: int, dtype, device):
+    from transformers.cache_utils import DynamicCache
+
+    head_dim = cfg.hidden_size // cfg.num_attention_heads
+    cache = DynamicCache()
+    if context > 0:
+        shape = (batch, cfg.num_key_value_heads, context, head_dim)
+        cache.update(torch.randn(shape, dtype=dtype, device=device), torch.randn(shape, dtype=dtype, device=device), 0)
+    return cache
+
+
+def build_case(
+    component: str, cfg, seq: int, context: int, batch: int, dtype, device
+) -> Tuple[torch.nn.Module, Callable[[], Dict[str, Any]]]:
+    bitnet = _load_bitnet()
+    m = bitnet.modeling_bitnet
+    hidden = cfg.hidden_size
+    head_dim = hidden // cfg.num_attention_heads
+    # Decode attends over a KV cache of `context` tokens; prefill starts from empty
+    past = context if seq == 1 else 0
+
+    def hidden_states(width: int = hidden) -> torch.Tensor:
+        return torch.randn(batch, seq, width, dtype=dtype, device=device)
+
+    def positions() -> torch.Tensor:
+        return torch.arange(past, past + seq, device=device).unsqueeze(0).expand(batch, -1)
+
+    if component == "bitlinear":
+        module = bitnet.utils_quant.BitLinear(
+            hidden, cfg.intermediate_size, bias=False, weight_bits=cfg.weight_bits, input_bits=cfg.input_bits
+        )
+        setup = lambda: {"input": hidden_states()}
+    elif component == "rmsnorm":
+        module = m.BitnetRMSNorm(hidden, eps=cfg.rms_norm_eps)
+        setup = lambda: {"hidden_states": hidden_states()}
+    elif component == "rotary":
+        module = m.BitnetRotaryEmbedding(head_dim, max_position_embeddings=cfg.max_position_embeddings, base=cfg.rope_theta)
+        setup = lambda: {
+            "x": torch.randn(batch, cfg.num_attention_heads, seq, head_dim, dtype=dtype, device=device),
+            "position_ids": positions(),
+        }
+    elif component == "mlp":
+        module = m.BitnetMLP(cfg)
+        setup = lambda: {"x": hidden_states()}
+    elif component in ("attention", "decoder_layer"):
+        module = m.BitnetAttention(cfg, layer_idx=0) if component == "attention" else m.BitnetDecoderLayer(cfg, 0)
+
+        def setup() -> Dict[str, Any]:
+            # A fresh cache per run: update() appends, so a shared one would grow
+            cache = _kv_cache(cfg, past, batch, dtype, device)
+            mask = _causal_mask(seq, past + seq, dtype, device) if seq > 1 else None
+            return {
+                "hidden_states": hidden_states(),
+                "attention_mask": mask,
+                "position_ids": positions(),
+                "past_key_value": cache,
+                "use_cache": True,
+                "cache_position": torch.arange(past, past + seq, device=device),
+            }
+    else:
+        raise ValueError(f"unknown component {component!r}")
+
+    module = module.to(device=device, dtype=dtype).eval()
+    return module, setup
+
+
+def time_case(module: torch.nn.Module, setup, warmup: int, repeat: int, device: str) -> Dict[str, Any]:
+    def sync() -> None:
+        if device == "cuda":
+            torch.cuda.synchronize()
+
+    with torch.inference_mode():
+        for _ in range(warmup):
+            module(**setup())
+        sync()
+
+        times: List[float] = []
+        for _ in range(repeat):
+            kwargs = setup()
+            sync()
+            t0 = time.perf_counter()
+            module(**kwargs)
+            sync()
+            times.append(time.perf_counter() - t0)
+            del kwargs
+
+    times.sort()
+    return {
+        "median_ms": round(statistics.median(times) * 1000, 4),
+        "mean_ms": round(statistics.fmean(times) * 1000, 4),
+        "min_ms": round(times[0] * 1000, 4),
+        "p90_ms": round(times[min(len(times) - 1, int(len(times) * 0.9))] * 1000, 4),
+    }
+
+
+def probe_peak(module: torch.nn.Module, setup, device: str) -> Optional[float]:
+    """Peak MB of one forward pass; meant to run first thing in a fresh process."""
+    with torch.inference_mode():
+        kwargs = setup()
+        base = _reset_peak(device)
+        module(**kwargs)
+        peak = _peak_delta(device, base)
+    return round(peak / MB, 2) if peak is not None else None
+
+
+def _spawn_probe(args: argparse.Namespace, component: str, seq: int) -> Optional[float]:
+    cmd = [
+        sys.executable, os.path.abspath(__file__),
+        "--probe", f"{component}:{seq}",
+        "--preset", args.preset,
+        "--seqs", args.seqs,
+        "--context", str(args.context),
+        "--batch", str(args.batch),
+        "--dtype", args.dtype,
+        "--device", args.device,
+        "--threads", str(args.threads),
+        "--seed", str(args.seed),
+    ]
+    try:
+        out = subprocess.run(cmd, capture_output=True, text=True, timeout=600, check=True).stdout
+        return json.loads(out.strip().splitlines()[-1])["peak_mem_mb"]
+    except Exception as e:
+        print(f"    (memory probe for {component} seq={seq} failed: {e})")
+        return None
+
+
+# ------------------------------------------------------------------------------
+# CLI
+# ------------------------------------------------------------------------------
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(old_path: str, new_path: str) -> None:
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    prev = {(c["component"], c["seq"]): c for c in old.get("cases", [])}
+    for c in new.get("cases", []):
+        p = prev.get((c["component"], c["seq"]))
+        if p is None:
+            continue
+        a, b = p["median_ms"], c["median_ms"]
+        pct = (b - a) / a * 100 if a else 0.0
+        mem = f"  peak {p['peak_mem_mb']} -> {c['peak_mem_mb']} MB" if c.get("peak_mem_mb") is not None else ""
+        print(f"{c['component']:14s} seq={c['seq']:<5d} {a:9.3f} -> {b:9.3f} ms ({pct:+.1f}%){mem}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--preset", choices=tuple(PRESETS), default="small")
+    parser.add_argument("--components", default=",".join(COMPONENTS), help="comma-separated subset")
+    parser.add_argument("--seqs", default="1,512,2048", help="1 = decode step; larger = prefill length")
+    parser.add_argument("--context", type=int, default=512, help="KV cache length for decode (seq=1) cases")
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--dtype", choices=("float32", "bfloat16", "float16"), default="float32")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 = torch default)")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="", help="write results as JSON to this path")
+    parser.add_argument("--no-memory", action="store_true", help="skip the per-case peak memory probes")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="diff two result files and exit")
+    parser.add_argument("--probe", default="", help=argparse.SUPPRESS)  # internal: COMPONENT:SEQ
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    torch.manual_seed(args.seed)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    dtype = getattr(torch, args.dtype)
+    seqs = [int(s) for s in args.seqs.split(",") if s.strip()]
+    cfg = make_config(args.preset, max_positions=max(seqs + [args.context + 1]))
+
+    if args.probe:
+        component, seq = args.probe.rsplit(":", 1)
+        if args.device == "cpu":
+            _pin_mmap_threshold()
+        module, setup = build_case(component, cfg, int(seq), args.context, args.batch, dtype, args.device)
+        print(json.dumps({"peak_mem_mb": probe_peak(module, setup, args.device)}))
+        return
+
+    cases = []
+    for component in [c.strip() for c in args.components.split(",") if c.strip()]:
+        for seq in seqs:
+            module, setup = build_case(component, cfg, seq, args.context, args.batch, dtype, args.device)
+            res = time_case(module, setup, args.warmup, args.repeat, args.device)
+            del module
+            tokens = args.batch * seq
+            res.update({
+                "component": component,
+                "seq": seq,
+                "peak_mem_mb": None if args.no_memory else _spawn_probe(args, component, seq),
+                "tokens_per_s": round(tokens / (res["median_ms"] / 1000), 1) if res["median_ms"] > 0 else None,
+            })
+            cases.append(res)
+            print(
+                f"{component:14s} seq={seq:<5d} median={res['median_ms']:9.3f}ms p90={res['p90_ms']:9.3f}ms "
+                f"tok/s={res['tokens_per_s']} peak={res['peak_mem_mb']}MB"
+            )
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "preset": args.preset,
+        "config": {k: getattr(cfg, k) for k in ("hidden_size", "intermediate_size", "num_attention_heads", "num_key_value_heads")},
+        "context": args.context,
+        "batch": args.batch,
+        "dtype": args.dtype,
+        "device": args.device,
+        "threads": torch.get_num_threads(),
+        "torch": torch.__version__,
+        "cases": cases,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Startup time and per-worker memory: prefork.py vs. `uvicorn --workers N`.
+
+    python benchmarks/bench_prefork.py --workers 4 --out prefork.json
+
+Each mode is started from the backend directory, /health is polled until every
+worker (distinct pid) reports ready, then RSS / PSS / USS are read for the
+master and each worker. PSS is the number to compare: shared copy-on-write
+pages are split between the processes that map them.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import subprocess
+import urllib.request
+from typing import Dict, Any, List
+
+import psutil
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 1024 * 1024
+
+
+def _health(port: int) -> Dict[str, Any]:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=2) as r:
+        return json.loads(r.read().decode("utf-8"))
+
+
+def _command(mode: str, workers: int, port: int) -> List[str]:
+    if mode == "prefork":
+        return [sys.executable, "prefork.py", "--workers", str(workers), "--port", str(port)]
+    return [sys.executable, "-m", "uvicorn", "api_v2:app", "--workers", str(workers), "--port", str(port)]
+
+
+def _memory(proc: psutil.Process) -> Dict[str, Any]:
+    info = proc.memory_full_info()
+    return {
+        "pid": proc.pid,
+        "rss_mb": round(info.rss / MB, 1),
+        "pss_mb": round(getattr(info, "pss", 0) / MB, 1),
+        "uss_mb": round(getattr(info, "uss", 0) / MB, 1),
+    }
+
+
+def run(mode: str, workers: int, port: int, timeout: float) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(_command(mode, workers, port), cwd=BACKEND_DIR, start_new_session=True)
+    master = psutil.Process(proc.pid)
+
+    ready_pids = set()
+    first_ready = None
+    try:
+        while len(ready_pids) < workers:
+            if time.perf_counter() - t0 > timeout:
+                raise TimeoutError(f"{mode}: only {len(ready_pids)}/{workers} workers ready after {timeout}s")
+            if proc.poll() is not None:
+                raise RuntimeError(f"{mode}: server exited with {proc.returncode}")
+            try:
+                h = _health(port)
+                if h.get("ready"):
+                    ready_pids.add(h.get("pid"))
+                    first_ready = first_ready or time.perf_counter() - t0
+            except Exception:
+                pass
+            time.sleep(0.05)
+        all_ready = time.perf_counter() - t0
+
+        procs = [master] + master.children(recursive=True)
+        mem = [_memory(p) for p in procs if p.is_running()]
+        worker_pids = {p.pid for p in master.children(recursive=True)} & ready_pids
+        per_worker = [m for m in mem if m["pid"] in worker_pids]
+        return {
+            "mode": mode,
+            "workers": workers,
+            "first_ready_s": round(first_ready, 2),
+            "all_ready_s": round(all_ready, 2),
+            "processes": mem,
+            "per_worker": per_worker,
+            "total_pss_mb": round(sum(m["pss_mb"] for m in mem), 1),
+            "total_rss_mb": round(sum(m["rss_mb"] for m in mem), 1),
+        }
+    finally:
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(timeout=30)
+        except Exception:
+            os.killpg(proc.pid, signal.SIGKILL)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--modes", default="prefork,uvicorn", help="comma-separated: prefork,uvicorn")
+    parser.add_argument("--timeout", type=float, default=900.0)
+    parser.add_argument("--out", default="", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = []
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        res = run(mode, args.workers, args.port, args.timeout)
+        results.append(res)
+        print(
+            f"{mode:8s} workers={res['workers']} first_ready={res['first_ready_s']}s "
+            f"all_ready={res['all_ready_s']}s total_pss={res['total_pss_mb']}MB total_rss={res['total_rss_mb']}MB"
+        )
+        for m in res["per_worker"]:
+            print(f"    pid={m['pid']} rss={m['rss_mb']}MB pss={m['pss_mb']}MB uss={m['uss_mb']}MB")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
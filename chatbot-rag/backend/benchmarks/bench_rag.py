@@ -0,0 +1,420 @@
+"""
+End-to-end latency / quality benchmark for the RAG service.
+
+    # in-process: api_v2.app through TestClient with the local models, no server needed
+    python benchmarks/bench_rag.py --mode inprocess --concurrency 1,2,4 --out before.json
+
+    # against a running api_v2 (start it with HF_HUB_OFFLINE=1 for offline runs)
+    python benchmarks/bench_rag.py --mode http --url http://127.0.0.1:8000 --api stream
+
+    # compare two runs (e.g. two commits)
+    python benchmarks/bench_rag.py --compare before.json after.json
+
+Replays a question corpus (--questions: one per line, or JSONL with a
+"question" field; a small built-in set otherwise) at each concurrency level
+and reports time-to-first-token, latency percentiles, throughput, decode
+tokens/s, fallback rate and "I don't know" rate. Generated-token and
+answer-source counts come from the service's own /metrics, so they are
+exact rather than estimated. Both modes go through api_v2; in-process drives
+the ASGI app directly instead of a server socket.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_QUESTIONS = [
+    "How can I calm down when I feel anxious before a test?",
+    "What are some signs of depression in teens?",
+    "How does sleep affect my mood?",
+    "What is mindfulness and how do I start?",
+    "How can I manage stress from school and friends?",
+    "What are healthy ways to take care of myself?",
+    "What should I do if I have a panic attack?",
+    "How can I talk to my parents about how I feel?",
+    # Off-topic: these should be gated to "I don't know."
+    "What is the capital of Australia?",
+    "How do I change the oil in a car?",
+]
+
+IDK_ANSWERS = {"i don't know.", "i don't know", "i do not know."}
+
+
+# ------------------------------------------------------------------------------
+# Helpers
+# ------------------------------------------------------------------------------
+def load_questions(path: str) -> List[str]:
+    if not path:
+        return list(DEFAULT_QUESTIONS)
+    out: List[str] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                line = str(json.loads(line).get("question", "")).strip()
+            if line:
+                out.append(line)
+    return out
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    s = sorted(values)
+    pos = (len(s) - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (pos - lo)
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    def r(v: Optional[float]) -> Optional[float]:
+        return None if v is None else round(v, 4)
+
+    return {
+        "mean": r(sum(values) / len(values)) if values else None,
+        "p50": r(percentile(values, 50)),
+        "p90": r(percentile(values, 90)),
+        "p95": r(percentile(values, 95)),
+        "p99": r(percentile(values, 99)),
+        "max": r(max(values)) if values else None,
+    }
+
+
+def parse_prometheus(text: str) -> Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]:
+    """name{labels} value lines -> {(name, labels): value}; enough for our own /metrics."""
+    out: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        head, _, value = line.rpartition(" ")
+        name, labels = head, ()
+        if "{" in head:
+            name, _, body = head.partition("{")
+            pairs = []
+            for item in body.rstrip("}").split('",'):
+                if "=" in item:
+                    k, _, v = item.partition("=")
+                    pairs.append((k.strip(), v.strip().strip('"')))
+            labels = tuple(sorted(pairs))
+        try:
+            out[(name, labels)] = float(value)
+        except ValueError:
+            pass
+    return out
+
+
+def counter_deltas(before: Dict, after: Dict) -> Dict[str, float]:
+    """Generated tokens, answer sources and decode time between two metric snapshots."""
+    def total(snap: Dict, name: str, **match: str) -> float:
+        want = set(match.items())
+        return sum(v for (n, labels), v in snap.items() if n == name and want <= set(labels))
+
+    out = {
+        "generated_tokens": total(after, "rag_generated_tokens_total") - total(before, "rag_generated_tokens_total"),
+        "decode_seconds": sum(
+            total(after, "rag_stage_seconds_sum", stage=f"{m}.decode") - total(before, "rag_stage_seconds_sum", stage=f"{m}.decode")
+            for m in ("bitnet", "fallback")
+        ),
+    }
+    for source in ("bitnet", "fallback", "idk"):
+        out[f"answers_{source}"] = total(after, "rag_answers_total", source=source) - total(
+            before, "rag_answers_total", source=source
+        )
+    return out
+
+
+# ------------------------------------------------------------------------------
+# Targets: each returns (ok, status, ttft_s, answer) for one question
+#
+# Both drive api_v2 over HTTP semantics (routing, request parsing, auth,
+# admission control, deadlines, the SSE stream endpoint), so they measure the
+# same code path; in-process just skips the socket.
+# ------------------------------------------------------------------------------
+def read_sse(lines, t0: float) -> Tuple[bool, Optional[float], str]:
+    """Consume /api/chat/stream events -> (ok, ttft_s, answer)."""
+    ttft, parts, ok = None, [], True
+    for line in lines:
+        line = line.strip()
+        if not line.startswith("data:"):
+            continue
+        event = json.loads(line[5:].strip())
+        if event.get("type") == "token":
+            if ttft is None:
+                ttft = time.perf_counter() - t0
+            parts.append(event.get("text", ""))
+        elif event.get("type") == "error":
+            ok = False
+            parts = [event.get("message", "")]
+        elif event.get("type") == "done":
+            break
+    return ok, ttft, "".join(parts).strip()
+
+
+def _auth_headers(token: str) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+
+class InProcessTarget:
+    """
+    api_v2.app through Starlette's TestClient: no server process, but every
+    request goes through the ASGI app exactly as it would over HTTP. The test
+    transport hands the body over once the response completes; the stream
+    endpoint sends the answer as one event right before "done", so TTFT is
+    unaffected.
+    """
+
+    def __init__(self, api: str, timeout: float, token: str = ""):
+        # Never reach for the Hub mid-benchmark
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+        sys.path.insert(0, BACKEND_DIR)
+        os.chdir(BACKEND_DIR)
+
+        from fastapi.testclient import TestClient
+
+        import api_v2
+
+        t0 = time.perf_counter()
+        self.client = TestClient(api_v2.app)
+        self.client.__enter__()  # runs the startup hooks, which schedule the warm-up
+        self.api = api
+        self.headers = _auth_headers(token)
+        deadline = time.monotonic() + timeout
+        while True:
+            health = self.client.get("/health").json()
+            if health.get("ready"):
+                break
+            if health.get("phase") == "failed":
+                raise RuntimeError(f"chain not ready (phase=failed): {health.get('init_error')}")
+            if time.monotonic() >= deadline:
+                raise RuntimeError(f"chain not ready after {timeout:.0f}s (phase={health.get('phase')})")
+            time.sleep(0.5)
+        self.load_s = time.perf_counter() - t0
+
+    def close(self) -> None:
+        self.client.__exit__(None, None, None)
+
+    def snapshot(self) -> Dict:
+        return parse_prometheus(self.client.get("/metrics").text)
+
+    def ask(self, question: str) -> Tuple[bool, int, Optional[float], str]:
+        t0 = time.perf_counter()
+        if self.api == "chat":
+            r = self.client.post("/api/chat", json={"question": question}, headers=self.headers)
+            if r.status_code != 200:
+                return False, r.status_code, None, ""
+            return True, r.status_code, None, r.json().get("answer", "")
+
+        with self.client.stream("GET", "/api/chat/stream", params={"question": question}, headers=self.headers) as r:
+            if r.status_code != 200:
+                return False, r.status_code, None, ""
+            ok, ttft, answer = read_sse(r.iter_lines(), t0)
+            return ok, r.status_code, ttft, answer
+
+
+class HttpTarget:
+    def __init__(self, url: str, api: str, timeout: float, token: str = ""):
+        self.url = url.rstrip("/")
+        self.api = api
+        self.timeout = timeout
+        self.headers = _auth_headers(token)
+        self.load_s = None
+
+    def close(self) -> None:
+        pass
+
+    def snapshot(self) -> Dict:
+        try:
+            with urllib.request.urlopen(self.url + "/metrics", timeout=5) as r:
+                return parse_prometheus(r.read().decode("utf-8"))
+        except Exception:
+            return {}
+
+    def ask(self, question: str) -> Tuple[bool, int, Optional[float], str]:
+        t0 = time.perf_counter()
+        try:
+            if self.api == "chat":
+                req = urllib.request.Request(
+                    self.url + "/api/chat",
+                    data=json.dumps({"question": question}).encode("utf-8"),
+                    headers={"Content-Type": "application/json", **self.headers},
+                )
+                with urllib.request.urlopen(req, timeout=self.timeout) as r:
+                    return True, r.status, None, json.loads(r.read().decode("utf-8")).get("answer", "")
+
+            qs = urllib.parse.urlencode({"question": question})
+            req = urllib.request.Request(f"{self.url}/api/chat/stream?{qs}", headers=self.headers)
+            with urllib.request.urlopen(req, timeout=self.timeout) as r:
+                ok, ttft, answer = read_sse((raw.decode("utf-8") for raw in r), t0)
+                return ok, r.status, ttft, answer
+        except urllib.error.HTTPError as e:
+            return False, e.code, None, ""
+        except Exception as e:
+            return False, 0, None, str(e)
+
+
+# ------------------------------------------------------------------------------
+# Runner
+# ------------------------------------------------------------------------------
+def run_level(target, questions: List[str], concurrency: int, repeat: int) -> Dict[str, Any]:
+    work = [q for _ in range(repeat) for q in questions]
+    before = target.snapshot()
+
+    def one(q: str) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        try:
+            ok, status, ttft, answer = target.ask(q)
+        except Exception as e:
+            ok, status, ttft, answer = False, 0, None, str(e)
+        return {"ok": ok, "status": status, "latency_s": time.perf_counter() - t0, "ttft_s": ttft, "answer": answer}
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        results = list(ex.map(one, work))
+    wall = time.perf_counter() - t0
+    deltas = counter_deltas(before, target.snapshot())
+
+    good = [r for r in results if r["ok"]]
+    for r in good:
+        r["idk"] = r["answer"].strip().lower() in IDK_ANSWERS
+    idk = [r for r in good if r["idk"]]
+    generated = [r for r in good if not r["idk"]]
+    answered_by_model = deltas["answers_bitnet"] + deltas["answers_fallback"]
+    statuses: Dict[str, int] = {}
+    for r in results:
+        if not r["ok"]:
+            statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(good),
+        "error_statuses": statuses,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(good) / wall, 3) if wall > 0 else None,
+        "latency_s": summarize([r["latency_s"] for r in good]),
+        "ttft_s": summarize([r["ttft_s"] for r in good if r["ttft_s"] is not None]),
+        "generated_latency_s": summarize([r["latency_s"] for r in generated]),
+        "idk_rate": round(len(idk) / len(good), 4) if good else None,
+        "fallback_rate": round(deltas["answers_fallback"] / answered_by_model, 4) if answered_by_model else None,
+        "generated_tokens": int(deltas["generated_tokens"]),
+        "decode_tokens_per_s": (
+            round(deltas["generated_tokens"] / deltas["decode_seconds"], 2) if deltas["decode_seconds"] > 0 else None
+        ),
+        "answers": {k[len("answers_"):]: int(v) for k, v in deltas.items() if k.startswith("answers_")},
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(old_path: str, new_path: str) -> None:
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    old_levels = {lvl["concurrency"]: lvl for lvl in old.get("levels", [])}
+
+    def delta(a: Optional[float], b: Optional[float]) -> str:
+        if a is None or b is None:
+            return f"{a} -> {b}"
+        pct = (b - a) / a * 100 if a else 0.0
+        return f"{a:.3f} -> {b:.3f} ({pct:+.1f}%)"
+
+    for lvl in new.get("levels", []):
+        prev = old_levels.get(lvl["concurrency"])
+        if prev is None:
+            continue
+        print(f"c={lvl['concurrency']}")
+        for name, get in (
+            ("latency p50", lambda x: x["latency_s"]["p50"]),
+            ("latency p95", lambda x: x["latency_s"]["p95"]),
+            ("latency p99", lambda x: x["latency_s"]["p99"]),
+            ("ttft p50", lambda x: x["ttft_s"]["p50"]),
+            ("throughput rps", lambda x: x["throughput_rps"]),
+            ("decode tok/s", lambda x: x["decode_tokens_per_s"]),
+            ("fallback rate", lambda x: x["fallback_rate"]),
+            ("idk rate", lambda x: x["idk_rate"]),
+        ):
+            print(f"    {name:15s} {delta(get(prev), get(lvl))}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", choices=("inprocess", "http"), default="inprocess")
+    parser.add_argument("--api", choices=("chat", "stream"), default="stream", help="non-streaming invoke or streamed answer")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--questions", default="", help="text file (one per line) or JSONL with a question field")
+    parser.add_argument("--concurrency", default="1,2,4", help="comma-separated sweep")
+    parser.add_argument("--repeat", type=int, default=1, help="passes over the corpus per level")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed requests before the sweep")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--token", default=os.getenv("BENCH_TOKEN", ""), help="bearer token (needed with REQUIRE_AUTH=1)")
+    parser.add_argument("--out", default="", help="write results as JSON to this path")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="diff two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    questions = load_questions(args.questions)
+    if args.mode == "inprocess":
+        target: Any = InProcessTarget(args.api, args.timeout, args.token)
+    else:
+        target = HttpTarget(args.url, args.api, args.timeout, args.token)
+
+    levels = []
+    try:
+        for q in questions[: max(0, args.warmup)]:
+            target.ask(q)
+
+        for c in [int(x) for x in args.concurrency.split(",") if x.strip()]:
+            res = run_level(target, questions, c, args.repeat)
+            levels.append(res)
+            lat, ttft = res["latency_s"], res["ttft_s"]
+            ttft_p50 = "-" if ttft["p50"] is None else f"{ttft['p50']}s"
+            print(
+                f"c={c:<3d} n={res['requests']} err={res['errors']} rps={res['throughput_rps']} "
+                f"p50={lat['p50']}s p95={lat['p95']}s p99={lat['p99']}s ttft_p50={ttft_p50} "
+                f"tok/s={res['decode_tokens_per_s']} fallback={res['fallback_rate']} idk={res['idk_rate']}"
+            )
+    finally:
+        target.close()
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "mode": args.mode,
+        "api": args.api,
+        "questions": len(questions),
+        "repeat": args.repeat,
+        "load_s": round(target.load_s, 2) if target.load_s is not None else None,
+        "levels": levels,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
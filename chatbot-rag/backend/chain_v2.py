@@ -3,9 +3,9 @@ import shutil
 import logging
 import time
 import warnings
-import re
-from dataclasses import dataclass
-from typing import Tuple, Optional, List, Dict, Any
+import threading
+from dataclasses import dataclass, field
+from typing import Tuple, Optional, List, Dict, Any, TYPE_CHECKING
 
 # ------------------------------------------------------------------------------
 # Logging
@@ -23,17 +23,25 @@ print("=" * 50 + "\n", flush=True)
 
 # ------------------------------------------------------------------------------
 # Third-party imports
+#
+# Only light modules are imported here. langchain_community, langchain_chroma,
+# sentence_transformers, transformers and the optional bitnet/sentencepiece
+# probes are imported where they are first used, so api_v2 can bind its port
+# (and serve /health + auth) while the models warm up in the background.
 # ------------------------------------------------------------------------------
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
-from langchain_chroma import Chroma
-# PATCHED: Using sentence_transformers directly to avoid compatibility issues
-from sentence_transformers import SentenceTransformer
 from langchain_core.embeddings import Embeddings
 from typing import List as ListType
 
+if TYPE_CHECKING:
+    from langchain_chroma import Chroma
+    from langchain_core.retrievers import BaseRetriever
+
 class HuggingFaceEmbeddings(Embeddings):
     """Custom wrapper for HuggingFace embeddings using sentence-transformers directly"""
     def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2", **kwargs):
+        # PATCHED: Using sentence_transformers directly to avoid compatibility issues
+        from sentence_transformers import SentenceTransformer
+
         self.model = SentenceTransformer(model_name)
     
     def embed_documents(self, texts: ListType[str]) -> ListType[ListType[float]]:
@@ -42,38 +50,38 @@ class HuggingFaceEmbeddings(Embeddings):
     def embed_query(self, text: str) -> ListType[float]:
         return self.model.encode([text], convert_to_tensor=False)[0].tolist()
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
-from langchain_core.retrievers import BaseRetriever
+
+from quant_index import QuantizedIndex, QUANT_MODES, cosine_to_relevance
+from lexical_index import BM25Index, tokenize
+from reranker import Reranker, RERANK_ENABLED, RERANK_FETCH_K, RERANK_MODEL
+from context_packer import pack_context
+from mmr import mmr_order
+from deadline import Deadline, RequestCancelled, check_deadline
+from metrics import span, GenerationTimer, ANSWERS, GIBBERISH_ABORTS, NEGATIVE_CACHE
+from negative_cache import negative_cache
+from text_quality import GibberishMonitor, score_text
+from stopping import STOP_MARKERS, answer_criteria
+import resources
+import profiling
+from conversation import memory, HISTORY_TOKEN_BUDGET, blend_query_vectors
+from inference_service import (
+    INFERENCE_SOCKET, InferenceClient, RemoteEmbeddings, RemoteChatModel, RemoteCrossEncoder,
+)
 
 warnings.filterwarnings("ignore", category=UserWarning)
 warnings.filterwarnings("ignore", message=".*TracerWarning.*")
 warnings.filterwarnings("ignore", message=".*torch_dtype.*")
 
-# BitNet native (optional)
-try:
-    from bitnet import BitNetInference  # type: ignore
-    BITNET_AVAILABLE = True
-except Exception:
-    BITNET_AVAILABLE = False
-
-# HF / ORT
-from transformers import AutoTokenizer, AutoModelForCausalLM  # type: ignore
 
-try:
-    import sentencepiece  # noqa: F401
-    from transformers import LlamaTokenizer  # type: ignore
-    SENTENCEPIECE_AVAILABLE = True
-except Exception:
-    LlamaTokenizer = None  # type: ignore
-    SENTENCEPIECE_AVAILABLE = False
+def _bitnet_inference_cls():
+    """BitNet native (optional); None when the package isn't installed."""
+    try:
+        from bitnet import BitNetInference  # type: ignore
+        return BitNetInference
+    except Exception:
+        return None
 
-try:
-    from transformers import GPT2TokenizerFast  # type: ignore
-    GPT2_FAST_AVAILABLE = True
-except Exception:
-    GPT2TokenizerFast = None  # type: ignore
-    GPT2_FAST_AVAILABLE = False
 
 #from optimum.onnxruntime import ORTModelForCausalLM  # type: ignore
 
@@ -95,6 +103,25 @@ Question: {question}
 
 Answer:"""
 
+# Same prompt with the session's bounded history (conversation.history_block)
+RAG_HISTORY_PROMPT_TEMPLATE = """You are a retrieval QA assistant.
+
+RULES:
+- Use ONLY the Context.
+- If the Context does not contain the answer, say: "I don't know."
+- Keep the answer to 1-3 short sentences.
+- Do not ask the user questions.
+
+Context:
+{context}
+
+Conversation so far:
+{history}
+
+Question: {question}
+
+Answer:"""
+
 DOCS_DIR = os.getenv("DOCS_DIR", "./docs")
 CHROMA_DIR = os.getenv("CHROMA_DIR", "./.chroma")
 CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "rag-index")
@@ -134,23 +161,89 @@ MIN_RELEVANCE_SCORE = float(os.getenv("MIN_RELEVANCE_SCORE", "0.20"))
 # If we only have "distance" scores (lower better)
 MAX_DISTANCE_SCORE = float(os.getenv("MAX_DISTANCE_SCORE", "1.25"))
 
+# ------------------------------------------------------------------------------
+# Quantized embedding storage (optional)
+# ------------------------------------------------------------------------------
+# "none" keeps dense search in Chroma; "int8" / "binary" search compact codes and
+# rescore a shortlist with the full-precision vectors.
+EMBED_QUANT = os.getenv("EMBED_QUANT", "none").strip().lower()
+QUANT_INDEX_DIR = os.getenv("QUANT_INDEX_DIR", os.path.join(CHROMA_DIR, "quant"))
+QUANT_SHORTLIST = int(os.getenv("QUANT_SHORTLIST", "24"))
+
+# ------------------------------------------------------------------------------
+# Hybrid retrieval (BM25 + dense, reciprocal rank fusion)
+# ------------------------------------------------------------------------------
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", os.path.join(CHROMA_DIR, "bm25.json"))
+# Candidates pulled from each side before fusion
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "12"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# A chunk containing this fraction of the query's content terms counts as relevant
+# even when its dense score is below MIN_RELEVANCE_SCORE.
+MIN_LEXICAL_COVERAGE = float(os.getenv("MIN_LEXICAL_COVERAGE", "0.99"))
+# ...but only for queries with at least this many distinct content terms: a single
+# term is "fully covered" by any chunk that mentions it, on topic or not.
+MIN_LEXICAL_TERMS = int(os.getenv("MIN_LEXICAL_TERMS", "2"))
+
+# ------------------------------------------------------------------------------
+# Diversity (maximal marginal relevance over the fetched candidates)
+# ------------------------------------------------------------------------------
+MMR_ENABLED = os.getenv("MMR", "1") == "1"
+MMR_FETCH_K = int(os.getenv("MMR_FETCH_K", "12"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+
 # ------------------------------------------------------------------------------
 # Global readiness state
 # ------------------------------------------------------------------------------
+# Warm-up phases, in order:
+#   cold -> loading_embeddings -> loading_index -> loading_models -> smoke_test -> ready
+# "degraded" = usable but the smoke test warned; "failed" = no usable chain.
+PHASES = ("cold", "loading_embeddings", "loading_index", "loading_models", "smoke_test", "ready", "degraded", "failed")
+SERVING_PHASES = ("ready", "degraded")
+
+
 @dataclass
 class ServiceState:
     initialized: bool = False
     model_loaded: bool = False
     init_error: Optional[str] = None
+    phase: str = "cold"
+    phase_since: float = field(default_factory=time.time)
+    started_at: float = field(default_factory=time.time)
+
+    @property
+    def ready(self) -> bool:
+        return self.phase in SERVING_PHASES
+
+    def set_phase(self, phase: str) -> None:
+        assert phase in PHASES, phase
+        logger.info("🔄 [System] phase %s -> %s (%.1fs)", self.phase, phase, time.time() - self.phase_since)
+        self.phase = phase
+        self.phase_since = time.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "phase": self.phase,
+            "ready": self.ready,
+            "phase_elapsed_s": round(now - self.phase_since, 3),
+            "uptime_s": round(now - self.started_at, 3),
+            "init_error": self.init_error,
+        }
 
 
 state = ServiceState()
+_init_lock = threading.Lock()
+_warmup_thread: Optional[threading.Thread] = None
 
 rag_chain: Optional["RAGBitNetChain"] = None
-retriever: Optional[BaseRetriever] = None
+retriever: Optional["BaseRetriever"] = None
 
 # keep vectorstore around so we can fetch scores
-vectorstore: Optional[Chroma] = None
+vectorstore: Optional["Chroma"] = None
+embeddings: Optional[Embeddings] = None
+quant_index: Optional[QuantizedIndex] = None
+bm25_index: Optional[BM25Index] = None
 
 # ------------------------------------------------------------------------------
 # Debug prints (helps confirm correct file/dirs are being used)
@@ -169,6 +262,9 @@ def _load_documents(docs_dir: str) -> List[Document]:
     """
     Load docs from DOCS_DIR. If none exist, return [] (do NOT create a fake doc).
     """
+    from langchain_community.document_loaders import DirectoryLoader, TextLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
     os.makedirs(docs_dir, exist_ok=True)
     loaders = [
         DirectoryLoader(docs_dir, glob="**/*.txt", loader_cls=TextLoader),
@@ -191,7 +287,9 @@ def _load_documents(docs_dir: str) -> List[Document]:
     return all_docs
 
 
-def _build_vectorstore(embeddings: HuggingFaceEmbeddings) -> Chroma:
+def _build_vectorstore(embeddings: Embeddings) -> "Chroma":
+    from langchain_chroma import Chroma
+
     # Load persisted if it exists
     if os.path.isdir(CHROMA_DIR) and any(os.scandir(CHROMA_DIR)):
         logger.info("📚 [Chroma] Loading persisted index at: %s", CHROMA_DIR)
@@ -232,6 +330,92 @@ def _build_vectorstore(embeddings: HuggingFaceEmbeddings) -> Chroma:
     return vs
 
 
+def _build_quant_index(vs: "Chroma") -> Optional[QuantizedIndex]:
+    """
+    Load (or build from the Chroma collection) the quantized copy of the corpus.
+    Rebuilt whenever the persisted codes don't match the mode or the collection size.
+    """
+    if EMBED_QUANT in ("", "none", "0", "off"):
+        return None
+    if EMBED_QUANT not in QUANT_MODES:
+        logger.warning("⚠️ [Quant] Unknown EMBED_QUANT=%r; using full-precision search.", EMBED_QUANT)
+        return None
+
+    try:
+        count = vs._collection.count()
+    except Exception:
+        count = None
+
+    try:
+        idx = QuantizedIndex.load(QUANT_INDEX_DIR)
+    except Exception as e:
+        logger.warning("⚠️ [Quant] Persisted codes unreadable; rebuilding. err=%s", e)
+        idx = None
+
+    if idx is not None and idx.mode == EMBED_QUANT and (count is None or len(idx) == count):
+        logger.info("🗜️ [Quant] Loaded %s codes for %d chunks from: %s", idx.mode, len(idx), QUANT_INDEX_DIR)
+        return idx
+
+    data = vs.get(include=["embeddings", "documents", "metadatas"])
+    ids = data.get("ids") or []
+    if not ids:
+        logger.warning("⚠️ [Quant] Collection is empty; nothing to quantize.")
+        return None
+
+    idx = QuantizedIndex.build(
+        data["embeddings"],
+        texts=data.get("documents") or [""] * len(ids),
+        metadatas=data.get("metadatas") or [{}] * len(ids),
+        ids=ids,
+        mode=EMBED_QUANT,
+    )
+    idx.save(QUANT_INDEX_DIR)
+    code_bytes, full_bytes = idx.nbytes()
+    logger.info(
+        "🗜️ [Quant] Built %s codes for %d chunks: %d KiB in memory (full precision: %d KiB on disk).",
+        idx.mode, len(idx), code_bytes // 1024, full_bytes // 1024,
+    )
+    return idx
+
+
+def _build_lexical_index(vs: "Chroma") -> Optional[BM25Index]:
+    """
+    Load (or build from the Chroma collection) the BM25 index persisted next to it.
+    """
+    if not HYBRID_SEARCH:
+        return None
+
+    try:
+        count = vs._collection.count()
+    except Exception:
+        count = None
+
+    try:
+        idx = BM25Index.load(BM25_INDEX_PATH)
+    except Exception as e:
+        logger.warning("⚠️ [BM25] Persisted index unreadable; rebuilding. err=%s", e)
+        idx = None
+
+    if idx is not None and (count is None or len(idx) == count):
+        logger.info("🔤 [BM25] Loaded index for %d chunks from: %s", len(idx), BM25_INDEX_PATH)
+        return idx
+
+    data = vs.get(include=["documents", "metadatas"])
+    ids = data.get("ids") or []
+    if not ids:
+        logger.warning("⚠️ [BM25] Collection is empty; lexical search disabled.")
+        return None
+
+    idx = BM25Index.build(
+        texts=data.get("documents") or [""] * len(ids),
+        metadatas=data.get("metadatas") or [{}] * len(ids),
+        ids=ids,
+    )
+    idx.save(BM25_INDEX_PATH)
+    logger.info("🔤 [BM25] Built index: %d chunks, %d terms.", len(idx), len(idx.vocabulary))
+    return idx
+
+
 def _local_onnx_present(path: str) -> bool:
     if not os.path.isdir(path):
         return False
@@ -245,41 +429,7 @@ def _local_onnx_present(path: str) -> bool:
 
 
 def _looks_like_gibberish(text: str) -> bool:
-    t = (text or "").strip()
-    if len(t) < 12:
-        return True
-    if "�" in t:
-        return True
-
-    non_ascii = sum(1 for c in t if ord(c) > 127)
-    if non_ascii / max(1, len(t)) > 0.08:
-        return True
-
-    punct = sum(1 for c in t if c in ".,;:!?()[]{}<>_/\\|@#$%^&*+=~`")
-    if punct / max(1, len(t)) > 0.25:
-        return True
-
-    letters = sum(1 for c in t if c.isalpha())
-    if letters / max(1, len(t)) < 0.50:
-        return True
-
-    vowels = sum(1 for c in t.lower() if c in "aeiou")
-    if vowels / max(1, letters) < 0.22:
-        return True
-
-    tokens = t.split()
-    if len(tokens) >= 8:
-        short = sum(1 for w in tokens if len(w.strip(".,;:!?()[]{}")) <= 2)
-        if short / len(tokens) > 0.35:
-            return True
-        abbr = len(re.findall(r"\b\w{1,4}\.\b", t))
-        if abbr >= 4:
-            return True
-        uniq = len(set(tokens))
-        if uniq / len(tokens) < 0.55:
-            return True
-
-    return False
+    return score_text(text).is_gibberish
 
 
 def _finalize_answer(text: str) -> str:
@@ -291,7 +441,7 @@ def _finalize_answer(text: str) -> str:
     if "\n" in t:
         t = t.split("\n", 1)[0].strip()
 
-    for bad in ["RULES:", "Context:", "Question:"]:
+    for bad in STOP_MARKERS:
         if bad in t:
             t = t.split(bad, 1)[0].strip()
 
@@ -302,18 +452,71 @@ def _finalize_answer(text: str) -> str:
 # ------------------------------------------------------------------------------
 # Scored retrieval (visibility + gating)
 # ------------------------------------------------------------------------------
-def retrieve_with_scores(question: str, k: int = RETRIEVAL_K_DEFAULT) -> Dict[str, Any]:
+def _doc_key(d: Document) -> Tuple[str, str]:
+    return (str((d.metadata or {}).get("source", "")), d.page_content or "")
+
+
+def _dense_retrieve(
+    question: str, k: int, deadline: Optional[Deadline] = None, query_vec: Optional[List[float]] = None
+) -> Dict[str, Any]:
     """
-    Returns:
-      {
-        "docs": [Document...],
-        "score_type": "relevance" | "distance" | "none",
-        "scores": [float...]  # aligned with docs
-      }
+    Dense candidates, best first. When the search path can return them, the
+    candidates' stored vectors come back under "embeddings" (aligned with docs)
+    so later stages never have to re-embed chunks. A precomputed `query_vec`
+    skips embedding the question.
     """
     if vectorstore is None:
         return {"docs": [], "score_type": "none", "scores": []}
 
+    if query_vec is None and embeddings is not None:
+        try:
+            with span("embed"):
+                query_vec = resources.run_embed(embeddings.embed_query, question)
+        except Exception as e:
+            logger.warning("⚠️ [Retrieval] query embedding failed; falling back. err=%s", e)
+    check_deadline(deadline, "embed")
+
+    with span("vector_search") as sp:
+        pack = _vector_search(question, k, query_vec)
+        sp["score_type"] = pack["score_type"]
+        sp["hits"] = len(pack["docs"])
+    return pack
+
+
+def _vector_search(question: str, k: int, query_vec: Optional[List[float]]) -> Dict[str, Any]:
+    # Quantized candidate generation + full-precision rescoring
+    if quant_index is not None and query_vec is not None:
+        try:
+            hits = quant_index.search(query_vec, k=k, shortlist=QUANT_SHORTLIST)
+            docs = [
+                Document(page_content=quant_index.texts[i], metadata=dict(quant_index.metadatas[i]))
+                for i, _ in hits
+            ]
+            scores = [cosine_to_relevance(c) for _, c in hits]
+            vecs = [quant_index.full[i] for i, _ in hits]
+            return {"docs": docs, "score_type": "relevance", "scores": scores, "embeddings": vecs, "query_vec": query_vec}
+        except Exception as e:
+            logger.warning("⚠️ [Retrieval] quantized search failed; falling back. err=%s", e)
+
+    # Query the collection by vector so the candidates' stored embeddings come back too
+    if query_vec is not None:
+        try:
+            res = vectorstore._collection.query(
+                query_embeddings=[query_vec],
+                n_results=k,
+                include=["documents", "metadatas", "distances", "embeddings"],
+            )
+            to_relevance = vectorstore._select_relevance_score_fn()
+            docs = [
+                Document(page_content=text or "", metadata=meta or {})
+                for text, meta in zip(res["documents"][0], res["metadatas"][0])
+            ]
+            scores = [float(to_relevance(dist)) for dist in res["distances"][0]]
+            vecs = list(res["embeddings"][0])
+            return {"docs": docs, "score_type": "relevance", "scores": scores, "embeddings": vecs, "query_vec": query_vec}
+        except Exception as e:
+            logger.warning("⚠️ [Retrieval] vector query failed; falling back. err=%s", e)
+
     # Prefer normalized relevance scores (0..1, higher better)
     if hasattr(vectorstore, "similarity_search_with_relevance_scores"):
         try:
@@ -342,30 +545,155 @@ def retrieve_with_scores(question: str, k: int = RETRIEVAL_K_DEFAULT) -> Dict[st
         return {"docs": [], "score_type": "none", "scores": []}
 
 
-def retrieval_is_relevant(score_type: str, scores: List[Any], docs: Optional[List[Document]] = None) -> bool:
+def _truncate_pack(pack: Dict[str, Any], k: int) -> Dict[str, Any]:
+    out = dict(pack)
+    for key in ("docs", "scores", "lexical_scores", "embeddings"):
+        if key in out:
+            out[key] = out[key][:k]
+    return out
+
+
+def _diversify(pack: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reorder dense candidates by MMR using the embeddings the search already
+    returned. Scores travel with their documents, so gating is unaffected.
+    """
+    vecs = pack.get("embeddings")
+    if not vecs or pack.get("query_vec") is None or len(pack["docs"]) <= 1:
+        return pack
+    try:
+        order = mmr_order(pack["query_vec"], vecs, lambda_mult=MMR_LAMBDA)
+    except Exception as e:
+        logger.warning("⚠️ [Retrieval] MMR failed; keeping similarity order. err=%s", e)
+        return pack
+
+    out = dict(pack)
+    for key in ("docs", "scores", "embeddings"):
+        out[key] = [pack[key][i] for i in order]
+    return out
+
+
+def _fuse_hybrid(question: str, dense: Dict[str, Any], k: int) -> Dict[str, Any]:
+    """
+    Reciprocal rank fusion of the dense pack with BM25 hits over the same chunks.
+    Dense scores are carried through (None for lexical-only chunks) so gating and
+    get_sources keep working; lexical coverage is reported alongside.
+    """
+    hits = bm25_index.search(question, k=HYBRID_FETCH_K) if bm25_index is not None else []
+    if not hits:
+        return _truncate_pack(dense, k)
+
+    fused: Dict[Tuple[str, str], float] = {}
+    by_key: Dict[Tuple[str, str], Document] = {}
+    dense_score: Dict[Tuple[str, str], Any] = {}
+    dense_vec: Dict[Tuple[str, str], Any] = {}
+    coverage: Dict[Tuple[str, str], float] = {}
+
+    vecs = dense.get("embeddings") or []
+    for rank, d in enumerate(dense["docs"]):
+        key = _doc_key(d)
+        by_key.setdefault(key, d)
+        dense_score.setdefault(key, dense["scores"][rank] if rank < len(dense["scores"]) else None)
+        if rank < len(vecs):
+            dense_vec.setdefault(key, vecs[rank])
+        fused[key] = fused.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+
+    for rank, (row, _, cov) in enumerate(hits):
+        d = Document(page_content=bm25_index.texts[row], metadata=dict(bm25_index.metadatas[row]))
+        key = _doc_key(d)
+        by_key.setdefault(key, d)
+        coverage[key] = cov
+        fused[key] = fused.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+
+    order = sorted(fused, key=lambda key: fused[key], reverse=True)[:k]
+    out = {
+        "docs": [by_key[key] for key in order],
+        "score_type": dense["score_type"],
+        "scores": [dense_score.get(key) for key in order],
+        "lexical_scores": [coverage.get(key, 0.0) for key in order],
+        "query_terms": len(set(tokenize(question))),
+    }
+    if "query_vec" in dense:
+        out["query_vec"] = dense["query_vec"]
+        out["embeddings"] = [dense_vec.get(key) for key in order]
+    return out
+
+
+def retrieve_with_scores(
+    question: str,
+    k: int = RETRIEVAL_K_DEFAULT,
+    deadline: Optional[Deadline] = None,
+    query_vec: Optional[List[float]] = None,
+) -> Dict[str, Any]:
+    """
+    Returns:
+      {
+        "docs": [Document...],
+        "score_type": "relevance" | "distance" | "none",
+        "scores": [float...],         # aligned with docs (None where only BM25 found it)
+        "lexical_scores": [float...], # hybrid only: query-term coverage, aligned with docs
+        "query_terms": int,           # hybrid only: distinct content terms in the query
+        "embeddings": [vector...],    # when available: stored chunk vectors, aligned with docs
+        "query_vec": vector           # when available: the embedded question
+      }
+    Raises RequestCancelled once `deadline` is cancelled or expired.
+    """
+    check_deadline(deadline, "retrieve")
+    fetch_k = k
+    if bm25_index is not None:
+        fetch_k = max(fetch_k, HYBRID_FETCH_K)
+    if MMR_ENABLED:
+        fetch_k = max(fetch_k, MMR_FETCH_K)
+
+    dense = _dense_retrieve(question, k=fetch_k, deadline=deadline, query_vec=query_vec)
+    check_deadline(deadline, "retrieve")
+    if MMR_ENABLED:
+        with span("mmr"):
+            dense = _diversify(dense)
+
+    if bm25_index is None:
+        return _truncate_pack(dense, k)
+    with span("hybrid_fusion"):
+        return _fuse_hybrid(question, dense, k)
+
+
+def retrieval_is_relevant(
+    score_type: str,
+    scores: List[Any],
+    docs: Optional[List[Document]] = None,
+    lexical_scores: Optional[List[float]] = None,
+    query_terms: int = 0,
+) -> bool:
     """
     Decide if retrieval is good enough to answer.
     Conservative defaults: if we can't score, require real non-trivial content.
+    A chunk matching (nearly) every content term of a multi-term query also qualifies.
     """
     docs = docs or []
     if not docs:
         return False
 
+    if lexical_scores and query_terms >= MIN_LEXICAL_TERMS and max(lexical_scores) >= MIN_LEXICAL_COVERAGE:
+        return True
+
     # If we don't have real scores, require some non-trivial context
     if score_type == "none" or not scores:
         joined = "\n".join([d.page_content.strip() for d in docs if d.page_content])
         return len(joined.strip()) >= 40  # small but non-empty threshold
 
+    # Hybrid packs may carry None for chunks only BM25 found
+    scores = [s for s in scores if s is not None]
+
     if score_type == "relevance":
         try:
-            top = float(scores[0])
+            top = max(float(s) for s in scores)
             return top >= MIN_RELEVANCE_SCORE
         except Exception:
             return False
 
     if score_type == "distance":
         try:
-            top = float(scores[0])
+            top = min(float(s) for s in scores)
             return top <= MAX_DISTANCE_SCORE
         except Exception:
             return False
@@ -373,6 +701,16 @@ def retrieval_is_relevant(score_type: str, scores: List[Any], docs: Optional[Lis
     return False
 
 
+def pack_is_relevant(pack: Dict[str, Any]) -> bool:
+    return retrieval_is_relevant(
+        pack["score_type"],
+        pack["scores"],
+        docs=pack["docs"],
+        lexical_scores=pack.get("lexical_scores"),
+        query_terms=pack.get("query_terms", 0),
+    )
+
+
 # ------------------------------------------------------------------------------
 # Model wrapper
 # ------------------------------------------------------------------------------
@@ -395,34 +733,155 @@ class DualChatModel:
     def model(self):
         return self.fallback.model or self.bitnet.model
 
-    def generate(self, prompt: str) -> str:
-        if self.bitnet.model is not None:
-            out = self.bitnet.generate(prompt)
-            out2 = _finalize_answer(out)
+    @property
+    def tokenizer(self):
+        """Tokenizer of the model that will answer first (BitNet if it loaded)."""
+        if self.bitnet.model is not None and self.bitnet.tokenizer is not None:
+            return self.bitnet.tokenizer
+        return self.fallback.tokenizer
+
+    def count_tokens(self, text: str) -> int:
+        tok = self.tokenizer
+        if tok is None:
+            return max(1, len(text or "") // 4)
+        return len(tok.encode(text or "", add_special_tokens=False))
+
+    @staticmethod
+    def _accept_bitnet(out2: str) -> bool:
+        if out2.startswith("Error:"):
+            logger.warning("⚠️ [LLM] BitNet errored; using fallback. err=%s", out2)
+            return False
+        with span("gibberish_check"):
+            reasons = score_text(out2).reasons()
+        if reasons:
+            logger.warning("⚠️ [LLM] BitNet gibberish (%s); using fallback. sample=%r", ",".join(reasons), out2[:120])
+            return False
+        logger.info("✅ [LLM] Answered with BitNet.")
+        return True
 
-            if out2.startswith("Error:"):
-                logger.warning("⚠️ [LLM] BitNet errored; using fallback. err=%s", out2)
-            elif _looks_like_gibberish(out2):
-                logger.warning("⚠️ [LLM] BitNet gibberish; using fallback. sample=%r", out2[:120])
-            else:
-                logger.info("✅ [LLM] Answered with BitNet.")
+    @staticmethod
+    def _finalize(text: str) -> str:
+        with span("finalize"):
+            return _finalize_answer(text)
+
+    def generate(self, prompt: str, deadline: Optional[Deadline] = None) -> str:
+        with profiling.torch_trace("generate"):
+            return self._generate(prompt, deadline)
+
+    def _generate(self, prompt: str, deadline: Optional[Deadline]) -> str:
+        check_deadline(deadline, "generate")
+        if self.bitnet.model is not None:
+            with span("bitnet"):
+                out = self.bitnet.generate(prompt, deadline=deadline)
+            out2 = self._finalize(out)
+            # A cut-off BitNet answer must not trigger a fallback run for nobody
+            check_deadline(deadline, "generate")
+            if self._accept_bitnet(out2):
+                ANSWERS.inc(source="bitnet")
                 return out2
 
-        fb = self.fallback.generate(prompt)
-        fb2 = _finalize_answer(fb)
+        with span("fallback"):
+            fb = self.fallback.generate(prompt, deadline=deadline)
+        fb2 = self._finalize(fb)
+        ANSWERS.inc(source="fallback")
         logger.info("✅ [LLM] Answered with FALLBACK. model=%s", FALLBACK_MODEL_PATH)
         return fb2
 
-    def stream(self, prompt: str):
-        text = self.generate(prompt)
+    def generate_text(self, prompt: str, deadline: Optional[Deadline] = None) -> str:
+        """
+        Plain completion for internal prompts (conversation summaries): no
+        answer-shape stopping, no _finalize_answer, not counted in ANSWERS.
+        Prefers the fallback model, whose output needs no gibberish check.
+        """
+        check_deadline(deadline, "generate")
+        if self.fallback.model is not None:
+            with span("fallback"):
+                return self.fallback.generate(prompt, deadline=deadline, answer_stop=False)
+        with span("bitnet"):
+            return self.bitnet.generate(prompt, deadline=deadline, answer_stop=False)
+
+    def generate_batch(self, prompts: List[str], deadline: Optional[Deadline] = None) -> List[str]:
+        """
+        Same as generate() for several prompts: one padded BitNet pass, then one
+        fallback pass for the answers BitNet got wrong.
+        """
+        with profiling.torch_trace("generate_batch"):
+            return self._generate_batch(prompts, deadline)
+
+    def _generate_batch(self, prompts: List[str], deadline: Optional[Deadline]) -> List[str]:
+        check_deadline(deadline, "generate")
+        answers: List[Optional[str]] = [None] * len(prompts)
+        if self.bitnet.model is not None:
+            with span("bitnet", batch=len(prompts)):
+                outs = self.bitnet.generate_batch(prompts, deadline=deadline)
+            check_deadline(deadline, "generate")
+            for i, out in enumerate(outs):
+                out2 = self._finalize(out)
+                if self._accept_bitnet(out2):
+                    answers[i] = out2
+                    ANSWERS.inc(source="bitnet")
+
+        todo = [i for i, a in enumerate(answers) if a is None]
+        if todo:
+            with span("fallback", batch=len(todo)):
+                fbs = self.fallback.generate_batch([prompts[i] for i in todo], deadline=deadline)
+            for i, fb in zip(todo, fbs):
+                answers[i] = self._finalize(fb)
+            ANSWERS.inc(len(todo), source="fallback")
+            logger.info("✅ [LLM] Answered %d/%d with FALLBACK. model=%s", len(todo), len(prompts), FALLBACK_MODEL_PATH)
+        return [a or "I don't know." for a in answers]
+
+    def stream(self, prompt: str, deadline: Optional[Deadline] = None):
+        text = resources.run_generate(self.generate, prompt, deadline=deadline)
         if text.startswith("Error:"):
             yield text
             return
         for w in text.split():
+            check_deadline(deadline, "stream")
             yield w + " "
             time.sleep(0.01)
 
 
+def _stopping_kwargs(deadline: Optional[Deadline], *criteria: Any) -> Dict[str, Any]:
+    """stopping_criteria for HF generate(): the given criteria plus a per-token deadline check."""
+    items = list(criteria)
+    if deadline is not None:
+        items.append(deadline.criterion())
+    if not items:
+        return {}
+    from transformers import StoppingCriteriaList  # type: ignore
+
+    return {"stopping_criteria": StoppingCriteriaList(items)}
+
+
+def _hf_generate_batch(
+    model, tokenizer, prompts: List[str], name: str, deadline: Optional[Deadline] = None, **gen_kwargs
+) -> List[str]:
+    """One left-padded generate() call for several prompts (decoder-only models)."""
+    prev_side = tokenizer.padding_side
+    tokenizer.padding_side = "left"
+    try:
+        with span("tokenize", batch=len(prompts)):
+            inputs = tokenizer(prompts, return_tensors="pt", padding=True)
+    finally:
+        tokenizer.padding_side = prev_side
+
+    input_len = inputs["input_ids"].shape[-1]
+    timer = GenerationTimer(name)
+    gen_ids = model.generate(
+        **inputs,
+        max_new_tokens=GEN_MAX_NEW_TOKENS,
+        do_sample=GEN_DO_SAMPLE,
+        temperature=GEN_TEMPERATURE,
+        top_p=GEN_TOP_P,
+        repetition_penalty=GEN_REP_PENALTY,
+        **_stopping_kwargs(deadline, timer.criterion(), *answer_criteria(tokenizer, input_len)),
+        **gen_kwargs,
+    )
+    timer.finish()
+    return [tokenizer.decode(row[input_len:], skip_special_tokens=True).strip() for row in gen_ids]
+
+
 class HFChatModel:
     def __init__(self, model_path: str):
         self.model = None
@@ -430,6 +889,8 @@ class HFChatModel:
         self.last_error: Optional[str] = None
 
         try:
+            from transformers import AutoTokenizer, AutoModelForCausalLM  # type: ignore
+
             logger.info("📦 [Fallback] Loading HF model: %s", model_path)
             self.tokenizer = AutoTokenizer.from_pretrained(model_path, use_fast=True)
             if getattr(self.tokenizer, "pad_token", None) is None:
@@ -442,11 +903,14 @@ class HFChatModel:
             self.model = None
             self.tokenizer = None
 
-    def generate(self, prompt: str) -> str:
+    def generate(self, prompt: str, deadline: Optional[Deadline] = None, answer_stop: bool = True) -> str:
         if self.model is None or self.tokenizer is None:
             return f"Error: Fallback model not loaded. {self.last_error or ''}".strip()
 
-        inputs = self.tokenizer(prompt, return_tensors="pt")
+        with span("tokenize"):
+            inputs = self.tokenizer(prompt, return_tensors="pt")
+        input_len = inputs["input_ids"].shape[-1]
+        timer = GenerationTimer("fallback")
         gen_ids = self.model.generate(
             **inputs,
             max_new_tokens=GEN_MAX_NEW_TOKENS,
@@ -456,11 +920,34 @@ class HFChatModel:
             repetition_penalty=GEN_REP_PENALTY,
             eos_token_id=self.tokenizer.eos_token_id,
             pad_token_id=self.tokenizer.eos_token_id,
+            **_stopping_kwargs(
+                deadline, timer.criterion(), *(answer_criteria(self.tokenizer, input_len) if answer_stop else [])
+            ),
         )
-        input_len = inputs["input_ids"].shape[-1]
+        timer.finish()
+        check_deadline(deadline, "fallback")
         new_tokens = gen_ids[0][input_len:]
         return self.tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
 
+    def generate_batch(self, prompts: List[str], deadline: Optional[Deadline] = None) -> List[str]:
+        if self.model is None or self.tokenizer is None or len(prompts) <= 1:
+            return [self.generate(p, deadline=deadline) for p in prompts]
+        try:
+            out = _hf_generate_batch(
+                self.model,
+                self.tokenizer,
+                prompts,
+                "fallback",
+                deadline,
+                eos_token_id=self.tokenizer.eos_token_id,
+                pad_token_id=self.tokenizer.eos_token_id,
+            )
+        except Exception:
+            logger.warning("⚠️ [Fallback] Batched generation failed; generating one by one.", exc_info=True)
+            return [self.generate(p, deadline=deadline) for p in prompts]
+        check_deadline(deadline, "fallback")
+        return out
+
 
 class BitNetChatModel:
     def __init__(self, model_path: str):
@@ -469,7 +956,8 @@ class BitNetChatModel:
         self.is_bitnet_native = False
         self.last_error: Optional[str] = None
 
-        if BITNET_AVAILABLE:
+        BitNetInference = _bitnet_inference_cls()
+        if BitNetInference is not None:
             try:
                 logger.info("🚀 [BitNet] Attempting Native Load: %s", model_path)
                 self.model = BitNetInference(model_path)
@@ -517,6 +1005,8 @@ class BitNetChatModel:
             self.is_bitnet_native = False
 
     def _load_tokenizer_prefer_local(self, remote_path: str, local_path: str):
+        from transformers import AutoTokenizer  # type: ignore
+
         try:
             tok = AutoTokenizer.from_pretrained(local_path, trust_remote_code=True)
             logger.info("✅ [Tokenizer] Loaded from LOCAL_ONNX_PATH.")
@@ -538,7 +1028,12 @@ class BitNetChatModel:
         except Exception as e:
             logger.warning("⚠️ [Tokenizer] AutoTokenizer(trust_remote_code=False) failed: %s", e)
 
-        if GPT2_FAST_AVAILABLE:
+        try:
+            from transformers import GPT2TokenizerFast  # type: ignore
+        except Exception:
+            GPT2TokenizerFast = None  # type: ignore
+
+        if GPT2TokenizerFast is not None:
             try:
                 tok = GPT2TokenizerFast.from_pretrained(remote_path)
                 logger.info("✅ [Tokenizer] Loaded via GPT2TokenizerFast.")
@@ -546,7 +1041,13 @@ class BitNetChatModel:
             except Exception as e:
                 logger.warning("⚠️ [Tokenizer] GPT2TokenizerFast failed: %s", e)
 
-        if SENTENCEPIECE_AVAILABLE and LlamaTokenizer is not None:
+        try:
+            import sentencepiece  # noqa: F401
+            from transformers import LlamaTokenizer  # type: ignore
+        except Exception:
+            LlamaTokenizer = None  # type: ignore
+
+        if LlamaTokenizer is not None:
             try:
                 tok = LlamaTokenizer.from_pretrained(remote_path)
                 logger.info("✅ [Tokenizer] Loaded via LlamaTokenizer.")
@@ -556,15 +1057,22 @@ class BitNetChatModel:
 
         return None
 
-    def generate(self, prompt: str) -> str:
+    def generate(self, prompt: str, deadline: Optional[Deadline] = None, answer_stop: bool = True) -> str:
         if not self.model or not self.tokenizer:
             return f"Error: Model not loaded. {self.last_error or ''}".strip()
 
         try:
             if self.is_bitnet_native:
-                return self.model.generate(prompt, max_new_tokens=GEN_MAX_NEW_TOKENS).strip()
+                # The native runtime has no per-token hook; only check around the call
+                check_deadline(deadline, "bitnet")
+                with span("bitnet.generate"):
+                    return self.model.generate(prompt, max_new_tokens=GEN_MAX_NEW_TOKENS).strip()
 
-            inputs = self.tokenizer(prompt, return_tensors="pt")
+            with span("tokenize"):
+                inputs = self.tokenizer(prompt, return_tensors="pt")
+            input_len = inputs["input_ids"].shape[-1]
+            timer = GenerationTimer("bitnet")
+            monitor = GibberishMonitor(self.tokenizer, input_len)
             gen_ids = self.model.generate(
                 **inputs,
                 max_new_tokens=GEN_MAX_NEW_TOKENS,
@@ -572,51 +1080,160 @@ class BitNetChatModel:
                 temperature=GEN_TEMPERATURE,
                 top_p=GEN_TOP_P,
                 repetition_penalty=GEN_REP_PENALTY,
+                **_stopping_kwargs(
+                    deadline,
+                    timer.criterion(),
+                    monitor.criterion(),
+                    *(answer_criteria(self.tokenizer, input_len) if answer_stop else []),
+                ),
             )
-            input_len = inputs["input_ids"].shape[-1]
+            timer.finish()
+            check_deadline(deadline, "bitnet")
+            if monitor.aborted:
+                GIBBERISH_ABORTS.inc(model="bitnet")
+                logger.info("✂️ [BitNet] Stopped after %d tokens: %s", timer.steps, ",".join(monitor.scorer.score().reasons()))
             new_tokens = gen_ids[0][input_len:]
             return self.tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
+        except RequestCancelled:
+            raise
         except Exception as e:
             logger.error("Generation error", exc_info=True)
             return f"Error: Generation failed. {e}"
 
+    def generate_batch(self, prompts: List[str], deadline: Optional[Deadline] = None) -> List[str]:
+        if not self.model or not self.tokenizer or self.is_bitnet_native or len(prompts) <= 1:
+            return [self.generate(p, deadline=deadline) for p in prompts]
+        try:
+            return _hf_generate_batch(
+                self.model,
+                self.tokenizer,
+                prompts,
+                "bitnet",
+                deadline,
+                pad_token_id=self.tokenizer.pad_token_id,
+            )
+        except Exception:
+            logger.warning("⚠️ [BitNet] Batched generation failed; generating one by one.", exc_info=True)
+            return [self.generate(p, deadline=deadline) for p in prompts]
+
 
 # ------------------------------------------------------------------------------
 # RAG Chain
 # ------------------------------------------------------------------------------
 class RAGBitNetChain:
-    def __init__(self, retriever_obj: BaseRetriever, llm: DualChatModel):
+    def __init__(self, retriever_obj: "BaseRetriever", llm: DualChatModel, reranker_obj: Optional[Reranker] = None):
         self.retriever = retriever_obj
         self.llm = llm
+        self.reranker = reranker_obj
+
+    def _build_prompt(
+        self, question: str, deadline: Optional[Deadline] = None, session_id: Optional[str] = None
+    ) -> Optional[str]:
+        """Retrieve, gate, optionally rerank; None means answer "I don't know." """
+        fetch_k = max(RETRIEVAL_K_DEFAULT, RERANK_FETCH_K) if self.reranker is not None else RETRIEVAL_K_DEFAULT
+        with span("condense") as sp:
+            condensed = memory.condense(session_id, question)
+            sp["followup"] = condensed.followup
+        query = condensed.query
+        query_vec = condensed.query_vec
+        if query_vec is None and condensed.topic_vec is not None and embeddings is not None:
+            # Embed only the short follow-up and reuse the topic's vector
+            try:
+                with span("embed"):
+                    own_vec = resources.run_embed(embeddings.embed_query, question)
+                query_vec = blend_query_vectors(own_vec, condensed.topic_vec)
+            except Exception as e:
+                logger.warning("⚠️ [Condense] follow-up embedding failed; embedding the condensed query. err=%s", e)
+        if condensed.followup:
+            logger.info("🧵 [Condense] %r -> %r", question, query)
+
+        # Known-unanswerable questions stop here, before embedding or search
+        with span("negative_cache") as sp:
+            outcome = self._rejected_early(query, query_vec)
+            if outcome is None and query_vec is None and embeddings is not None:
+                try:
+                    with span("embed"):
+                        query_vec = resources.run_embed(embeddings.embed_query, query)
+                except Exception as e:
+                    logger.warning("⚠️ [Retrieval] query embedding failed; falling back. err=%s", e)
+                if negative_cache.near_vector(query_vec):
+                    outcome = "vector_hit"
+            sp["outcome"] = outcome or "miss"
+        NEGATIVE_CACHE.inc(result=outcome or "miss")
+        if outcome is not None:
+            logger.info("🚫 [NegCache] %s: %r", outcome, query)
+            return None
+        check_deadline(deadline, "embed")
+
+        with span("retrieve"):
+            pack = retrieve_with_scores(query, k=fetch_k, deadline=deadline, query_vec=query_vec)
+        memory.remember_query(session_id, question, condensed, pack.get("query_vec"))
+
+        with span("gating"):
+            relevant = pack_is_relevant(pack)
+        if not relevant:
+            negative_cache.add(query, pack.get("query_vec"))
+            return None
+
+        if self.reranker is not None:
+            with span("rerank"):
+                pack = resources.run_embed(
+                    self.reranker.rerank, query, pack, k=RETRIEVAL_K_DEFAULT, count_tokens=self.llm.count_tokens
+                )
+            check_deadline(deadline, "rerank")
+
+        with span("prompt_assembly") as sp:
+            packed = pack_context(pack["docs"], count_tokens=self.llm.count_tokens)
+            sp["context_tokens"] = packed.tokens_used
+        if not packed.context.strip():
+            negative_cache.add(query, pack.get("query_vec"))
+            return None
+
+        logger.info(
+            "📦 [Context] %d/%d chunks, %d tokens (saved %d).",
+            len(packed.docs), len(pack["docs"]), packed.tokens_used, packed.tokens_saved,
+        )
+        history = memory.history_block(session_id, self.llm.count_tokens, HISTORY_TOKEN_BUDGET)
+        if history:
+            return RAG_HISTORY_PROMPT_TEMPLATE.format(context=packed.context, history=history, question=question)
+        return RAG_PROMPT_TEMPLATE.format(context=packed.context, question=question)
+
+    @staticmethod
+    def _rejected_early(query: str, query_vec: Optional[List[float]]) -> Optional[str]:
+        """Outcome label when the query can be refused without retrieval, else None."""
+        if negative_cache.has_text(query):
+            return "text_hit"
+        if negative_cache.off_topic(query):
+            return "prefilter"
+        if query_vec is not None and negative_cache.near_vector(query_vec):
+            return "vector_hit"
+        return None
 
-    def invoke(self, question: str) -> str:
-        pack = retrieve_with_scores(question, k=RETRIEVAL_K_DEFAULT)
-        docs = pack["docs"]
-        score_type = pack["score_type"]
-        scores = pack["scores"]
-
-        context = "\n".join([d.page_content for d in docs]) if docs else ""
-
-        if (not context.strip()) or (not retrieval_is_relevant(score_type, scores, docs=docs)):
-            return "I don't know."
-
-        prompt = RAG_PROMPT_TEMPLATE.format(context=context, question=question)
-        return self.llm.generate(prompt)
-
-    def stream(self, question: str):
-        pack = retrieve_with_scores(question, k=RETRIEVAL_K_DEFAULT)
-        docs = pack["docs"]
-        score_type = pack["score_type"]
-        scores = pack["scores"]
-
-        context = "\n".join([d.page_content for d in docs]) if docs else ""
-
-        if (not context.strip()) or (not retrieval_is_relevant(score_type, scores, docs=docs)):
+    def invoke(self, question: str, deadline: Optional[Deadline] = None, session_id: Optional[str] = None) -> str:
+        """Raises RequestCancelled if `deadline` is cancelled or expires on the way."""
+        with span("request"):
+            prompt = self._build_prompt(question, deadline=deadline, session_id=session_id)
+            if prompt is None:
+                ANSWERS.inc(source="idk")
+                answer = "I don't know."
+            else:
+                with span("generate"):
+                    answer = resources.run_generate(self.llm.generate, prompt, deadline=deadline)
+            memory.record(session_id, question, answer)
+            return answer
+
+    def stream(self, question: str, deadline: Optional[Deadline] = None, session_id: Optional[str] = None):
+        prompt = self._build_prompt(question, deadline=deadline, session_id=session_id)
+        if prompt is None:
+            ANSWERS.inc(source="idk")
+            memory.record(session_id, question, "I don't know.")
             yield "I don't know."
             return
-
-        prompt = RAG_PROMPT_TEMPLATE.format(context=context, question=question)
-        yield from self.llm.stream(prompt)
+        parts: List[str] = []
+        for piece in self.llm.stream(prompt, deadline=deadline):
+            parts.append(piece)
+            yield piece
+        memory.record(session_id, question, "".join(parts))
 
 
 def get_sources(question: str, k: int = RETRIEVAL_K_DEFAULT) -> List[Dict[str, Any]]:
@@ -628,7 +1245,7 @@ def get_sources(question: str, k: int = RETRIEVAL_K_DEFAULT) -> List[Dict[str, A
     score_type = pack["score_type"]
     scores = pack["scores"]
 
-    if (not docs) or (not retrieval_is_relevant(score_type, scores, docs=docs)):
+    if (not docs) or (not pack_is_relevant(pack)):
         return []
 
     items: List[Dict[str, Any]] = []
@@ -647,20 +1264,62 @@ def get_sources(question: str, k: int = RETRIEVAL_K_DEFAULT) -> List[Dict[str, A
     return items
 
 
-def build_rag_chain() -> Tuple[RAGBitNetChain, BaseRetriever]:
-    global vectorstore
+def build_rag_chain() -> Tuple[RAGBitNetChain, "BaseRetriever"]:
+    global vectorstore, embeddings, quant_index, bm25_index
     logger.info("🛠️ [RAG] Building components (Embeddings + VectorStore + Retriever + LLM)...")
-
-    embeddings = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
+    resources.configure()
+
+    # With INFERENCE_SOCKET set, models live in the shared inference process
+    client: Optional[InferenceClient] = None
+    info: Dict[str, Any] = {}
+    state.set_phase("loading_embeddings")
+    if INFERENCE_SOCKET:
+        client = InferenceClient(INFERENCE_SOCKET)
+        info = client.wait_ready()
+        logger.info("🔌 [RAG] Using inference process at %s (pid=%s).", INFERENCE_SOCKET, info.get("pid"))
+        embeddings = RemoteEmbeddings(client)
+    else:
+        embeddings = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
+
+    state.set_phase("loading_index")
     vectorstore = _build_vectorstore(embeddings)
 
+    try:
+        quant_index = _build_quant_index(vectorstore)
+    except Exception as e:
+        quant_index = None
+        logger.warning("⚠️ [Quant] Could not build quantized index; using full precision. err=%s", e)
+
+    try:
+        bm25_index = _build_lexical_index(vectorstore)
+    except Exception as e:
+        bm25_index = None
+        logger.warning("⚠️ [BM25] Could not build lexical index; dense-only retrieval. err=%s", e)
+    # Rejections recorded against the previous index no longer hold
+    negative_cache.set_vocabulary(bm25_index.vocabulary if bm25_index is not None else None)
+
     retriever_obj = vectorstore.as_retriever(search_kwargs={"k": RETRIEVAL_K_DEFAULT})
 
-    llm = DualChatModel(bitnet_path=BITNET_MODEL_PATH, fallback_path=FALLBACK_MODEL_PATH)
-    return RAGBitNetChain(retriever_obj, llm), retriever_obj
+    state.set_phase("loading_models")
+    reranker_obj: Optional[Reranker] = None
+    if RERANK_ENABLED:
+        try:
+            if client is not None:
+                reranker_obj = Reranker(RERANK_MODEL, model=RemoteCrossEncoder(client)) if info.get("rerank") else None
+            else:
+                reranker_obj = Reranker(RERANK_MODEL)
+        except Exception as e:
+            logger.warning("⚠️ [Rerank] Cross-encoder failed to load; reranking disabled. err=%s", e)
+
+    if client is not None:
+        llm = RemoteChatModel(client, info)
+    else:
+        llm = DualChatModel(bitnet_path=BITNET_MODEL_PATH, fallback_path=FALLBACK_MODEL_PATH)
+    memory.llm_generate = lambda prompt: resources.run_generate(llm.generate_text, prompt)
+    return RAGBitNetChain(retriever_obj, llm, reranker_obj), retriever_obj
 
 
-def reindex_all() -> Tuple[RAGBitNetChain, BaseRetriever]:
+def reindex_all() -> Tuple[RAGBitNetChain, "BaseRetriever"]:
     if os.path.exists(CHROMA_DIR):
         shutil.rmtree(CHROMA_DIR)
     return build_rag_chain()
@@ -678,38 +1337,67 @@ def smoke_test_generation() -> Optional[str]:
 def initialize_global_vars(force: bool = False) -> ServiceState:
     global rag_chain, retriever
 
-    if state.initialized and not force:
-        logger.info("ℹ️ [System] RAG already initialized; skipping.")
-        return state
+    with _init_lock:
+        if state.initialized and not force:
+            logger.info("ℹ️ [System] RAG already initialized; skipping.")
+            return state
 
-    state.initialized = False
-    state.model_loaded = False
-    state.init_error = None
+        state.initialized = False
+        state.model_loaded = False
+        state.init_error = None
 
-    try:
-        logger.info("🌟 [System] Starting Global RAG Initialization...")
-        rag_chain, retriever = build_rag_chain()
+        try:
+            logger.info("🌟 [System] Starting Global RAG Initialization...")
+            rag_chain, retriever = build_rag_chain()
+
+            state.initialized = True
+            state.model_loaded = bool(rag_chain and rag_chain.llm and rag_chain.llm.model)
+
+            if not state.model_loaded:
+                state.init_error = "No usable LLM model loaded (BitNet + fallback failed)."
+                logger.error("⚠️ [System] %s", state.init_error)
+                state.set_phase("failed")
+                return state
+
+            state.set_phase("smoke_test")
+            err = smoke_test_generation()
+            if err is None:
+                state.init_error = None
+                logger.info("✅ [System] Smoke test passed. Model ready.")
+                state.set_phase("ready")
+            else:
+                state.init_error = err
+                logger.warning("⚠️ [System] Smoke test warning: %s", err)
+                state.set_phase("degraded")
 
-        state.initialized = True
-        state.model_loaded = bool(rag_chain and rag_chain.llm and rag_chain.llm.model)
+        except Exception as e:
+            state.initialized = True
+            state.model_loaded = False
+            state.init_error = str(e)
+            logger.critical("💥 [System] Global initialization failed.", exc_info=True)
+            state.set_phase("failed")
 
-        if not state.model_loaded:
-            state.init_error = "No usable LLM model loaded (BitNet + fallback failed)."
-            logger.error("⚠️ [System] %s", state.init_error)
-            return state
+        return state
 
-        err = smoke_test_generation()
-        if err is None:
-            state.init_error = None
-            logger.info("✅ [System] Smoke test passed. Model ready.")
-        else:
-            state.init_error = err
-            logger.warning("⚠️ [System] Smoke test warning: %s", err)
 
-    except Exception as e:
-        state.initialized = True
-        state.model_loaded = False
-        state.init_error = str(e)
-        logger.critical("💥 [System] Global initialization failed.", exc_info=True)
+def start_background_warmup(force: bool = False) -> Optional[threading.Thread]:
+    """
+    Run initialize_global_vars on a daemon thread and return immediately.
+    Progress is visible through state.phase; a second call while warm-up is
+    running (or after it finished, unless force) is a no-op.
+    """
+    global _warmup_thread
+
+    if _warmup_thread is not None and _warmup_thread.is_alive():
+        return _warmup_thread
+    if state.initialized and not force:
+        return None
 
-    return state
\ No newline at end of file
+    _warmup_thread = threading.Thread(
+        target=initialize_global_vars,
+        kwargs={"force": force},
+        name="rag-warmup",
+        daemon=True,
+    )
+    _warmup_thread.start()
+    return _warmup_thread
\ No newline at end of file
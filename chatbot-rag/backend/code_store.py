@@ -0,0 +1,240 @@
+import os
+import hmac
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional, Sequence, Tuple
+
+logger = logging.getLogger("RAG_CODES")
+
+# ------------------------------------------------------------------------------
+# Verification codes + rate limits
+#
+# Codes live in SQLite (users.db by default, its own tables) so every uvicorn
+# worker sees them and they survive restarts. Each row carries expires_at:
+# reads treat expired rows as absent (lazy expiry) and sweep() deletes them in
+# bulk, opportunistically on writes and from a background thread, so the table
+# only ever holds codes issued in the last VERIFICATION_CODE_TTL_S.
+#
+# Rate limits are token buckets in the same database, one row per key
+# ("email:<addr>" / "ip:<addr>"). check_rate() reads both buckets in one
+# IMMEDIATE transaction and spends from them only if both allow, so workers
+# can't both spend the last token and a throttled address doesn't drain its IP.
+# ------------------------------------------------------------------------------
+VERIFICATION_DB = os.getenv("VERIFICATION_DB", os.getenv("USERS_DB", "users.db"))
+VERIFICATION_CODE_TTL_S = float(os.getenv("VERIFICATION_CODE_TTL_S", "600"))
+# Wrong guesses allowed per code before it is burned
+VERIFICATION_MAX_ATTEMPTS = int(os.getenv("VERIFICATION_MAX_ATTEMPTS", "5"))
+CODE_SWEEP_INTERVAL_S = float(os.getenv("CODE_SWEEP_INTERVAL_S", "60"))
+# Token buckets: burst size and sustained requests per hour
+CODE_EMAIL_BURST = float(os.getenv("CODE_EMAIL_BURST", "3"))
+CODE_EMAIL_PER_HOUR = float(os.getenv("CODE_EMAIL_PER_HOUR", "6"))
+CODE_IP_BURST = float(os.getenv("CODE_IP_BURST", "10"))
+CODE_IP_PER_HOUR = float(os.getenv("CODE_IP_PER_HOUR", "60"))
+CODE_DB_POOL_SIZE = int(os.getenv("CODE_DB_POOL_SIZE", "2"))
+
+
+class RateLimited(Exception):
+    def __init__(self, key: str, retry_after: float):
+        super().__init__(f"rate limited ({key}); retry in {retry_after:.0f}s")
+        self.key = key
+        self.retry_after = retry_after
+
+
+class VerificationCodeStore:
+    _PUT = (
+        "INSERT INTO verification_codes (email, code, expires_at, attempts) VALUES (?, ?, ?, 0) "
+        "ON CONFLICT(email) DO UPDATE SET code = excluded.code, expires_at = excluded.expires_at, attempts = 0"
+    )
+    _GET = "SELECT code, expires_at, attempts FROM verification_codes WHERE email = ?"
+    _DELETE = "DELETE FROM verification_codes WHERE email = ?"
+    _MISS = "UPDATE verification_codes SET attempts = attempts + 1 WHERE email = ?"
+    _BUCKET = "SELECT tokens, updated_at FROM rate_buckets WHERE key = ?"
+    _SET_BUCKET = "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?)"
+    _SWEEP_CODES = "DELETE FROM verification_codes WHERE expires_at <= ?"
+    # A bucket that has refilled completely is the same as no row at all
+    _SWEEP_BUCKETS = "DELETE FROM rate_buckets WHERE full_at <= ?"
+
+    def __init__(self, path: str = VERIFICATION_DB, pool_size: int = CODE_DB_POOL_SIZE):
+        self.path = path
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        conn = self._connect()
+        try:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS verification_codes (
+                    email TEXT PRIMARY KEY,
+                    code TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS verification_codes_expiry ON verification_codes (expires_at);
+                CREATE TABLE IF NOT EXISTS rate_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    full_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS rate_buckets_full ON rate_buckets (full_at);
+                """
+            )
+        finally:
+            conn.close()
+        for _ in range(max(1, pool_size)):
+            self._pool.put(self._connect())
+        self._last_sweep = 0.0
+        self._sweeper: Optional[threading.Thread] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10.0, check_same_thread=False, isolation_level=None, cached_statements=32)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=10000")
+        return conn
+
+    @contextmanager
+    def _conn(self) -> Iterator[sqlite3.Connection]:
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    # --- codes ---
+    def put(self, email: str, code: str, ttl_s: float = VERIFICATION_CODE_TTL_S) -> None:
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(self._PUT, (email, code, now + ttl_s))
+        self._maybe_sweep(now)
+
+    def discard(self, email: str) -> None:
+        with self._conn() as conn:
+            conn.execute(self._DELETE, (email,))
+
+    def check(self, email: str, code: str, max_attempts: int = VERIFICATION_MAX_ATTEMPTS) -> bool:
+        """True (and the code is consumed) on a match; wrong guesses count toward max_attempts."""
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(self._GET, (email,)).fetchone()
+                if row is None:
+                    ok = False
+                elif row[1] <= now:
+                    conn.execute(self._DELETE, (email,))
+                    ok = False
+                elif hmac.compare_digest(str(row[0]), str(code)):
+                    conn.execute(self._DELETE, (email,))
+                    ok = True
+                else:
+                    if row[2] + 1 >= max_attempts:
+                        conn.execute(self._DELETE, (email,))
+                    else:
+                        conn.execute(self._MISS, (email,))
+                    ok = False
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return ok
+
+    # --- rate limits ---
+    def take(self, key: str, burst: float, per_hour: float) -> Tuple[bool, float]:
+        """Spend one token from `key`'s bucket. Returns (allowed, seconds until a token is available)."""
+        denied, retry_after = self.take_all([(key, burst, per_hour)])
+        return denied is None, retry_after
+
+    def take_all(self, buckets: Sequence[Tuple[str, float, float]]) -> Tuple[Optional[str], float]:
+        """Spend one token from every (key, burst, per_hour) bucket, or from none of them.
+
+        Returns (None, 0.0) when all allowed; otherwise the key of the empty bucket
+        with the longest wait and that wait in seconds. Nothing is charged then.
+        """
+        buckets = [(k, b, p) for k, b, p in buckets if b > 0 and p > 0]
+        if not buckets:
+            return None, 0.0
+        now = time.time()
+        denied: Optional[str] = None
+        wait = 0.0
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                spent = []
+                for key, burst, per_hour in buckets:
+                    rate = per_hour / 3600.0
+                    row = conn.execute(self._BUCKET, (key,)).fetchone()
+                    tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                    if tokens < 1.0:
+                        if (1.0 - tokens) / rate > wait:
+                            denied, wait = key, (1.0 - tokens) / rate
+                    else:
+                        tokens -= 1.0
+                        spent.append((key, tokens, now, now + (burst - tokens) / rate))
+                if denied is None:
+                    conn.executemany(self._SET_BUCKET, spent)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return denied, wait
+
+    # --- expiry ---
+    def sweep(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        self._last_sweep = now
+        with self._conn() as conn:
+            removed = conn.execute(self._SWEEP_CODES, (now,)).rowcount
+            removed += conn.execute(self._SWEEP_BUCKETS, (now,)).rowcount
+        if removed:
+            logger.info("🧹 [Codes] Swept %d expired rows.", removed)
+        return removed
+
+    def _maybe_sweep(self, now: float) -> None:
+        if now - self._last_sweep >= CODE_SWEEP_INTERVAL_S:
+            self.sweep(now)
+
+    def start_sweeper(self, interval_s: float = CODE_SWEEP_INTERVAL_S) -> None:
+        """Daemon thread that sweeps every interval_s, for idle periods with no writes."""
+        if self._sweeper is not None or interval_s <= 0:
+            return
+
+        def _loop() -> None:
+            while True:
+                time.sleep(interval_s)
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.warning("⚠️ [Codes] Sweep failed: %s", e)
+
+        self._sweeper = threading.Thread(target=_loop, name="code-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def count(self) -> int:
+        with self._conn() as conn:
+            return int(conn.execute("SELECT COUNT(*) FROM verification_codes").fetchone()[0])
+
+
+_store: Optional[VerificationCodeStore] = None
+_store_lock = threading.Lock()
+
+
+def get_code_store() -> VerificationCodeStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = VerificationCodeStore(VERIFICATION_DB)
+    return _store
+
+
+def check_rate(email: str, ip: Optional[str]) -> None:
+    """Spend one per-email and one per-IP token; raises RateLimited (charging neither) if either bucket is empty."""
+    checks = [(f"email:{email.lower()}", CODE_EMAIL_BURST, CODE_EMAIL_PER_HOUR)]
+    if ip:
+        checks.append((f"ip:{ip}", CODE_IP_BURST, CODE_IP_PER_HOUR))
+    denied, retry_after = get_code_store().take_all(checks)
+    if denied is not None:
+        raise RateLimited(denied, retry_after)
@@ -0,0 +1,111 @@
+import os
+import logging
+from dataclasses import dataclass
+from typing import List, Callable, Optional
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger("RAG_PACKER")
+
+# ------------------------------------------------------------------------------
+# Config
+# ------------------------------------------------------------------------------
+# Tokens of retrieved text allowed into {context}. BitNet has 2048 positions; the
+# template, question and GEN_MAX_NEW_TOKENS need the rest.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1024"))
+
+# Overlap between adjacent chunks is at most the splitter's chunk_overlap (80);
+# look a little further in case chunks come from a differently-split index.
+CONTEXT_MAX_OVERLAP_CHARS = int(os.getenv("CONTEXT_MAX_OVERLAP_CHARS", "200"))
+CONTEXT_MIN_OVERLAP_CHARS = int(os.getenv("CONTEXT_MIN_OVERLAP_CHARS", "20"))
+
+
+@dataclass
+class PackedContext:
+    context: str
+    docs: List[Document]
+    tokens_used: int
+    tokens_raw: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.tokens_raw - self.tokens_used)
+
+
+def _overlap(head: str, tail: str) -> int:
+    """Length of the longest suffix of `head` that is a prefix of `tail`."""
+    longest = min(len(head), len(tail), CONTEXT_MAX_OVERLAP_CHARS)
+    for n in range(longest, CONTEXT_MIN_OVERLAP_CHARS - 1, -1):
+        if head.endswith(tail[:n]):
+            return n
+    return 0
+
+
+def _dedupe(text: str, source: str, kept: List[Document]) -> str:
+    """Strip spans of `text` already present in kept chunks from the same file."""
+    for d in kept:
+        if (d.metadata or {}).get("source") != source:
+            continue
+        prev = d.page_content or ""
+        if text in prev:
+            return ""
+        n = _overlap(prev, text)
+        if n:
+            text = text[n:].lstrip()
+        n = _overlap(text, prev)
+        if n:
+            text = text[:-n].rstrip()
+    return text
+
+
+def _truncate_to_budget(text: str, budget: int, count_tokens: Callable[[str], int]) -> str:
+    # Binary search on character length; tokenizers are monotone enough for this.
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    cut = text[:lo]
+    # Prefer ending on a sentence or word boundary
+    for sep in (". ", "\n", " "):
+        idx = cut.rfind(sep)
+        if idx > len(cut) // 2:
+            return cut[: idx + 1].rstrip()
+    return cut
+
+
+def pack_context(
+    docs: List[Document],
+    count_tokens: Callable[[str], int],
+    budget: Optional[int] = None,
+) -> PackedContext:
+    """
+    Fill the context with chunks in the order given (best first) until `budget`
+    tokens are used, removing text duplicated by the splitter's chunk overlap.
+    tokens_raw is what the naive newline join of every chunk would have cost.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    tokens_raw = sum(count_tokens(d.page_content or "") for d in docs)
+
+    kept: List[Document] = []
+    parts: List[str] = []
+    used = 0
+    for d in docs:
+        text = _dedupe((d.page_content or "").strip(), (d.metadata or {}).get("source"), kept)
+        if not text:
+            continue
+        cost = count_tokens(text)
+        if used + cost > budget:
+            if parts:
+                continue  # a later, shorter chunk may still fit
+            text = _truncate_to_budget(text, budget, count_tokens)
+            cost = count_tokens(text)
+            if not text:
+                break
+        kept.append(Document(page_content=text, metadata=d.metadata))
+        parts.append(text)
+        used += cost
+
+    return PackedContext(context="\n".join(parts), docs=kept, tokens_used=used, tokens_raw=tokens_raw)
@@ -0,0 +1,318 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from lexical_index import tokenize
+
+logger = logging.getLogger("RAG_MEMORY")
+
+# ------------------------------------------------------------------------------
+# Conversation memory
+#
+# One session per JWT subject, in process memory (bounded LRU, idle TTL). A
+# session keeps its last SESSION_RECENT_TURNS turns verbatim plus a rolling
+# summary of everything older. Turns that fall out of the recent window are
+# folded into the summary on a background thread, never on the request path.
+#
+# history_block() renders summary + recent turns newest-first into at most
+# HISTORY_TOKEN_BUDGET tokens, so a long chat costs the same prefill as a short
+# one. Under prefork each worker has its own sessions.
+#
+#   SUMMARY_MODE=extractive (default)  first sentence of each Q/A, oldest dropped
+#   SUMMARY_MODE=llm                   ask the chat model to rewrite the summary
+#
+# condense() turns a follow-up ("what about at night?") into a standalone
+# retrieval query by prefixing the session's current topic, i.e. the last
+# question that stood on its own. The follow-up's vector is a blend of its own
+# embedding and the topic's stored one, so the (longer) condensed text is never
+# embedded; results are memoized per session.
+# ------------------------------------------------------------------------------
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "256"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "96"))
+SESSION_RECENT_TURNS = int(os.getenv("SESSION_RECENT_TURNS", "4"))
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "3600"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "extractive").lower()
+CONDENSE_ENABLED = os.getenv("CONDENSE", "1") == "1"
+# A question with at most this many content words (after stopwords) may be a follow-up
+CONDENSE_MAX_CONTENT_WORDS = int(os.getenv("CONDENSE_MAX_CONTENT_WORDS", "3"))
+# Weight of the follow-up's own embedding vs. the topic's in the blended vector
+CONDENSE_BLEND = float(os.getenv("CONDENSE_BLEND", "0.5"))
+CONDENSE_MEMO_SIZE = int(os.getenv("CONDENSE_MEMO_SIZE", "32"))
+
+SUMMARY_PROMPT_TEMPLATE = """Rewrite the summary of a conversation so it also covers the new turns.
+Keep it under 60 words. Keep names, feelings and topics; drop greetings.
+
+Summary so far:
+{summary}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_FOLLOWUP_OPENERS = ("what about", "how about", "and ", "but ", "also ", "what if", "same ", "how come")
+_REFERRING_WORDS = frozenset(
+    "it that this they them those these there he she him her its their more else again other another same".split()
+)
+
+
+@dataclass
+class Turn:
+    question: str
+    answer: str
+
+
+@dataclass
+class Session:
+    recent: Deque[Turn] = field(default_factory=deque)
+    summary: str = ""
+    # Turns evicted from `recent` but not yet folded into `summary`
+    pending: List[Turn] = field(default_factory=list)
+    last_used: float = field(default_factory=time.monotonic)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    summarizing: bool = False
+    # Last standalone question and its query vector; follow-ups are condensed against it
+    topic: str = ""
+    topic_vec: Optional[List[float]] = None
+    # (normalized question, topic) -> (condensed query, query vector)
+    memo: "OrderedDict[Tuple[str, str], Tuple[str, Optional[List[float]]]]" = field(default_factory=OrderedDict)
+
+
+@dataclass
+class CondensedQuery:
+    query: str
+    followup: bool = False
+    # Memo hit: use as the query vector directly
+    query_vec: Optional[List[float]] = None
+    # Follow-up: the topic's vector, to blend with the question's own embedding
+    topic_vec: Optional[List[float]] = None
+    _key: Optional[Tuple[str, str]] = None
+
+
+def _first_sentence(text: str, max_chars: int) -> str:
+    text = " ".join((text or "").split())
+    head = _SENTENCE_END.split(text, 1)[0]
+    return head if len(head) <= max_chars else head[: max_chars - 1].rstrip() + "…"
+
+
+def _render_turn(turn: Turn) -> str:
+    return f"User: {turn.question}\nAssistant: {turn.answer}"
+
+
+class SessionMemory:
+    def __init__(self, max_sessions: int = SESSION_MAX, ttl_s: float = SESSION_TTL_S):
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._summarizer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
+        # Set by the chain when SUMMARY_MODE=llm: prompt -> text
+        self.llm_generate: Optional[Callable[[str], str]] = None
+
+    def _session(self, session_id: str, create: bool) -> Optional[Session]:
+        now = time.monotonic()
+        with self._lock:
+            s = self._sessions.get(session_id)
+            if s is not None and now - s.last_used > self.ttl_s:
+                del self._sessions[session_id]
+                s = None
+            if s is None:
+                if not create:
+                    return None
+                s = self._sessions[session_id] = Session()
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(session_id)
+            s.last_used = now
+            return s
+
+    def record(self, session_id: Optional[str], question: str, answer: str) -> None:
+        """Append a finished turn; older turns are summarized in the background."""
+        if not session_id:
+            return
+        s = self._session(session_id, create=True)
+        with s.lock:
+            s.recent.append(Turn(question.strip(), answer.strip()))
+            while len(s.recent) > SESSION_RECENT_TURNS:
+                s.pending.append(s.recent.popleft())
+            if not s.pending or s.summarizing:
+                return
+            s.summarizing = True
+        self._summarizer.submit(self._fold, s)
+
+    def _fold(self, s: Session) -> None:
+        while True:
+            with s.lock:
+                turns, s.pending = s.pending, []
+                summary = s.summary
+                if not turns:
+                    s.summarizing = False
+                    return
+            try:
+                summary = self._summarize(summary, turns)
+            except Exception as e:
+                logger.warning("⚠️ [Memory] Summary update failed; using extractive: %s", e)
+                summary = _extractive_summary(summary, turns)
+            with s.lock:
+                s.summary = summary
+
+    def _summarize(self, summary: str, turns: List[Turn]) -> str:
+        if SUMMARY_MODE == "llm" and self.llm_generate is not None:
+            prompt = SUMMARY_PROMPT_TEMPLATE.format(
+                summary=summary or "(none)", turns="\n".join(_render_turn(t) for t in turns)
+            )
+            out = (self.llm_generate(prompt) or "").strip()
+            if out and not out.startswith("Error:"):
+                return _clip_words(out, SUMMARY_TOKEN_BUDGET)
+        return _extractive_summary(summary, turns)
+
+    def condense(self, session_id: Optional[str], question: str) -> CondensedQuery:
+        """Standalone retrieval query for `question` given the session's topic."""
+        s = self._session(session_id, create=False) if session_id and CONDENSE_ENABLED else None
+        if s is None:
+            return CondensedQuery(query=question)
+        key = (_normalize(question), "")
+        with s.lock:
+            topic, topic_vec = s.topic, s.topic_vec
+            followup = bool(topic) and is_followup(question)
+            if followup:
+                key = (key[0], topic)
+            hit = s.memo.get(key)
+            if hit is not None:
+                s.memo.move_to_end(key)
+            if not followup:
+                # A standalone question moves the topic even if it is never searched
+                s.topic, s.topic_vec = question.strip(), hit[1] if hit is not None else None
+        if hit is not None:
+            return CondensedQuery(query=hit[0], followup=followup, query_vec=hit[1], _key=key)
+        if not followup:
+            return CondensedQuery(query=question, _key=key)
+        return CondensedQuery(query=f"{topic} {question.strip()}", followup=True, topic_vec=topic_vec, _key=key)
+
+    def remember_query(
+        self, session_id: Optional[str], question: str, condensed: CondensedQuery, query_vec: Optional[List[float]]
+    ) -> None:
+        """Memoize the condensed query/vector; a standalone question becomes the new topic."""
+        if not session_id or not CONDENSE_ENABLED:
+            return
+        s = self._session(session_id, create=True)
+        key = condensed._key or (_normalize(question), "")
+        with s.lock:
+            s.memo[key] = (condensed.query, query_vec)
+            s.memo.move_to_end(key)
+            while len(s.memo) > CONDENSE_MEMO_SIZE:
+                s.memo.popitem(last=False)
+            if not condensed.followup:
+                s.topic, s.topic_vec = question.strip(), query_vec
+
+    def history(self, session_id: Optional[str]) -> List[Turn]:
+        s = self._session(session_id, create=False) if session_id else None
+        if s is None:
+            return []
+        with s.lock:
+            return list(s.recent)
+
+    def history_block(
+        self, session_id: Optional[str], count_tokens: Callable[[str], int], budget: int = HISTORY_TOKEN_BUDGET
+    ) -> str:
+        """Summary + newest turns that fit in `budget` tokens; "" for a new or anonymous session."""
+        s = self._session(session_id, create=False) if session_id else None
+        if s is None or budget <= 0:
+            return ""
+        with s.lock:
+            recent = list(s.recent)
+            summary = s.summary
+
+        parts: List[str] = []
+        used = 0
+        for turn in reversed(recent):
+            text = _render_turn(turn)
+            cost = count_tokens(text) + 1
+            if used + cost > budget:
+                break
+            parts.append(text)
+            used += cost
+        parts.reverse()
+        if summary:
+            line = f"Earlier: {summary}"
+            cost = count_tokens(line) + 1
+            if used + cost <= budget:
+                parts.insert(0, line)
+        return "\n".join(parts)
+
+    def forget(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"sessions": len(self._sessions), "max_sessions": self.max_sessions}
+
+
+def _normalize(text: str) -> str:
+    return " ".join((text or "").lower().split())
+
+
+def is_followup(question: str) -> bool:
+    """
+    Short question that leans on earlier turns: it opens with a continuation
+    ("what about at night?") or refers back ("is it normal?", "tell me more").
+    A short question that does neither ("what is anxiety?") stands on its own.
+    """
+    q = _normalize(question)
+    if len(tokenize(q)) > CONDENSE_MAX_CONTENT_WORDS:
+        return False
+    if q.startswith(_FOLLOWUP_OPENERS):
+        return True
+    words = set(re.findall(r"[a-z']+", q))
+    return bool(words & _REFERRING_WORDS)
+
+
+def blend_query_vectors(own: List[float], topic: List[float], weight: float = CONDENSE_BLEND) -> List[float]:
+    """weight * own + (1 - weight) * topic, on unit vectors, rescaled to the topic's norm."""
+    a = np.asarray(own, dtype=np.float32)
+    b = np.asarray(topic, dtype=np.float32)
+    na, nb = float(np.linalg.norm(a)), float(np.linalg.norm(b))
+    if na == 0.0 or nb == 0.0:
+        return list(own)
+    v = weight * (a / na) + (1.0 - weight) * (b / nb)
+    nv = float(np.linalg.norm(v))
+    return (v * (nb / nv)).tolist() if nv > 0 else list(own)
+
+
+def _clip_words(text: str, max_tokens: int) -> str:
+    # ~0.75 words per token; callers only need a bound, not an exact count.
+    # Keeps the start: a summary leads with the oldest, most topical context.
+    words = text.split()
+    limit = max(1, int(max_tokens * 0.75))
+    return " ".join(words[:limit]) if len(words) > limit else text
+
+
+def _extractive_summary(summary: str, turns: List[Turn]) -> str:
+    """Append one short line per turn and keep the newest that fit the budget."""
+    lines = [l for l in summary.split(" | ") if l] if summary else []
+    for t in turns:
+        lines.append(f"asked {_first_sentence(t.question, 80)} -> {_first_sentence(t.answer, 100)}")
+    limit = max(1, int(SUMMARY_TOKEN_BUDGET * 0.75))
+    kept: List[str] = []
+    words = 0
+    for line in reversed(lines):
+        n = len(line.split())
+        if kept and words + n > limit:
+            break
+        kept.append(line)
+        words += n
+    kept.reverse()
+    return " | ".join(kept)
+
+
+memory = SessionMemory()
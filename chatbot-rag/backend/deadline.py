@@ -0,0 +1,113 @@
+import os
+import time
+import threading
+from typing import Optional
+
+# ------------------------------------------------------------------------------
+# Request deadlines / cooperative cancellation
+#
+# api_v2 creates one Deadline per request and hands it down the pipeline
+# (retrieve_with_scores -> rerank -> DualChatModel.generate). Stages call
+# check() between steps; HF generate() gets criterion() as a stopping
+# criterion so it looks at the deadline after every token. cancel() is safe
+# from any thread, e.g. the event loop when the client disconnects while
+# generation runs in a pool.
+# ------------------------------------------------------------------------------
+REQUEST_TIMEOUT_S = float(os.getenv("REQUEST_TIMEOUT_S", "60"))
+
+
+class RequestCancelled(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Deadline:
+    def __init__(self, timeout_s: Optional[float] = REQUEST_TIMEOUT_S):
+        self.started = time.monotonic()
+        self.expires_at = self.started + timeout_s if timeout_s and timeout_s > 0 else None
+        self._cancelled = threading.Event()
+        self._reason = ""
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        if not self._cancelled.is_set():
+            self._reason = reason
+            self._cancelled.set()
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    @property
+    def done(self) -> bool:
+        return self._cancelled.is_set() or self.expired
+
+    @property
+    def reason(self) -> str:
+        if self._cancelled.is_set():
+            return self._reason
+        return "deadline exceeded" if self.expired else ""
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left (None = no time limit); 0 once cancelled or expired."""
+        if self._cancelled.is_set():
+            return 0.0
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self, stage: str = "") -> None:
+        if self.done:
+            raise RequestCancelled(f"{self.reason} ({stage})" if stage else self.reason)
+
+    def criterion(self):
+        """HF StoppingCriteria that ends the whole batch once this deadline is done."""
+        from transformers import StoppingCriteria  # type: ignore
+
+        deadline = self
+
+        class _DeadlineCriteria(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                import torch
+
+                return torch.full((input_ids.shape[0],), deadline.done, dtype=torch.bool, device=input_ids.device)
+
+        return _DeadlineCriteria()
+
+
+class DeadlineGroup(Deadline):
+    """
+    Deadline for work shared by several requests (one generate batch): done
+    only once every member is, so one caller leaving doesn't stop the others.
+    """
+
+    def __init__(self, members):
+        super().__init__(None)
+        self.members = list(members)
+
+    @property
+    def expired(self) -> bool:
+        return all(d.expired for d in self.members)
+
+    @property
+    def done(self) -> bool:
+        return self._cancelled.is_set() or all(d.done for d in self.members)
+
+    @property
+    def reason(self) -> str:
+        if self._cancelled.is_set():
+            return self._reason
+        return self.members[0].reason if self.done and self.members else ""
+
+    def remaining(self) -> Optional[float]:
+        if self._cancelled.is_set():
+            return 0.0
+        left = [d.remaining() for d in self.members]
+        return None if None in left else max(left, default=0.0)
+
+
+def check_deadline(deadline: Optional[Deadline], stage: str = "") -> None:
+    """check() that tolerates deadline=None (callers outside a request)."""
+    if deadline is not None:
+        deadline.check(stage)
+
@@ -0,0 +1,486 @@
+import os
+import json
+import time
+import select
+import socket
+import struct
+import asyncio
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from deadline import Deadline, DeadlineGroup, RequestCancelled, check_deadline
+
+logger = logging.getLogger("RAG_INFERENCE")
+
+# ------------------------------------------------------------------------------
+# Dedicated inference process
+#
+# One process loads the embedder, the LLMs (and the cross-encoder when RERANK=1)
+# and serves them over a local Unix socket. API workers started with
+# INFERENCE_SOCKET set talk to it through the Remote* classes below instead of
+# loading their own copies, so model memory stays constant as workers scale.
+#
+# Wire format: 4-byte big-endian length + UTF-8 JSON, both directions.
+#   request:  {"id": int, "op": "info" | "embed" | "generate" | "complete" | "rerank", ...}
+#             ("generate"/"complete" may carry "timeout_s": the caller's remaining deadline;
+#             "complete" is a raw, unbatched completion for internal prompts)
+#             {"id": int, "op": "cancel"} stops generate/complete request `id` (no response)
+#   response: {"id": int, "ok": true, "result": ...} | {"id": int, "ok": false, "error": str}
+# A generate request is also cancelled when its connection closes. Either way
+# the server-side Deadline stops decoding at the next token.
+# Requests for the same op arriving within INFERENCE_BATCH_WINDOW_MS are run as
+# one batch (one encode() / one padded generate() / one predict()).
+# ------------------------------------------------------------------------------
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "")
+INFERENCE_BATCH_WINDOW_MS = float(os.getenv("INFERENCE_BATCH_WINDOW_MS", "5"))
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "8"))
+INFERENCE_TIMEOUT_S = float(os.getenv("INFERENCE_TIMEOUT_S", "120"))
+# How long an API worker waits for the inference process to come up
+INFERENCE_CONNECT_TIMEOUT_S = float(os.getenv("INFERENCE_CONNECT_TIMEOUT_S", "300"))
+# While a generate call waits, how often the caller's Deadline is checked, and how
+# long the server gets to answer a cancel before the connection is dropped instead
+INFERENCE_CANCEL_POLL_S = float(os.getenv("INFERENCE_CANCEL_POLL_S", "0.1"))
+INFERENCE_CANCEL_GRACE_S = float(os.getenv("INFERENCE_CANCEL_GRACE_S", "2"))
+
+_HEADER = struct.Struct(">I")
+
+
+def _encode(msg: Dict[str, Any]) -> bytes:
+    body = json.dumps(msg).encode("utf-8")
+    return _HEADER.pack(len(body)) + body
+
+
+# ------------------------------------------------------------------------------
+# Client side (API workers)
+# ------------------------------------------------------------------------------
+class InferenceClient:
+    """Blocking client; each calling thread gets its own connection."""
+
+    def __init__(self, socket_path: str = INFERENCE_SOCKET, timeout: float = INFERENCE_TIMEOUT_S):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._ids = 0
+        self._ids_lock = threading.Lock()
+
+    def _conn(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _drop(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except Exception:
+                pass
+
+    def _recv_exact(self, sock: socket.socket, n: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = sock.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("inference process closed the connection")
+            buf.extend(chunk)
+        return bytes(buf)
+
+    def _await_response(self, sock: socket.socket, req_id: int, deadline: Deadline) -> None:
+        """Block until a response is readable; tell the server to stop once `deadline` is done."""
+        waited = 0.0
+        cancelled_at: Optional[float] = None
+        while not select.select([sock], [], [], INFERENCE_CANCEL_POLL_S)[0]:
+            waited += INFERENCE_CANCEL_POLL_S
+            if cancelled_at is None and deadline.done:
+                sock.sendall(_encode({"id": req_id, "op": "cancel"}))
+                cancelled_at = waited
+            elif cancelled_at is not None and waited - cancelled_at >= INFERENCE_CANCEL_GRACE_S:
+                # Closing the connection cancels it server-side too
+                raise ConnectionError(f"inference request {req_id} not stopped after cancel")
+            if waited >= self.timeout:
+                raise socket.timeout(f"inference request {req_id} timed out")
+
+    def call(self, op: str, deadline: Optional[Deadline] = None, **payload: Any) -> Any:
+        with self._ids_lock:
+            self._ids += 1
+            req_id = self._ids
+
+        try:
+            sock = self._conn()
+            sock.sendall(_encode({"id": req_id, "op": op, **payload}))
+            if deadline is not None:
+                self._await_response(sock, req_id, deadline)
+            (size,) = _HEADER.unpack(self._recv_exact(sock, _HEADER.size))
+            resp = json.loads(self._recv_exact(sock, size).decode("utf-8"))
+            if resp.get("id") != req_id:
+                # A stale reply from an earlier request: the stream is out of step
+                raise ConnectionError(f"inference response id {resp.get('id')} does not match request {req_id}")
+        except Exception:
+            # Never reuse a connection that may hold a half-read frame
+            self._drop()
+            raise
+
+        if not resp.get("ok"):
+            raise RuntimeError(f"inference {op} failed: {resp.get('error')}")
+        return resp.get("result")
+
+    def wait_ready(self, timeout: float = INFERENCE_CONNECT_TIMEOUT_S) -> Dict[str, Any]:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.call("info")
+            except Exception as e:
+                if time.monotonic() >= deadline:
+                    raise RuntimeError(f"inference process at {self.socket_path} not reachable: {e}")
+                time.sleep(0.5)
+
+
+class RemoteEmbeddings(Embeddings):
+    def __init__(self, client: InferenceClient):
+        self.client = client
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.client.call("embed", texts=list(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.client.call("embed", texts=[text])[0]
+
+
+class RemoteCrossEncoder:
+    """Stands in for sentence_transformers.CrossEncoder inside reranker.Reranker."""
+
+    def __init__(self, client: InferenceClient):
+        self.client = client
+
+    def predict(self, pairs: List[Tuple[str, str]], batch_size: int = 32) -> List[float]:
+        return self.client.call("rerank", pairs=[list(p) for p in pairs])
+
+
+class RemoteChatModel:
+    """Same surface as chain_v2.DualChatModel, backed by the inference process."""
+
+    def __init__(self, client: InferenceClient, info: Dict[str, Any]):
+        self.client = client
+        self.info = info
+        self._tokenizer = None
+        self._tokenizer_tried = False
+
+    @property
+    def model(self):
+        # Truthy when the inference process has a usable LLM (used for readiness)
+        return self.info.get("model_loaded") or None
+
+    @property
+    def tokenizer(self):
+        # Tokenizers are small; load one locally so token counting stays in-process.
+        if not self._tokenizer_tried:
+            self._tokenizer_tried = True
+            path = self.info.get("tokenizer_path")
+            if path:
+                try:
+                    from transformers import AutoTokenizer  # type: ignore
+
+                    self._tokenizer = AutoTokenizer.from_pretrained(path, trust_remote_code=True)
+                except Exception as e:
+                    logger.warning("⚠️ [Inference] Local tokenizer %s unavailable; estimating tokens. err=%s", path, e)
+        return self._tokenizer
+
+    def count_tokens(self, text: str) -> int:
+        tok = self.tokenizer
+        if tok is None:
+            return max(1, len(text or "") // 4)
+        return len(tok.encode(text or "", add_special_tokens=False))
+
+    def generate(self, prompt: str, deadline: Optional[Deadline] = None) -> str:
+        check_deadline(deadline, "generate")
+        try:
+            timeout_s = deadline.remaining() if deadline is not None else None
+            return self.client.call("generate", deadline=deadline, prompt=prompt, timeout_s=timeout_s)
+        except Exception as e:
+            # The server stops at our deadline or cancel; report that as a cancellation, not a model error
+            check_deadline(deadline, "generate")
+            logger.error("❌ [Inference] Remote generation failed: %s", e)
+            return f"Error: Generation failed. {e}"
+
+    def generate_text(self, prompt: str, deadline: Optional[Deadline] = None) -> str:
+        check_deadline(deadline, "generate")
+        try:
+            timeout_s = deadline.remaining() if deadline is not None else None
+            return self.client.call("complete", deadline=deadline, prompt=prompt, timeout_s=timeout_s)
+        except Exception as e:
+            check_deadline(deadline, "generate")
+            logger.error("❌ [Inference] Remote completion failed: %s", e)
+            return f"Error: Generation failed. {e}"
+
+    def stream(self, prompt: str, deadline: Optional[Deadline] = None):
+        text = self.generate(prompt, deadline=deadline)
+        if text.startswith("Error:"):
+            yield text
+            return
+        for w in text.split():
+            check_deadline(deadline, "stream")
+            yield w + " "
+            time.sleep(0.01)
+
+
+# ------------------------------------------------------------------------------
+# Server side (the inference process)
+# ------------------------------------------------------------------------------
+class _Batcher:
+    """Collects submissions for up to window_s (or max_batch items) and runs them together."""
+
+    def __init__(self, name: str, fn: Callable[[List[Any]], List[Any]], executor: ThreadPoolExecutor):
+        self.name = name
+        self.fn = fn
+        self.executor = executor
+        self.queue: "asyncio.Queue[Tuple[Any, asyncio.Future]]" = asyncio.Queue()
+
+    async def submit(self, item: Any) -> Any:
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, fut))
+        return await fut
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        window = INFERENCE_BATCH_WINDOW_MS / 1000.0
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + window
+            while len(batch) < INFERENCE_MAX_BATCH:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.fn, items)
+            except Exception as e:
+                if isinstance(e, RequestCancelled):
+                    logger.info("⏹️ [Inference] %s batch of %d stopped: %s", self.name, len(items), e.reason)
+                else:
+                    logger.error("❌ [Inference] %s batch of %d failed: %s", self.name, len(items), e)
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            for (_, fut), res in zip(batch, results):
+                if fut.done():
+                    continue
+                if isinstance(res, Exception):
+                    fut.set_exception(res)
+                else:
+                    fut.set_result(res)
+
+
+def _request_deadline(timeout_s: Optional[float]) -> Deadline:
+    """Server-side Deadline for a generate request; timeout_s is what the caller had left."""
+    if timeout_s is None:
+        return Deadline(None)
+    deadline = Deadline(float(timeout_s))
+    if float(timeout_s) <= 0:
+        deadline.cancel("deadline exceeded")
+    return deadline
+
+
+def _split(flat: List[Any], sizes: List[int]) -> List[List[Any]]:
+    out, pos = [], 0
+    for n in sizes:
+        out.append(flat[pos:pos + n])
+        pos += n
+    return out
+
+
+class InferenceServer:
+    def __init__(self, socket_path: str):
+        import chain_v2
+        import resources
+        from reranker import RERANK_ENABLED, RERANK_MODEL
+
+        self.socket_path = socket_path
+        pools = resources.configure()
+
+        logger.info("📦 [Inference] Loading embeddings: %s", chain_v2.EMBED_MODEL)
+        self.embeddings = chain_v2.HuggingFaceEmbeddings(model_name=chain_v2.EMBED_MODEL)
+        self.llm = chain_v2.DualChatModel(bitnet_path=chain_v2.BITNET_MODEL_PATH, fallback_path=chain_v2.FALLBACK_MODEL_PATH)
+
+        self.cross_encoder = None
+        if RERANK_ENABLED:
+            try:
+                from sentence_transformers import CrossEncoder
+
+                self.cross_encoder = CrossEncoder(RERANK_MODEL)
+            except Exception as e:
+                logger.warning("⚠️ [Inference] Cross-encoder failed to load; rerank op disabled. err=%s", e)
+
+        tokenizer_path = None
+        if self.llm.bitnet.model is not None and self.llm.bitnet.tokenizer is not None:
+            tokenizer_path = chain_v2.BITNET_MODEL_PATH
+        elif self.llm.fallback.tokenizer is not None:
+            tokenizer_path = chain_v2.FALLBACK_MODEL_PATH
+
+        self.info = {
+            "pid": os.getpid(),
+            "embed_model": chain_v2.EMBED_MODEL,
+            "model_loaded": bool(self.llm.model),
+            "tokenizer_path": tokenizer_path,
+            "rerank": self.cross_encoder is not None,
+        }
+
+        # Generation gets its own thread so embedding/rerank batches never queue behind it.
+        # With CPU_MANAGER=1 these are the pinned pools from resources.py.
+        if pools:
+            self._gen_pool = pools["generate"].executor
+            self._aux_pool = pools["embed"].executor
+        else:
+            self._gen_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="infer-gen")
+            self._aux_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="infer-aux")
+        self._batchers: Dict[str, _Batcher] = {}
+        # The loop only keeps weak references to tasks; these keep them alive until done
+        self._tasks: "set[asyncio.Task]" = set()
+
+    def _spawn(self, coro, name: str) -> asyncio.Task:
+        task = asyncio.create_task(coro, name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        e = None if task.cancelled() else task.exception()
+        if e is not None:
+            # A batcher's run() never returns, so this also means its op has stopped being served
+            logger.error("❌ [Inference] Task %s failed: %r", task.get_name(), e, exc_info=e)
+
+    # --- batch functions (run on executor threads) ---
+    def _embed_batch(self, items: List[List[str]]) -> List[List[List[float]]]:
+        flat = [t for texts in items for t in texts]
+        return _split(self.embeddings.embed_documents(flat), [len(t) for t in items])
+
+    def _generate_batch(self, items: List[Tuple[str, Deadline]]) -> List[Any]:
+        # Items are (prompt, the caller's server-side Deadline). Skip the ones that were
+        # cancelled or expired while queued; the batch stops once every caller is done.
+        results: List[Any] = [None] * len(items)
+        live = []
+        for i, (_, d) in enumerate(items):
+            if d.done:
+                results[i] = RequestCancelled(f"{d.reason} (queued)")
+            else:
+                live.append(i)
+        if not live:
+            return results
+
+        outs = self.llm.generate_batch([items[i][0] for i in live], deadline=DeadlineGroup(items[i][1] for i in live))
+        for i, out in zip(live, outs):
+            d = items[i][1]
+            results[i] = RequestCancelled(d.reason) if d.done else out
+        return results
+
+    def _rerank_batch(self, items: List[List[List[str]]]) -> List[List[float]]:
+        flat = [tuple(p) for pairs in items for p in pairs]
+        scores = [float(s) for s in self.cross_encoder.predict(flat, batch_size=max(1, len(flat)))]
+        return _split(scores, [len(p) for p in items])
+
+    async def _dispatch(self, req: Dict[str, Any], deadline: Optional[Deadline] = None) -> Any:
+        op = req.get("op")
+        if op == "info":
+            return self.info
+        if op == "embed":
+            return await self._batchers["embed"].submit(req["texts"])
+        if op == "generate":
+            return await self._batchers["generate"].submit((req["prompt"], deadline or Deadline(None)))
+        if op == "complete":
+            # Internal prompts (summaries): unbatched, on the generation thread
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._gen_pool, self.llm.generate_text, req["prompt"], deadline)
+        if op == "rerank":
+            if self.cross_encoder is None:
+                raise RuntimeError("rerank model not loaded")
+            return await self._batchers["rerank"].submit(req["pairs"])
+        raise ValueError(f"unknown op {op!r}")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        write_lock = asyncio.Lock()
+        # id -> Deadline of this connection's generate requests still running
+        inflight: Dict[Any, Deadline] = {}
+
+        async def answer(req: Dict[str, Any], deadline: Optional[Deadline]) -> None:
+            try:
+                resp = {"id": req.get("id"), "ok": True, "result": await self._dispatch(req, deadline)}
+            except Exception as e:
+                resp = {"id": req.get("id"), "ok": False, "error": str(e)}
+            finally:
+                inflight.pop(req.get("id"), None)
+            if writer.is_closing():
+                return
+            async with write_lock:
+                writer.write(_encode(resp))
+                await writer.drain()
+
+        try:
+            while True:
+                header = await reader.readexactly(_HEADER.size)
+                (size,) = _HEADER.unpack(header)
+                req = json.loads((await reader.readexactly(size)).decode("utf-8"))
+                if req.get("op") == "cancel":
+                    d = inflight.get(req.get("id"))
+                    if d is not None:
+                        d.cancel("cancelled by client")
+                    continue
+                deadline = None
+                if req.get("op") in ("generate", "complete"):
+                    # Registered before the task runs so a cancel right behind it finds it
+                    deadline = inflight[req.get("id")] = _request_deadline(req.get("timeout_s"))
+                self._spawn(answer(req, deadline), name=f"infer-{req.get('op')}-{req.get('id')}")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for d in inflight.values():
+                d.cancel("client disconnected")
+            writer.close()
+
+    async def serve_forever(self) -> None:
+        self._batchers = {
+            "embed": _Batcher("embed", self._embed_batch, self._aux_pool),
+            "generate": _Batcher("generate", self._generate_batch, self._gen_pool),
+            "rerank": _Batcher("rerank", self._rerank_batch, self._aux_pool),
+        }
+        for b in self._batchers.values():
+            self._spawn(b.run(), name=f"batcher-{b.name}")
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        # Only this user's workers may ask the model process for anything
+        os.chmod(self.socket_path, 0o600)
+        logger.info("✅ [Inference] Serving on %s (pid=%d).", self.socket_path, os.getpid())
+        async with server:
+            await server.serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the shared model process for api_v2 workers.")
+    parser.add_argument("--socket", default=INFERENCE_SOCKET or "/tmp/teenzen-inference.sock")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = InferenceServer(args.socket)
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import os
+import re
+import json
+import math
+import heapq
+import logging
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger("RAG_LEXICAL")
+
+# ------------------------------------------------------------------------------
+# In-process BM25 over the same chunks stored in Chroma
+#
+# Posting weights (idf * saturated tf with length normalization) are precomputed
+# when the index is built or loaded, so a query is just a dict walk over the
+# postings of its terms -- well under a millisecond for our corpus sizes.
+# ------------------------------------------------------------------------------
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset(
+    """
+    a about after again all also am an and any are as at be because been before being
+    but by can could did do does doing for from get got had has have having he her here
+    him his how i if in into is it its just let me more most my no not now of off on
+    once only or other our out over own same she should so some such than that the
+    their them then there these they this those through to too under until up very
+    was we were what when where which while who whom why will with would you your
+    yours im dont cant ive
+    """.split()
+)
+
+
+def _stem(tok: str) -> str:
+    # Deliberately tiny: only folds the plural/verb forms that split our queries
+    # ("attacks" vs "attack", "breathing" vs "breathe").
+    if len(tok) > 4 and tok.endswith("ies"):
+        return tok[:-3] + "y"
+    if len(tok) > 5 and tok.endswith("ing"):
+        return tok[:-3]
+    if len(tok) > 4 and tok.endswith("ed"):
+        return tok[:-2]
+    if len(tok) > 3 and tok.endswith("s") and not tok.endswith("ss"):
+        return tok[:-1]
+    if len(tok) > 4 and tok.endswith("e"):
+        return tok[:-1]
+    return tok
+
+
+def tokenize(text: str) -> List[str]:
+    return [_stem(t) for t in _TOKEN_RE.findall((text or "").lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    def __init__(
+        self,
+        postings: Dict[str, List[List[int]]],
+        doc_len: List[int],
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        ids: List[str],
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ):
+        self.postings = postings
+        self.doc_len = doc_len
+        self.texts = texts
+        self.metadatas = metadatas
+        self.ids = ids
+        self.k1 = k1
+        self.b = b
+        self._weights = self._precompute()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def vocabulary(self):
+        return self.postings.keys()
+
+    def _precompute(self) -> Dict[str, List[Tuple[int, float]]]:
+        n = len(self.doc_len)
+        avgdl = (sum(self.doc_len) / n) if n else 1.0
+        weights: Dict[str, List[Tuple[int, float]]] = {}
+        for term, plist in self.postings.items():
+            df = len(plist)
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            row = []
+            for doc, tf in plist:
+                norm = self.k1 * (1.0 - self.b + self.b * self.doc_len[doc] / avgdl)
+                row.append((doc, idf * tf * (self.k1 + 1.0) / (tf + norm)))
+            weights[term] = row
+        return weights
+
+    # --------------------------------------------------------------------------
+    # Build / persist
+    # --------------------------------------------------------------------------
+    @classmethod
+    def build(
+        cls,
+        texts: List[str],
+        metadatas: List[Optional[Dict[str, Any]]],
+        ids: List[str],
+    ) -> "BM25Index":
+        postings: Dict[str, List[List[int]]] = {}
+        doc_len: List[int] = []
+        for doc, text in enumerate(texts):
+            toks = tokenize(text)
+            doc_len.append(len(toks))
+            for term, tf in Counter(toks).items():
+                postings.setdefault(term, []).append([doc, tf])
+        return cls(postings, doc_len, list(texts), [m or {} for m in metadatas], list(ids))
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "k1": self.k1,
+                    "b": self.b,
+                    "ids": self.ids,
+                    "texts": self.texts,
+                    "metadatas": self.metadatas,
+                    "doc_len": self.doc_len,
+                    "postings": self.postings,
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(
+            postings=data["postings"],
+            doc_len=data["doc_len"],
+            texts=data["texts"],
+            metadatas=data["metadatas"],
+            ids=data["ids"],
+            k1=data.get("k1", BM25_K1),
+            b=data.get("b", BM25_B),
+        )
+
+    # --------------------------------------------------------------------------
+    # Search
+    # --------------------------------------------------------------------------
+    def search(self, query: str, k: int) -> List[Tuple[int, float, float]]:
+        """
+        Returns [(row, bm25_score, coverage)] best first, where coverage is the
+        fraction of distinct query terms that occur in the chunk.
+        """
+        terms = set(tokenize(query))
+        if not terms or k <= 0:
+            return []
+
+        scores: Dict[int, float] = {}
+        matched: Dict[int, int] = {}
+        for term in terms:
+            for doc, w in self._weights.get(term, ()):
+                scores[doc] = scores.get(doc, 0.0) + w
+                matched[doc] = matched.get(doc, 0) + 1
+
+        top = heapq.nlargest(k, scores.items(), key=lambda kv: kv[1])
+        return [(doc, score, matched[doc] / len(terms)) for doc, score in top]
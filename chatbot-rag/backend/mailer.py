@@ -0,0 +1,410 @@
+import os
+import time
+import asyncio
+import logging
+import argparse
+from email.message import EmailMessage
+from email import message_from_bytes
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("RAG_MAIL")
+
+# ------------------------------------------------------------------------------
+# Outbound mail
+#
+# Endpoints call mailer.send(), which only puts the message on an asyncio queue
+# and returns. One worker task drains the queue in batches over a single
+# persistent SMTP connection (reopened when the server drops it or after
+# MAIL_IDLE_CLOSE_S of quiet), retrying transient failures with exponential
+# backoff.
+#
+#   MAIL_BACKEND=console (default)  print the message, as the dev setup always did
+#   MAIL_BACKEND=smtp               aiosmtplib to SMTP_HOST:SMTP_PORT
+#
+# For tests, `python mailer.py standin --port 1025` (or LocalSMTPServer in
+# code) is a tiny SMTP server that accepts and records everything; point
+# SMTP_HOST/SMTP_PORT at it with MAIL_BACKEND=smtp.
+# ------------------------------------------------------------------------------
+MAIL_BACKEND = os.getenv("MAIL_BACKEND", "console").lower()
+MAIL_FROM = os.getenv("MAIL_FROM", "Teen Zen <no-reply@teenzen.local>")
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USER = os.getenv("SMTP_USER", "")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+# Implicit TLS (port 465). Otherwise STARTTLS is used when the server offers it.
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "0") == "1"
+SMTP_TIMEOUT_S = float(os.getenv("SMTP_TIMEOUT_S", "10"))
+MAIL_QUEUE_SIZE = int(os.getenv("MAIL_QUEUE_SIZE", "1000"))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "20"))
+# After the first message arrives, wait this long for more to share the batch
+MAIL_BATCH_WAIT_MS = float(os.getenv("MAIL_BATCH_WAIT_MS", "50"))
+MAIL_MAX_RETRIES = int(os.getenv("MAIL_MAX_RETRIES", "4"))
+MAIL_BACKOFF_S = float(os.getenv("MAIL_BACKOFF_S", "2"))
+MAIL_IDLE_CLOSE_S = float(os.getenv("MAIL_IDLE_CLOSE_S", "60"))
+
+
+class MailQueueFull(Exception):
+    pass
+
+
+class PermanentMailError(Exception):
+    """The server rejected the message outright (5xx); retrying won't help."""
+
+
+class _Outgoing:
+    __slots__ = ("msg", "attempt")
+
+    def __init__(self, msg: EmailMessage):
+        self.msg = msg
+        self.attempt = 0
+
+
+def build_message(to: str, subject: str, body: str, sender: str = MAIL_FROM) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = to
+    msg["Subject"] = subject
+    msg.set_content(body)
+    return msg
+
+
+# --- backends ---
+
+class ConsoleBackend:
+    async def send_batch(self, batch: List[EmailMessage]) -> List[Optional[Exception]]:
+        for msg in batch:
+            print(f"\n[EMAIL SIMULATION] To: {msg['To']} | {msg['Subject']}\n{msg.get_content().strip()}\n")
+        return [None] * len(batch)
+
+    async def close(self) -> None:
+        pass
+
+
+class SMTPBackend:
+    def __init__(self):
+        import aiosmtplib  # noqa: F401  (fail at startup, not on the first send)
+
+        self._smtp = None
+        self._last_used = 0.0
+
+    async def _connection(self):
+        import aiosmtplib
+
+        if self._smtp is not None and self._smtp.is_connected:
+            if time.monotonic() - self._last_used < MAIL_IDLE_CLOSE_S:
+                return self._smtp
+            await self.close()
+        smtp = aiosmtplib.SMTP(
+            hostname=SMTP_HOST,
+            port=SMTP_PORT,
+            use_tls=SMTP_USE_TLS,
+            start_tls=False if SMTP_USE_TLS else None,
+            timeout=SMTP_TIMEOUT_S,
+        )
+        await smtp.connect()
+        if SMTP_USER:
+            await smtp.login(SMTP_USER, SMTP_PASSWORD)
+        self._smtp = smtp
+        logger.info("📮 [Mail] Connected to %s:%d.", SMTP_HOST, SMTP_PORT)
+        return smtp
+
+    async def send_batch(self, batch: List[EmailMessage]) -> List[Optional[Exception]]:
+        import aiosmtplib
+
+        results: List[Optional[Exception]] = []
+        for i, msg in enumerate(batch):
+            try:
+                smtp = await self._connection()
+                await smtp.send_message(msg)
+                self._last_used = time.monotonic()
+                results.append(None)
+            except aiosmtplib.SMTPRecipientsRefused as e:
+                results.append(PermanentMailError(str(e)))
+            except aiosmtplib.SMTPResponseException as e:
+                if 500 <= e.code < 600:
+                    results.append(PermanentMailError(f"{e.code} {e.message}"))
+                else:
+                    results.append(e)
+            except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError) as e:
+                # Connection-level failure: drop the session; the rest of the batch retries later
+                await self.close()
+                results.append(e)
+                results.extend([e] * (len(batch) - i - 1))
+                break
+        return results
+
+    async def close(self) -> None:
+        smtp, self._smtp = self._smtp, None
+        if smtp is None:
+            return
+        try:
+            if smtp.is_connected:
+                await smtp.quit()
+        except Exception:
+            smtp.close()
+
+
+# --- queue ---
+
+class Mailer:
+    def __init__(self, backend_name: str = MAIL_BACKEND):
+        self.backend_name = backend_name
+        self.backend: Any = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._retry_handles: set = set()
+        self.stats: Dict[str, int] = {"sent": 0, "retried": 0, "failed": 0, "batches": 0}
+
+    def _make_backend(self):
+        if self.backend_name == "smtp":
+            return SMTPBackend()
+        return ConsoleBackend()
+
+    async def start(self) -> None:
+        if self._worker is not None:
+            return
+        self.backend = self._make_backend()
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=MAIL_QUEUE_SIZE)
+        self._worker = self._loop.create_task(self._run(), name="mailer")
+        logger.info("📮 [Mail] Queue started (%s backend).", type(self.backend).__name__)
+
+    async def stop(self, drain_timeout_s: float = 5.0) -> None:
+        """Deliver what is queued (up to drain_timeout_s), then close the connection."""
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout_s)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ [Mail] %d messages still queued at shutdown.", self._queue.qsize())
+        for h in list(self._retry_handles):
+            h.cancel()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        await self.backend.close()
+
+    def send(self, to: str, subject: str, body: str) -> None:
+        """Enqueue and return immediately. Falls back to printing when the queue isn't running."""
+        msg = build_message(to, subject, body)
+        if self._worker is None:
+            print(f"\n[EMAIL SIMULATION] To: {to} | {subject}\n{body}\n")
+            return
+        item = _Outgoing(msg)
+        if _in_loop(self._loop):
+            self._put(item)
+        else:
+            # From a worker thread: wait for the loop to enqueue, so MailQueueFull reaches the caller
+            asyncio.run_coroutine_threadsafe(self._put_async(item), self._loop).result()
+
+    def full(self) -> bool:
+        """True when send() would raise MailQueueFull right now."""
+        return self._queue is not None and self._queue.full()
+
+    async def _put_async(self, item: _Outgoing) -> None:
+        self._put(item)
+
+    def _put(self, item: _Outgoing) -> None:
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.stats["failed"] += 1
+            logger.error("❌ [Mail] Queue full (%d); dropped mail to %s.", MAIL_QUEUE_SIZE, item.msg["To"])
+            raise MailQueueFull(f"mail queue full ({MAIL_QUEUE_SIZE})")
+
+    def _retry_later(self, item: _Outgoing, error: Exception) -> None:
+        item.attempt += 1
+        if item.attempt > MAIL_MAX_RETRIES:
+            self.stats["failed"] += 1
+            logger.error("❌ [Mail] Giving up on mail to %s after %d attempts: %s", item.msg["To"], item.attempt, error)
+            return
+        delay = MAIL_BACKOFF_S * (2 ** (item.attempt - 1))
+        self.stats["retried"] += 1
+        logger.warning("⚠️ [Mail] Send to %s failed (%s); retry %d in %.0fs.", item.msg["To"], error, item.attempt, delay)
+
+        def _requeue() -> None:
+            self._retry_handles.discard(handle)
+            try:
+                self._put(item)
+            except MailQueueFull:
+                pass
+
+        handle = self._loop.call_later(delay, _requeue)
+        self._retry_handles.add(handle)
+
+    async def _next_batch(self) -> List[_Outgoing]:
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + MAIL_BATCH_WAIT_MS / 1000.0
+        while len(batch) < MAIL_BATCH_SIZE:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                results = await self.backend.send_batch([item.msg for item in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            self.stats["batches"] += 1
+            for item, error in zip(batch, results):
+                if error is None:
+                    self.stats["sent"] += 1
+                elif isinstance(error, PermanentMailError):
+                    self.stats["failed"] += 1
+                    logger.error("❌ [Mail] Rejected mail to %s: %s", item.msg["To"], error)
+                else:
+                    self._retry_later(item, error)
+                self._queue.task_done()
+
+    def queue_stats(self) -> Dict[str, int]:
+        return {"queued": self._queue.qsize() if self._queue is not None else 0, **self.stats}
+
+
+def _in_loop(loop: Optional[asyncio.AbstractEventLoop] = None) -> bool:
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return loop is None or running is loop
+
+
+mailer = Mailer()
+
+
+# ------------------------------------------------------------------------------
+# Local SMTP stand-in (stdlib only)
+# ------------------------------------------------------------------------------
+class LocalSMTPServer:
+    """
+    Accepts EHLO/HELO, AUTH PLAIN, MAIL, RCPT, DATA, RSET, NOOP and QUIT and keeps
+    every message in .messages. fail_next=N answers the next N DATA commands with
+    a transient 451, to exercise retries; recipients in `reject` get a permanent
+    550 at RCPT.
+
+        async with LocalSMTPServer(port=0) as srv:   # srv.port is the bound port
+            ...
+    """
+
+    def __init__(
+        self, host: str = "127.0.0.1", port: int = 1025, fail_next: int = 0, echo: bool = False, reject=()
+    ):
+        self.host = host
+        self.port = port
+        self.fail_next = fail_next
+        self.reject = {r.lower() for r in reject}
+        self.echo = echo
+        self.messages: List[Dict[str, Any]] = []
+        self.sessions = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def __aenter__(self) -> "LocalSMTPServer":
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def serve_forever(self) -> None:
+        async with self:
+            logger.info("📮 [Mail] SMTP stand-in listening on %s:%d", self.host, self.port)
+            await self._server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.sessions += 1
+
+        async def reply(line: str) -> None:
+            writer.write((line + "\r\n").encode())
+            await writer.drain()
+
+        mail_from, rcpts = None, []
+        await reply("220 localhost ESMTP stand-in")
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    break
+                line = raw.decode("utf-8", "replace").rstrip("\r\n")
+                verb = line[:4].upper()
+                if verb == "EHLO":
+                    writer.write(b"250-localhost\r\n250-8BITMIME\r\n250-PIPELINING\r\n250 AUTH PLAIN\r\n")
+                    await writer.drain()
+                elif verb == "HELO":
+                    await reply("250 localhost")
+                elif verb == "AUTH":
+                    await reply("235 2.7.0 Authentication successful")
+                elif verb == "MAIL":
+                    mail_from, rcpts = line.split(":", 1)[1].strip(), []
+                    await reply("250 OK")
+                elif verb == "RCPT":
+                    rcpt = line.split(":", 1)[1].strip()
+                    if rcpt.strip("<>").lower() in self.reject:
+                        await reply("550 5.1.1 Mailbox unavailable")
+                        continue
+                    rcpts.append(rcpt)
+                    await reply("250 OK")
+                elif verb == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    chunks = []
+                    while True:
+                        data_line = await reader.readline()
+                        if not data_line or data_line in (b".\r\n", b".\n"):
+                            break
+                        chunks.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                    if self.fail_next > 0:
+                        self.fail_next -= 1
+                        await reply("451 4.3.0 Try again later")
+                        continue
+                    data = b"".join(chunks)
+                    parsed = message_from_bytes(data)
+                    record = {"from": mail_from, "to": rcpts, "subject": parsed.get("Subject"), "data": data}
+                    self.messages.append(record)
+                    if self.echo:
+                        print(f"[SMTP stand-in] {mail_from} -> {', '.join(rcpts)} | {record['subject']}")
+                    await reply("250 OK queued")
+                elif verb == "RSET":
+                    mail_from, rcpts = None, []
+                    await reply("250 OK")
+                elif verb == "NOOP":
+                    await reply("250 OK")
+                elif verb == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    await reply("502 Command not implemented")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mail utilities.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    standin = sub.add_parser("standin", help="run a local SMTP server that records and prints mail")
+    standin.add_argument("--host", default="127.0.0.1")
+    standin.add_argument("--port", type=int, default=1025)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.cmd == "standin":
+        try:
+            asyncio.run(LocalSMTPServer(args.host, args.port, echo=True).serve_forever())
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
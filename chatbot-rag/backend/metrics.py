@@ -0,0 +1,239 @@
+import os
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Optional, Iterator, Any
+
+logger = logging.getLogger("RAG_METRICS")
+
+# ------------------------------------------------------------------------------
+# Latency instrumentation
+#
+# span("embed") times one RAG stage and records it in the rag_stage_seconds
+# histogram; api_v2 serves everything in Prometheus text format on /metrics.
+# Registries are per process: under prefork / uvicorn --workers each worker
+# reports its own numbers (Prometheus sums them across scrapes of all workers).
+#
+#   OTEL_ENABLED=1   also emit each span to OpenTelemetry (OTLP/gRPC exporter,
+#                    configured by the standard OTEL_EXPORTER_OTLP_* env vars)
+# ------------------------------------------------------------------------------
+OTEL_ENABLED = os.getenv("OTEL_ENABLED", "0") == "1"
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "teen-zen-rag")
+
+# Seconds; wide enough for both a 2ms embedding and a 60s CPU generation
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATE_BUCKETS = (0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0, 128.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    body = ",".join('%s="%s"' % (k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in items)
+    return "{" + body + "}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts..., +Inf count], sum
+        self._counts: Dict[Labels, List[int]] = {}
+        self._sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _labels(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[i] += 1
+            self._sums[key] += value
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(k, list(c), self._sums[k]) for k, c in self._counts.items()]
+        for key, counts, total in sorted(snapshot):
+            running = 0
+            for bound, n in zip(self.buckets, counts):
+                running += n
+                out.append(f"{self.name}_bucket{_fmt_labels(key, ('le', repr(float(bound))))} {running}")
+            running += counts[-1]
+            out.append(f"{self.name}_bucket{_fmt_labels(key, ('le', '+Inf'))} {running}")
+            out.append(f"{self.name}_sum{_fmt_labels(key)} {total:.6f}")
+            out.append(f"{self.name}_count{_fmt_labels(key)} {running}")
+        return out
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        for key, value in snapshot:
+            out.append(f"{self.name}{_fmt_labels(key)} {value:g}")
+        return out
+
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Wall time of one RAG pipeline stage.")
+DECODE_TOKENS_PER_SECOND = Histogram(
+    "rag_decode_tokens_per_second", "Decode throughput of one generate() call (all rows).", RATE_BUCKETS
+)
+GENERATED_TOKENS = Counter("rag_generated_tokens_total", "Tokens produced by generate().")
+ANSWERS = Counter("rag_answers_total", "Answers by the path that produced them.")
+STAGE_ERRORS = Counter("rag_stage_errors_total", "Stages that raised.")
+HTTP_SECONDS = Histogram("rag_http_request_seconds", "HTTP request latency by route.")
+GIBBERISH_ABORTS = Counter("rag_gibberish_aborts_total", "Generations stopped early because the answer read as gibberish.")
+NEGATIVE_CACHE = Counter(
+    "rag_negative_cache_total", "Questions checked against the rejected-query cache, by outcome (miss = retrieved)."
+)
+TOKEN_CACHE_HITS = Counter("rag_token_cache_hits_total", "Access tokens verified from the decoded-token cache.")
+TOKEN_CACHE_MISSES = Counter("rag_token_cache_misses_total", "Access tokens verified with a full JWT decode.")
+
+_REGISTRY = [
+    STAGE_SECONDS, DECODE_TOKENS_PER_SECOND, GENERATED_TOKENS, ANSWERS, STAGE_ERRORS, HTTP_SECONDS, GIBBERISH_ABORTS,
+    NEGATIVE_CACHE, TOKEN_CACHE_HITS, TOKEN_CACHE_MISSES,
+]
+
+
+# ------------------------------------------------------------------------------
+# OpenTelemetry (optional)
+# ------------------------------------------------------------------------------
+_tracer = None
+_tracer_lock = threading.Lock()
+_tracer_failed = False
+
+
+def _get_tracer():
+    global _tracer, _tracer_failed
+    if not OTEL_ENABLED or _tracer_failed:
+        return None
+    if _tracer is not None:
+        return _tracer
+    with _tracer_lock:
+        if _tracer is None and not _tracer_failed:
+            try:
+                from opentelemetry import trace
+                from opentelemetry.sdk.resources import Resource
+                from opentelemetry.sdk.trace import TracerProvider
+                from opentelemetry.sdk.trace.export import BatchSpanProcessor
+                from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+
+                provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+                provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+                trace.set_tracer_provider(provider)
+                _tracer = trace.get_tracer("rag")
+                logger.info("📡 [Metrics] OpenTelemetry exporter enabled (service=%s).", OTEL_SERVICE_NAME)
+            except Exception as e:
+                _tracer_failed = True
+                logger.warning("⚠️ [Metrics] OTEL_ENABLED=1 but OpenTelemetry is unavailable: %s", e)
+    return _tracer
+
+
+@contextmanager
+def span(stage: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Time one stage into rag_stage_seconds{stage=...}. Yields a dict; keys set on
+    it during the block become attributes of the OpenTelemetry span.
+    """
+    tracer = _get_tracer()
+    otel_cm = tracer.start_as_current_span(f"rag.{stage}") if tracer is not None else None
+    otel_span = otel_cm.__enter__() if otel_cm is not None else None
+    t0 = time.perf_counter()
+    extra: Dict[str, Any] = dict(attrs)
+    exc: Optional[BaseException] = None
+    try:
+        yield extra
+    except BaseException as e:
+        exc = e
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if exc is not None:
+            STAGE_ERRORS.inc(stage=stage)
+        if otel_cm is not None:
+            for k, v in extra.items():
+                if isinstance(v, (str, bool, int, float)):
+                    otel_span.set_attribute(k, v)
+            if exc is None:
+                otel_cm.__exit__(None, None, None)
+            else:
+                otel_cm.__exit__(type(exc), exc, exc.__traceback__)
+
+
+class GenerationTimer:
+    """
+    Splits one HF generate() call into prefill (up to the first new token) and
+    decode, via a StoppingCriteria that only notes when it is called.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.start = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.steps = 0
+        self.rows = 1
+
+    def criterion(self):
+        from transformers import StoppingCriteria  # type: ignore
+
+        timer = self
+
+        class _TimingCriteria(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                if timer.first_token_at is None:
+                    timer.first_token_at = time.perf_counter()
+                    timer.rows = int(input_ids.shape[0])
+                timer.steps += 1
+                return False
+
+        return _TimingCriteria()
+
+    def finish(self) -> None:
+        end = time.perf_counter()
+        if self.first_token_at is None:
+            STAGE_SECONDS.observe(end - self.start, stage=f"{self.model}.generate")
+            return
+        STAGE_SECONDS.observe(self.first_token_at - self.start, stage=f"{self.model}.prefill")
+        decode_s = end - self.first_token_at
+        STAGE_SECONDS.observe(decode_s, stage=f"{self.model}.decode")
+        tokens = self.steps * self.rows
+        GENERATED_TOKENS.inc(tokens, model=self.model)
+        if self.steps > 1 and decode_s > 0:
+            DECODE_TOKENS_PER_SECOND.observe((self.steps - 1) * self.rows / decode_s, model=self.model)
+
+
+def render(extra_gauges: Optional[Dict[str, float]] = None) -> str:
+    """Everything in Prometheus text exposition format (0.0.4)."""
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    for name, value in sorted((extra_gauges or {}).items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {float(value):g}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,43 @@
+from typing import List, Any
+
+import numpy as np
+
+
+def mmr_order(query_vec: Any, cand_vecs: Any, lambda_mult: float = 0.5, k: int = 0) -> List[int]:
+    """
+    Maximal marginal relevance over already-fetched candidate embeddings.
+
+    Returns candidate indices in selection order (all of them unless k > 0). Each
+    step picks argmax(lambda * sim(query, d) - (1 - lambda) * max sim(d, selected));
+    the query/candidate and candidate/candidate similarities are computed once
+    as two matrix products, so nothing is re-embedded.
+    """
+    cand = np.asarray(cand_vecs, dtype=np.float32)
+    n = len(cand)
+    if n == 0:
+        return []
+    limit = n if k <= 0 else min(k, n)
+
+    norms = np.linalg.norm(cand, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    cand = cand / norms
+    q = np.asarray(query_vec, dtype=np.float32).reshape(-1)
+    q = q / (np.linalg.norm(q) or 1.0)
+
+    rel = cand @ q
+    pair = cand @ cand.T
+
+    selected = [int(np.argmax(rel))]
+    redundancy = pair[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+
+    while len(selected) < limit:
+        score = lambda_mult * rel - (1.0 - lambda_mult) * redundancy
+        score[~available] = -np.inf
+        nxt = int(np.argmax(score))
+        selected.append(nxt)
+        available[nxt] = False
+        np.maximum(redundancy, pair[nxt], out=redundancy)
+
+    return selected
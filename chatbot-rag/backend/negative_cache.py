@@ -0,0 +1,145 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+from lexical_index import tokenize
+
+logger = logging.getLogger("RAG_NEGCACHE")
+
+# ------------------------------------------------------------------------------
+# Negative cache for "I don't know." answers
+#
+# Questions that failed the relevance gate are remembered for NEG_CACHE_TTL_S,
+# by normalized text and by query vector. A later question is answered
+# "I don't know." straight away when
+#   - its normalized text was rejected before (no embedding at all), or
+#   - its vector is within NEG_CACHE_SIM cosine of a rejected one (no search).
+# The lexical pre-filter runs before either: a question with at least
+# PREFILTER_MIN_TERMS content terms, none of which (nor their 4-letter stems)
+# occur anywhere in the corpus, can't be answered from it.
+# Both reset whenever the index is rebuilt.
+# ------------------------------------------------------------------------------
+NEG_CACHE_ENABLED = os.getenv("NEG_CACHE", "1") == "1"
+NEG_CACHE_SIZE = int(os.getenv("NEG_CACHE_SIZE", "2048"))
+NEG_CACHE_TTL_S = float(os.getenv("NEG_CACHE_TTL_S", "3600"))
+NEG_CACHE_SIM = float(os.getenv("NEG_CACHE_SIM", "0.95"))
+PREFILTER_ENABLED = os.getenv("LEXICAL_PREFILTER", "1") == "1"
+PREFILTER_MIN_TERMS = int(os.getenv("PREFILTER_MIN_TERMS", "3"))
+_PREFIX = 4
+
+
+def normalize_query(text: str) -> str:
+    terms = [t for t in tokenize(text) if len(t) > 1]
+    return " ".join(terms) or " ".join((text or "").lower().split())
+
+
+class NegativeCache:
+    def __init__(self, size: int = NEG_CACHE_SIZE, ttl_s: float = NEG_CACHE_TTL_S, sim: float = NEG_CACHE_SIM):
+        self.size = max(1, size)
+        self.ttl_s = ttl_s
+        self.sim = sim
+        self._lock = threading.Lock()
+        # normalized text -> expires_at
+        self._texts: "OrderedDict[str, float]" = OrderedDict()
+        # Unit vectors of rejected queries in a ring buffer; _expiry[i] == 0 marks a free row
+        self._vecs: Optional[np.ndarray] = None
+        self._expiry = np.zeros(self.size, dtype=np.float64)
+        self._next = 0
+        self._vocab: Optional[frozenset] = None
+        self._prefixes: Optional[frozenset] = None
+
+    # --- corpus vocabulary ---
+    def set_vocabulary(self, vocabulary: Optional[Iterable[str]]) -> None:
+        """Install the corpus vocabulary (BM25 terms) and drop everything cached against the old index."""
+        with self._lock:
+            if vocabulary is None:
+                self._vocab = self._prefixes = None
+            else:
+                self._vocab = frozenset(vocabulary)
+                self._prefixes = frozenset(t[:_PREFIX] for t in self._vocab if len(t) >= _PREFIX)
+            self._clear_locked()
+
+    def off_topic(self, question: str) -> bool:
+        """True when the question's content terms are all foreign to the corpus."""
+        vocab, prefixes = self._vocab, self._prefixes
+        if not PREFILTER_ENABLED or not vocab:
+            return False
+        terms = tokenize(question)
+        if len(terms) < PREFILTER_MIN_TERMS:
+            return False
+        for t in terms:
+            if t in vocab or (len(t) >= _PREFIX and t[:_PREFIX] in prefixes):
+                return False
+        return True
+
+    # --- rejected queries ---
+    def has_text(self, question: str) -> bool:
+        if not NEG_CACHE_ENABLED:
+            return False
+        key = normalize_query(question)
+        now = time.time()
+        with self._lock:
+            expires = self._texts.get(key)
+            if expires is None:
+                return False
+            if expires <= now:
+                del self._texts[key]
+                return False
+            self._texts.move_to_end(key)
+            return True
+
+    def near_vector(self, vec: Optional[Sequence[float]]) -> bool:
+        if not NEG_CACHE_ENABLED or vec is None or self._vecs is None:
+            return False
+        q = np.asarray(vec, dtype=np.float32)
+        n = float(np.linalg.norm(q))
+        if n == 0.0:
+            return False
+        with self._lock:
+            live = self._expiry > time.time()
+            if not live.any():
+                return False
+            sims = self._vecs @ (q / n)
+        return bool(sims[live].max() >= self.sim)
+
+    def add(self, question: str, vec: Optional[Sequence[float]] = None) -> None:
+        if not NEG_CACHE_ENABLED:
+            return
+        key = normalize_query(question)
+        expires = time.time() + self.ttl_s
+        with self._lock:
+            if vec is not None:
+                v = np.asarray(vec, dtype=np.float32)
+                n = float(np.linalg.norm(v))
+                if n > 0.0:
+                    if self._vecs is None or self._vecs.shape[1] != v.shape[0]:
+                        self._vecs = np.zeros((self.size, v.shape[0]), dtype=np.float32)
+                        self._expiry[:] = 0.0
+                    row = self._next
+                    self._next = (self._next + 1) % self.size
+                    self._vecs[row] = v / n
+                    self._expiry[row] = expires
+            self._texts[key] = expires
+            self._texts.move_to_end(key)
+            while len(self._texts) > self.size:
+                self._texts.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear_locked()
+
+    def _clear_locked(self) -> None:
+        self._texts.clear()
+        self._expiry[:] = 0.0
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+
+negative_cache = NegativeCache()
@@ -0,0 +1,171 @@
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+from typing import Dict
+
+# ------------------------------------------------------------------------------
+# Fork-after-load launcher for api_v2
+#
+# The master loads the embedder, the Chroma index and the LLM weights once,
+# freezes the heap, then forks the uvicorn workers. Weight storage is never
+# written after the fork, so those pages stay shared copy-on-write; gc.freeze()
+# keeps the cyclic GC in each worker from touching (and so un-sharing) every
+# object header that existed at fork time.
+#
+#   python prefork.py --workers 4 --port 8000
+# ------------------------------------------------------------------------------
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("prefork")
+
+PREFORK_WORKERS = int(os.getenv("PREFORK_WORKERS", "2"))
+# Intra-op threads per worker; 0 = split the machine's cores evenly
+PREFORK_THREADS_PER_WORKER = int(os.getenv("PREFORK_THREADS_PER_WORKER", "0"))
+
+
+def _prepare_master() -> None:
+    # Tokenizers' Rust thread pool and an already-spun-up OpenMP team do not
+    # survive fork(); keep the master single-threaded so workers start clean.
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    try:
+        import torch
+
+        torch.set_num_threads(1)
+    except Exception:
+        pass
+
+
+def _freeze_models() -> None:
+    import chain_v2
+
+    try:
+        import torch
+
+        torch.set_grad_enabled(False)
+        llm = chain_v2.rag_chain.llm if chain_v2.rag_chain is not None else None
+        for holder in (getattr(llm, "bitnet", None), getattr(llm, "fallback", None)):
+            model = getattr(holder, "model", None)
+            if isinstance(model, torch.nn.Module):
+                model.eval()
+                # No autograd bookkeeping is ever written into the shared parameters
+                for p in model.parameters():
+                    p.requires_grad_(False)
+    except Exception as e:
+        logger.warning("⚠️ [Prefork] Could not freeze model parameters: %s", e)
+
+    gc.collect()
+    gc.freeze()
+    logger.info("🧊 [Prefork] Heap frozen: %d objects moved to the permanent generation.", gc.get_freeze_count())
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(sock: socket.socket, index: int, threads: int) -> None:
+    # Drop inherited handlers; uvicorn installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # already fixed by work done in the master
+    except Exception:
+        pass
+
+    import uvicorn
+    import api_v2
+
+    logger.info("👷 [Prefork] worker %d pid=%d threads=%d", index, os.getpid(), threads)
+    config = uvicorn.Config(api_v2.app, log_level="info", access_log=False)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    os._exit(0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load models once, then fork api_v2 workers.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=PREFORK_WORKERS)
+    parser.add_argument("--threads-per-worker", type=int, default=PREFORK_THREADS_PER_WORKER)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    _prepare_master()
+
+    import chain_v2
+    import api_v2  # noqa: F401  (imported pre-fork so its modules are shared too)
+
+    st = chain_v2.initialize_global_vars()
+    if not st.ready:
+        logger.error("❌ [Prefork] Chain not ready (phase=%s): %s", st.phase, st.init_error)
+        sys.exit(1)
+    _freeze_models()
+    load_s = time.perf_counter() - t0
+
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // max(1, args.workers))
+    sock = _bind(args.host, args.port)
+    logger.info(
+        "🚀 [Prefork] Models loaded in %.1fs; forking %d workers (%d threads each) on %s:%d",
+        load_s, args.workers, threads, args.host, args.port,
+    )
+
+    children: Dict[int, int] = {}
+
+    def spawn(index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(sock, index, threads)
+        children[pid] = index
+
+    for i in range(args.workers):
+        spawn(i)
+
+    stopping = False
+
+    def stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        # Respawn from the master: the new worker shares the same loaded pages
+        logger.warning("⚠️ [Prefork] worker %d (pid=%d) exited with %s; respawning.", index, pid, status)
+        spawn(index)
+
+    logger.info("👋 [Prefork] All workers exited.")
+
+
+if __name__ == "__main__":
+    main()
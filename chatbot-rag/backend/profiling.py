@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import threading
+import contextlib
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger("RAG_PROFILING")
+
+# ------------------------------------------------------------------------------
+# On-demand profiling
+#
+# Nothing runs until a session is started (POST /admin/profile, or SIGUSR2 when
+# PROFILE_SIGNAL=1). A session samples every thread's Python stack for N
+# seconds from a background thread and writes, under PROFILE_DIR:
+#   profile-<pid>-<ts>.speedscope.json   open at https://www.speedscope.app
+#   profile-<pid>-<ts>.collapsed.txt     for flamegraph.pl / inferno
+#   profile-<pid>-<ts>.generate-N.torch.json
+#                                        (torch=True) chrome trace of each
+#                                        generation that starts in the window
+# Outside a session the only cost is torch_trace() reading one global.
+# ------------------------------------------------------------------------------
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", "10"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+PROFILE_SIGNAL = os.getenv("PROFILE_SIGNAL", "0") == "1"
+
+FrameKey = Tuple[str, str, int]
+
+
+class ProfileBusy(Exception):
+    pass
+
+
+class ProfileSession:
+    def __init__(self, seconds: float, interval_ms: float, torch_ops: bool):
+        self.seconds = max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+        self.interval_s = max(0.001, interval_ms / 1000.0)
+        self.torch_ops = torch_ops
+        self.started_at = time.time()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started_at))
+        self.base = os.path.join(PROFILE_DIR, f"profile-{os.getpid()}-{stamp}")
+        self.done = threading.Event()
+        self.result: Dict[str, Any] = {}
+
+        self._frames: Dict[FrameKey, int] = {}
+        self._frame_list: List[FrameKey] = []
+        # thread name -> (samples as frame-index lists root..leaf, weights in seconds)
+        self._samples: Dict[str, Tuple[List[List[int]], List[float]]] = {}
+        self._torch_lock = threading.Lock()
+        # torch.profiler is process-global: trace one generation at a time
+        self._torch_busy = threading.Lock()
+        self._torch_traces: List[str] = []
+        self._thread: Optional[threading.Thread] = None
+
+    # --- sampling ---
+    def _frame_index(self, code) -> int:
+        key = (getattr(code, "co_qualname", code.co_name), code.co_filename, code.co_firstlineno)
+        idx = self._frames.get(key)
+        if idx is None:
+            idx = self._frames[key] = len(self._frame_list)
+            self._frame_list.append(key)
+        return idx
+
+    def _sample(self, weight: float) -> None:
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack: List[int] = []
+            f = frame
+            while f is not None:
+                stack.append(self._frame_index(f.f_code))
+                f = f.f_back
+            stack.reverse()
+            samples, weights = self._samples.setdefault(names.get(ident, f"thread-{ident}"), ([], []))
+            samples.append(stack)
+            weights.append(weight)
+
+    def _run(self) -> None:
+        try:
+            t_end = time.perf_counter() + self.seconds
+            last = time.perf_counter()
+            n = 0
+            while True:
+                now = time.perf_counter()
+                if now >= t_end:
+                    break
+                self._sample(now - last if n else self.interval_s)
+                last = now
+                n += 1
+                time.sleep(max(0.0, self.interval_s - (time.perf_counter() - now)))
+            self.result = self._write(n)
+            logger.info("🔥 [Profile] %d samples over %.1fs -> %s", n, self.seconds, self.result["speedscope"])
+        except Exception as e:
+            logger.error("❌ [Profile] Session failed: %s", e, exc_info=True)
+            self.result = {"error": str(e)}
+        finally:
+            _end_session(self)
+            self.done.set()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    # --- output ---
+    def _write(self, n_samples: int) -> Dict[str, Any]:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        frames = [{"name": name, "file": file, "line": line} for name, file, line in self._frame_list]
+        profiles = []
+        for thread_name, (samples, weights) in sorted(self._samples.items()):
+            profiles.append({
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            })
+        doc = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+            "name": os.path.basename(self.base),
+            "activeProfileIndex": 0,
+            "exporter": "chatbot-rag profiling.py",
+        }
+        speedscope = self.base + ".speedscope.json"
+        with open(speedscope, "w", encoding="utf-8") as f:
+            json.dump(doc, f)
+
+        # Collapsed stacks ("thread;root;...;leaf count"), weights in microseconds
+        collapsed: Dict[str, float] = {}
+        for thread_name, (samples, weights) in self._samples.items():
+            for stack, w in zip(samples, weights):
+                key = ";".join([thread_name] + [self._frame_list[i][0] for i in stack])
+                collapsed[key] = collapsed.get(key, 0.0) + w
+        collapsed_path = self.base + ".collapsed.txt"
+        with open(collapsed_path, "w", encoding="utf-8") as f:
+            for key, w in sorted(collapsed.items()):
+                f.write(f"{key} {max(1, int(w * 1e6))}\n")
+
+        out: Dict[str, Any] = {
+            "samples": n_samples,
+            "seconds": self.seconds,
+            "interval_ms": self.interval_s * 1000,
+            "threads": len(self._samples),
+            "speedscope": speedscope,
+            "collapsed": collapsed_path,
+        }
+        if self.torch_ops:
+            with self._torch_lock:
+                out["torch_traces"] = list(self._torch_traces)
+        return out
+
+    # --- torch.profiler for generations that start while the session runs ---
+    @contextlib.contextmanager
+    def torch_trace(self, label: str):
+        try:
+            from torch.profiler import profile, ProfilerActivity
+        except Exception:
+            yield
+            return
+        if not self._torch_busy.acquire(blocking=False):
+            yield
+            return
+        try:
+            with profile(activities=[ProfilerActivity.CPU], record_shapes=True, with_stack=False) as prof:
+                yield
+        finally:
+            self._torch_busy.release()
+        with self._torch_lock:
+            path = f"{self.base}.{label}-{len(self._torch_traces)}.torch.json"
+            self._torch_traces.append(path)
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            prof.export_chrome_trace(path)
+        except Exception as e:
+            logger.warning("⚠️ [Profile] Could not write torch trace %s: %s", path, e)
+
+
+_active: Optional[ProfileSession] = None
+_active_lock = threading.Lock()
+
+
+def _end_session(session: ProfileSession) -> None:
+    global _active
+    with _active_lock:
+        if _active is session:
+            _active = None
+
+
+def start(
+    seconds: float = PROFILE_SECONDS, interval_ms: float = PROFILE_INTERVAL_MS, torch_ops: bool = False
+) -> ProfileSession:
+    """Start a session in the background; raises ProfileBusy if one is running."""
+    global _active
+    with _active_lock:
+        if _active is not None:
+            raise ProfileBusy(f"profile already running until ~{_active.started_at + _active.seconds:.0f}")
+        _active = ProfileSession(seconds, interval_ms, torch_ops)
+    logger.info(
+        "🔥 [Profile] Sampling for %.1fs every %.0fms (torch=%s).", _active.seconds, _active.interval_s * 1000, torch_ops
+    )
+    session = _active
+    session.start()
+    return session
+
+
+def active() -> Optional[ProfileSession]:
+    return _active
+
+
+def torch_trace(label: str):
+    """Wrap a generation; records a torch.profiler trace only while a torch session is active."""
+    session = _active
+    if session is None or not session.torch_ops:
+        return contextlib.nullcontext()
+    return session.torch_trace(label)
+
+
+def install_signal_handler(signum: int = getattr(signal, "SIGUSR2", 0)) -> bool:
+    """`kill -USR2 <pid>` starts a default session (main thread only; no-op unless PROFILE_SIGNAL=1)."""
+    if not PROFILE_SIGNAL or not signum:
+        return False
+
+    def _start_quietly() -> None:
+        try:
+            start()
+        except ProfileBusy as e:
+            logger.warning("⚠️ [Profile] %s", e)
+
+    def _handler(_signum, _frame):
+        # Don't take locks inside the handler; it interrupts the main thread anywhere
+        threading.Thread(target=_start_quietly, name="profiler-start", daemon=True).start()
+
+    try:
+        signal.signal(signum, _handler)
+    except ValueError:
+        return False
+    logger.info("🔥 [Profile] kill -USR2 %d starts a %.0fs profile.", os.getpid(), PROFILE_SECONDS)
+    return True
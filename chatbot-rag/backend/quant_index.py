@@ -0,0 +1,180 @@
+import os
+import json
+import math
+import logging
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("RAG_QUANT")
+
+# ------------------------------------------------------------------------------
+# Quantized corpus index
+#
+# Corpus vectors are kept as compact codes for candidate generation:
+#   - "int8":   symmetric scalar quantization, scored with int32-accumulated dot products
+#   - "binary": 1 bit per dimension (sign), scored with Hamming distance
+# The full-precision vectors are written next to the codes and memory-mapped, so
+# only the rows of the shortlist are ever touched when rescoring.
+# ------------------------------------------------------------------------------
+QUANT_MODES = ("int8", "binary")
+
+_META_FILE = "meta.json"
+_CODES_FILE = "codes.npy"
+_FULL_FILE = "full.npy"
+_DOCS_FILE = "docs.json"
+
+# popcount for every possible byte value (Hamming distance over packed bits)
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# rows scored per block when accumulating int8 dot products in int32
+_INT8_BLOCK = 4096
+
+
+def _normalize(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def cosine_to_relevance(cos: float) -> float:
+    """
+    Map cosine similarity of unit vectors onto the relevance Chroma reports for its
+    default "l2" space, so MIN_RELEVANCE_SCORE means the same on both paths. Chroma
+    returns the squared distance d2 = 2 - 2cos and LangChain scores it 1 - d2 / sqrt(2).
+    """
+    return 1.0 - (2.0 - 2.0 * float(cos)) / math.sqrt(2.0)
+
+
+class QuantizedIndex:
+    def __init__(
+        self,
+        mode: str,
+        codes: np.ndarray,
+        full: np.ndarray,
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        ids: List[str],
+        scale: float = 1.0,
+    ):
+        if mode not in QUANT_MODES:
+            raise ValueError(f"Unknown quantization mode '{mode}'. Use one of {QUANT_MODES}.")
+        self.mode = mode
+        self.codes = codes
+        self.full = full
+        self.texts = texts
+        self.metadatas = metadatas
+        self.ids = ids
+        self.scale = float(scale)
+        self.dim = int(full.shape[1]) if full.ndim == 2 and len(full) else 0
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    # --------------------------------------------------------------------------
+    # Build / persist
+    # --------------------------------------------------------------------------
+    @classmethod
+    def build(
+        cls,
+        vectors: Any,
+        texts: List[str],
+        metadatas: List[Optional[Dict[str, Any]]],
+        ids: List[str],
+        mode: str,
+    ) -> "QuantizedIndex":
+        full = _normalize(np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1))
+
+        scale = 1.0
+        if mode == "int8":
+            # Clip at a high percentile so a few outlier components don't waste range.
+            scale = float(np.percentile(np.abs(full), 99.9)) / 127.0 if full.size else 1.0
+            scale = scale or 1.0
+            codes = np.clip(np.rint(full / scale), -127, 127).astype(np.int8)
+        elif mode == "binary":
+            codes = np.packbits(full > 0, axis=1)
+        else:
+            raise ValueError(f"Unknown quantization mode '{mode}'. Use one of {QUANT_MODES}.")
+
+        return cls(
+            mode=mode,
+            codes=codes,
+            full=full,
+            texts=list(texts),
+            metadatas=[m or {} for m in metadatas],
+            ids=list(ids),
+            scale=scale,
+        )
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, _CODES_FILE), self.codes)
+        np.save(os.path.join(path, _FULL_FILE), np.ascontiguousarray(self.full, dtype=np.float32))
+        with open(os.path.join(path, _DOCS_FILE), "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "texts": self.texts, "metadatas": self.metadatas}, f)
+        with open(os.path.join(path, _META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"mode": self.mode, "scale": self.scale, "count": len(self.ids), "dim": self.dim}, f)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["QuantizedIndex"]:
+        meta_path = os.path.join(path, _META_FILE)
+        if not os.path.isfile(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(path, _DOCS_FILE), "r", encoding="utf-8") as f:
+            docs = json.load(f)
+
+        codes = np.load(os.path.join(path, _CODES_FILE))
+        # Full-precision rows stay on disk; rescoring only pages in the shortlist.
+        full = np.load(os.path.join(path, _FULL_FILE), mmap_mode="r")
+        return cls(
+            mode=meta["mode"],
+            codes=codes,
+            full=full,
+            texts=docs["texts"],
+            metadatas=docs["metadatas"],
+            ids=docs["ids"],
+            scale=meta.get("scale", 1.0),
+        )
+
+    def nbytes(self) -> Tuple[int, int]:
+        """(bytes of the in-memory codes, bytes of the full-precision vectors)."""
+        return int(self.codes.nbytes), int(len(self) * self.dim * 4)
+
+    # --------------------------------------------------------------------------
+    # Search
+    # --------------------------------------------------------------------------
+    def _candidates(self, q: np.ndarray, n: int) -> np.ndarray:
+        if self.mode == "binary":
+            q_bits = np.packbits(q > 0)
+            dist = _POPCOUNT[np.bitwise_xor(self.codes, q_bits)].sum(axis=1, dtype=np.int32)
+            order_key = dist
+        else:
+            q_codes = np.clip(np.rint(q / self.scale), -127, 127).astype(np.int32)
+            sims = np.empty(len(self), dtype=np.int32)
+            for start in range(0, len(self), _INT8_BLOCK):
+                block = self.codes[start:start + _INT8_BLOCK]
+                sims[start:start + len(block)] = block.astype(np.int32) @ q_codes
+            order_key = -sims
+
+        if n >= len(self):
+            return np.argsort(order_key, kind="stable")
+        top = np.argpartition(order_key, n - 1)[:n]
+        return top[np.argsort(order_key[top], kind="stable")]
+
+    def search(self, query_vec: Any, k: int, shortlist: int) -> List[Tuple[int, float]]:
+        """
+        Returns [(row, cosine)] for the top-k rows, best first. Candidates come from
+        the quantized codes; the shortlist is rescored with full-precision vectors.
+        """
+        if not len(self) or k <= 0:
+            return []
+
+        q = _normalize(np.asarray(query_vec, dtype=np.float32).reshape(-1))
+        cand = self._candidates(q, min(len(self), max(k, shortlist)))
+
+        rows = np.sort(cand)
+        exact = np.asarray(self.full[rows], dtype=np.float32) @ q
+        best = np.argsort(-exact, kind="stable")[:k]
+        return [(int(rows[i]), float(exact[i])) for i in best]
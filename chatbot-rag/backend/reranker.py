@@ -0,0 +1,133 @@
+import os
+import time
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Callable
+
+logger = logging.getLogger("RAG_RERANK")
+
+# ------------------------------------------------------------------------------
+# Config
+# ------------------------------------------------------------------------------
+RERANK_ENABLED = os.getenv("RERANK", "0") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+# Candidates fetched from retrieval before reranking
+RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", "12"))
+
+# Cross-encoder logit a chunk must reach to be kept (ms-marco models: > 0 ~ relevant)
+RERANK_MIN_SCORE = float(os.getenv("RERANK_MIN_SCORE", "0.0"))
+
+# Stop adding chunks once their combined size would exceed this (0 = no limit)
+RERANK_TOKEN_BUDGET = int(os.getenv("RERANK_TOKEN_BUDGET", "0"))
+
+# Hard per-request budget for the rerank stage; skipped if the predicted cost exceeds it
+RERANK_LATENCY_BUDGET_MS = float(os.getenv("RERANK_LATENCY_BUDGET_MS", "150"))
+
+# Skip reranking while this many rerank batches are already running (load shedding)
+RERANK_MAX_INFLIGHT = int(os.getenv("RERANK_MAX_INFLIGHT", "2"))
+
+
+def _approx_tokens(text: str) -> int:
+    # ~4 characters per token for English prose
+    return max(1, len(text or "") // 4)
+
+
+class Reranker:
+    def __init__(self, model_name: str = RERANK_MODEL, model: Any = None):
+        if model is None:
+            from sentence_transformers import CrossEncoder
+
+            logger.info("📦 [Rerank] Loading cross-encoder: %s", model_name)
+            model = CrossEncoder(model_name)
+        # Anything with CrossEncoder.predict(pairs, batch_size=...) works here
+        self.model = model
+        self.model_name = model_name
+
+        self._lock = threading.Lock()
+        self._inflight = 0
+        # EWMA of observed milliseconds per (query, chunk) pair; None until first batch
+        self._ms_per_pair: Optional[float] = None
+
+    def _predicted_ms(self, pairs: int) -> float:
+        return 0.0 if self._ms_per_pair is None else self._ms_per_pair * pairs
+
+    def rerank(
+        self,
+        question: str,
+        pack: Dict[str, Any],
+        k: int,
+        count_tokens: Optional[Callable[[str], int]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Scores every candidate in one batch and returns a pack (same shape as
+        retrieve_with_scores) holding at most k chunks above RERANK_MIN_SCORE and
+        within RERANK_TOKEN_BUDGET. Falls back to the retrieval order (truncated
+        to k) when over the latency budget or under load.
+        """
+        docs = pack["docs"]
+        if len(docs) <= 1:
+            return pack
+
+        passthrough = dict(pack)
+        for key in ("docs", "scores", "lexical_scores", "embeddings"):
+            if key in passthrough:
+                passthrough[key] = passthrough[key][:k]
+
+        with self._lock:
+            predicted = self._predicted_ms(len(docs))
+            if self._inflight >= RERANK_MAX_INFLIGHT or predicted > RERANK_LATENCY_BUDGET_MS:
+                if predicted > RERANK_LATENCY_BUDGET_MS:
+                    # Decay the estimate so one slow batch doesn't disable reranking for good
+                    self._ms_per_pair *= 0.9
+                logger.info(
+                    "⏭️ [Rerank] Skipped (inflight=%d predicted=%.0fms budget=%.0fms).",
+                    self._inflight, predicted, RERANK_LATENCY_BUDGET_MS,
+                )
+                return passthrough
+            self._inflight += 1
+
+        try:
+            t0 = time.perf_counter()
+            logits = self.model.predict([(question, d.page_content or "") for d in docs], batch_size=len(docs))
+            elapsed_ms = (time.perf_counter() - t0) * 1000.0
+        except Exception as e:
+            logger.warning("⚠️ [Rerank] Scoring failed; keeping retrieval order. err=%s", e)
+            return passthrough
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+        with self._lock:
+            per_pair = elapsed_ms / len(docs)
+            self._ms_per_pair = per_pair if self._ms_per_pair is None else 0.8 * self._ms_per_pair + 0.2 * per_pair
+
+        count = count_tokens or _approx_tokens
+        order = sorted(range(len(docs)), key=lambda i: float(logits[i]), reverse=True)
+
+        # The best chunk is always kept, even below the threshold: gating already
+        # decided this question is answerable from the corpus.
+        keep: List[int] = []
+        used = 0
+        for rank, i in enumerate(order[:k]):
+            if rank > 0 and float(logits[i]) < RERANK_MIN_SCORE:
+                break
+            cost = count(docs[i].page_content or "")
+            if RERANK_TOKEN_BUDGET and keep and used + cost > RERANK_TOKEN_BUDGET:
+                break
+            keep.append(i)
+            used += cost
+
+        logger.info(
+            "🎯 [Rerank] %d -> %d chunks in %.0fms (top=%.2f).",
+            len(docs), len(keep), elapsed_ms, float(logits[order[0]]),
+        )
+
+        out = dict(pack)
+        out["docs"] = [docs[i] for i in keep]
+        out["scores"] = [pack["scores"][i] if i < len(pack["scores"]) else None for i in keep]
+        for key in ("lexical_scores", "embeddings"):
+            if key in pack:
+                out[key] = [pack[key][i] for i in keep]
+        out["rerank_scores"] = [float(logits[i]) for i in keep]
+        return out
@@ -0,0 +1,153 @@
+import os
+import logging
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Callable
+
+logger = logging.getLogger("RAG_RESOURCES")
+
+# ------------------------------------------------------------------------------
+# CPU partitioning for inference
+#
+# With CPU_MANAGER=1 the cores this process may use are split into an "embed"
+# pool (query embedding + rerank) and a "generate" pool (BitNet / fallback).
+# Each pool is a small thread pool whose threads are pinned to the pool's cores
+# and whose torch intra-op thread count equals the pool's core count (OpenMP
+# thread counts are per calling thread), so a long generation can't starve
+# embedding and concurrent requests queue instead of oversubscribing cores.
+#
+#   CPU_EMBED_CORES / CPU_GEN_CORES   core lists like "0-1" or "0,2,4"
+#                                     (default: a quarter of the cores for embed, the rest for generate)
+#   CPU_EMBED_CONCURRENCY / CPU_GEN_CONCURRENCY
+#                                     requests a pool runs at once (default 1 each)
+#   CPU_PIN=0                         keep thread counts but skip affinity
+# ------------------------------------------------------------------------------
+CPU_MANAGER = os.getenv("CPU_MANAGER", "0") == "1"
+CPU_EMBED_CORES = os.getenv("CPU_EMBED_CORES", "")
+CPU_GEN_CORES = os.getenv("CPU_GEN_CORES", "")
+CPU_EMBED_CONCURRENCY = int(os.getenv("CPU_EMBED_CONCURRENCY", "1"))
+CPU_GEN_CONCURRENCY = int(os.getenv("CPU_GEN_CONCURRENCY", "1"))
+CPU_PIN = os.getenv("CPU_PIN", "1") == "1"
+
+
+def parse_cores(spec: str) -> List[int]:
+    cores: List[int] = []
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            cores.extend(range(int(lo), int(hi) + 1))
+        else:
+            cores.append(int(part))
+    return sorted(set(cores))
+
+
+def _available_cores() -> List[int]:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+class CorePool:
+    def __init__(self, name: str, cores: List[int], concurrency: int = 1):
+        self.name = name
+        self.cores = cores
+        self.threads = max(1, len(cores))
+        self.concurrency = max(1, concurrency)
+        self._local = threading.local()
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.concurrency,
+            thread_name_prefix=f"cpu-{name}",
+            initializer=self._init_thread,
+        )
+
+    def _init_thread(self) -> None:
+        self._local.inside = True
+        if CPU_PIN and self.cores:
+            try:
+                # pid 0 = the calling thread on Linux; OpenMP workers it spawns inherit the mask
+                os.sched_setaffinity(0, self.cores)
+            except (AttributeError, OSError) as e:
+                logger.warning("⚠️ [CPU] Could not pin %s thread to %s: %s", self.name, self.cores, e)
+        try:
+            import torch
+
+            torch.set_num_threads(self.threads)
+        except Exception:
+            pass
+
+    def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run fn on this pool and wait for it (inline when already on a pool thread)."""
+        if getattr(self._local, "inside", False):
+            return fn(*args, **kwargs)
+        # Carry the caller's context (tracing spans) onto the pool thread
+        ctx = contextvars.copy_context()
+        return self.executor.submit(ctx.run, fn, *args, **kwargs).result()
+
+    def describe(self) -> Dict[str, Any]:
+        return {"cores": self.cores, "threads": self.threads, "concurrency": self.concurrency}
+
+
+_pools: Dict[str, CorePool] = {}
+_configure_lock = threading.Lock()
+
+
+def configure() -> Dict[str, CorePool]:
+    """Create the pools once (no-op unless CPU_MANAGER=1). Call before models load."""
+    if not CPU_MANAGER:
+        return _pools
+
+    with _configure_lock:
+        if _pools:
+            return _pools
+
+        available = _available_cores()
+        embed = parse_cores(CPU_EMBED_CORES)
+        gen = parse_cores(CPU_GEN_CORES)
+        if not embed and not gen:
+            n_embed = max(1, len(available) // 4) if len(available) > 1 else 1
+            embed = available[:n_embed]
+            gen = available[n_embed:] or available
+        elif not gen:
+            gen = [c for c in available if c not in embed] or available
+        elif not embed:
+            embed = [c for c in available if c not in gen] or available
+
+        # HF fast tokenizers run on their own rayon pool; keep it inside the embed share
+        os.environ.setdefault("RAYON_RS_NUM_CPUS", str(len(embed)))
+        try:
+            import torch
+
+            torch.set_num_interop_threads(1)
+        except Exception:
+            pass
+
+        _pools["embed"] = CorePool("embed", embed, CPU_EMBED_CONCURRENCY)
+        _pools["generate"] = CorePool("generate", gen, CPU_GEN_CONCURRENCY)
+        logger.info(
+            "🧮 [CPU] embed=%s (x%d)  generate=%s (x%d)  pin=%s",
+            embed, CPU_EMBED_CONCURRENCY, gen, CPU_GEN_CONCURRENCY, CPU_PIN,
+        )
+        return _pools
+
+
+def pool(name: str) -> Optional[CorePool]:
+    return _pools.get(name)
+
+
+def run_embed(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    p = _pools.get("embed")
+    return p.run(fn, *args, **kwargs) if p is not None else fn(*args, **kwargs)
+
+
+def run_generate(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    p = _pools.get("generate")
+    return p.run(fn, *args, **kwargs) if p is not None else fn(*args, **kwargs)
+
+
+def describe() -> Dict[str, Any]:
+    return {name: p.describe() for name, p in _pools.items()}
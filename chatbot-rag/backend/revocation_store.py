@@ -0,0 +1,114 @@
+import os
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("RAG_REVOKED")
+
+# ------------------------------------------------------------------------------
+# Revoked access tokens
+#
+# Logout has to hold on every uvicorn worker, prefork child and the inference
+# process, so revocations live in SQLite (users.db by default, their own table)
+# rather than in one process's memory. A row is the token's digest plus its
+# `exp`; once that has passed the JWT check rejects the token anyway, so
+# sweep() deletes the row.
+#
+# Rows get increasing ids, so a process can mirror the table cheaply by asking
+# only for rows after the last id it has seen (since()).
+# ------------------------------------------------------------------------------
+REVOCATION_DB = os.getenv("REVOCATION_DB", os.getenv("USERS_DB", "users.db"))
+REVOCATION_SWEEP_INTERVAL_S = float(os.getenv("REVOCATION_SWEEP_INTERVAL_S", "300"))
+REVOCATION_DB_POOL_SIZE = int(os.getenv("REVOCATION_DB_POOL_SIZE", "2"))
+
+
+class RevocationStore:
+    _REVOKE = "INSERT OR IGNORE INTO revoked_tokens (digest, expires_at) VALUES (?, ?)"
+    _IS_REVOKED = "SELECT 1 FROM revoked_tokens WHERE digest = ? AND expires_at > ?"
+    _SINCE = "SELECT id, digest, expires_at FROM revoked_tokens WHERE id > ? AND expires_at > ? ORDER BY id"
+    _SWEEP = "DELETE FROM revoked_tokens WHERE expires_at <= ?"
+
+    def __init__(self, path: str = REVOCATION_DB, pool_size: int = REVOCATION_DB_POOL_SIZE):
+        self.path = path
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        conn = self._connect()
+        try:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS revoked_tokens (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    digest BLOB NOT NULL UNIQUE,
+                    expires_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS revoked_tokens_expiry ON revoked_tokens (expires_at);
+                """
+            )
+        finally:
+            conn.close()
+        for _ in range(max(1, pool_size)):
+            self._pool.put(self._connect())
+        self._last_sweep = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10.0, check_same_thread=False, isolation_level=None, cached_statements=16)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=10000")
+        return conn
+
+    @contextmanager
+    def _conn(self) -> Iterator[sqlite3.Connection]:
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def revoke(self, digest: bytes, expires_at: float) -> None:
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(self._REVOKE, (digest, expires_at))
+        if now - self._last_sweep >= REVOCATION_SWEEP_INTERVAL_S:
+            self.sweep(now)
+
+    def is_revoked(self, digest: bytes) -> bool:
+        with self._conn() as conn:
+            return conn.execute(self._IS_REVOKED, (digest, time.time())).fetchone() is not None
+
+    def since(self, last_id: int) -> Tuple[List[Tuple[bytes, float]], int]:
+        """Live revocations added after row `last_id`, and the id to pass next time."""
+        with self._conn() as conn:
+            rows = conn.execute(self._SINCE, (last_id, time.time())).fetchall()
+        if not rows:
+            return [], last_id
+        return [(bytes(r[1]), float(r[2])) for r in rows], int(rows[-1][0])
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        self._last_sweep = now
+        with self._conn() as conn:
+            removed = conn.execute(self._SWEEP, (now,)).rowcount
+        if removed:
+            logger.info("🧹 [Revoked] Swept %d expired tokens.", removed)
+        return removed
+
+    def count(self) -> int:
+        with self._conn() as conn:
+            return int(conn.execute("SELECT COUNT(*) FROM revoked_tokens").fetchone()[0])
+
+
+_store: Optional[RevocationStore] = None
+_store_lock = threading.Lock()
+
+
+def get_revocation_store() -> RevocationStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = RevocationStore(REVOCATION_DB)
+    return _store
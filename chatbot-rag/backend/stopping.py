@@ -0,0 +1,89 @@
+import os
+import re
+from typing import List, Optional
+
+# ------------------------------------------------------------------------------
+# Answer-shape stopping
+#
+# _finalize_answer keeps the first line of the output, cut at any template
+# marker. AnswerStopper ends decoding as soon as that line is complete, so the
+# tokens that would be thrown away are never generated:
+#   - a newline after some answer text
+#   - a template marker (the model starting to echo the prompt)
+#   - GEN_MAX_SENTENCES finished sentences (the prompt asks for 1-3)
+# Rows of a batch stop independently.
+# ------------------------------------------------------------------------------
+GEN_MAX_SENTENCES = int(os.getenv("GEN_MAX_SENTENCES", "3"))
+GEN_EARLY_STOP = os.getenv("GEN_EARLY_STOP", "1") == "1"
+
+STOP_MARKERS = ("RULES:", "Context:", "Question:")
+
+# Terminator (closing quotes/brackets allowed after it) followed by whitespace or
+# the end of the text so far: stopping right on the "." keeps the next sentence's
+# first word out of the answer.
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]*(?:\s|$)")
+_ABBREVIATIONS = frozenset("e.g. i.e. etc. vs. dr. mr. mrs. ms. st. no. approx.".split())
+
+
+def count_sentences(text: str) -> int:
+    n = 0
+    for m in _SENTENCE_END.finditer(text):
+        start = text.rfind(" ", 0, m.start()) + 1
+        if text[start:m.start() + 1].lower() in _ABBREVIATIONS:
+            continue
+        # "4." at the very end may still become "4.5"
+        if m.end() == len(text) and m.start() > 0 and text[m.start() - 1].isdigit():
+            continue
+        n += 1
+    return n
+
+
+def answer_complete(text: str, max_sentences: int = GEN_MAX_SENTENCES) -> bool:
+    """True once generating more can't change what _finalize_answer keeps."""
+    t = text.lstrip()
+    if not t:
+        return False
+    if "\n" in t:
+        return True
+    if any(marker in t for marker in STOP_MARKERS):
+        return True
+    return max_sentences > 0 and count_sentences(t) >= max_sentences
+
+
+class AnswerStopper:
+    def __init__(self, tokenizer, prompt_len: int, max_sentences: int = GEN_MAX_SENTENCES):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.max_sentences = max_sentences
+        self._done: Optional[List[bool]] = None
+
+    @property
+    def stopped_rows(self) -> int:
+        return sum(self._done or [])
+
+    def criterion(self):
+        from transformers import StoppingCriteria  # type: ignore
+
+        stopper = self
+
+        class _AnswerCriteria(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                import torch
+
+                rows = int(input_ids.shape[0])
+                if stopper._done is None:
+                    stopper._done = [False] * rows
+                for i in range(rows):
+                    if not stopper._done[i]:
+                        text = stopper.tokenizer.decode(input_ids[i, stopper.prompt_len:], skip_special_tokens=True)
+                        stopper._done[i] = answer_complete(text, stopper.max_sentences)
+                return torch.tensor(stopper._done, dtype=torch.bool, device=input_ids.device)
+
+        return _AnswerCriteria()
+
+
+def answer_criteria(tokenizer, prompt_len: int) -> list:
+    """[criterion] for _stopping_kwargs, or [] when GEN_EARLY_STOP=0."""
+    if not GEN_EARLY_STOP:
+        return []
+    return [AnswerStopper(tokenizer, prompt_len).criterion()]
@@ -0,0 +1,110 @@
+# backend/test_admission.py
+import asyncio
+
+import pytest
+
+from admission import PRIORITY_CHAT, PRIORITY_STREAM, AdmissionController, Overloaded
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_freed_slot_goes_to_highest_priority_then_fifo():
+    async def run():
+        adm = AdmissionController(max_inflight=1, max_queue=8, queue_timeout_s=30)
+        await adm.acquire()
+        order = []
+
+        async def waiter(name, priority):
+            await adm.acquire(priority)
+            order.append(name)
+            adm.release(0.0)
+
+        tasks = [
+            asyncio.create_task(waiter("chat-1", PRIORITY_CHAT)),
+            asyncio.create_task(waiter("chat-2", PRIORITY_CHAT)),
+            asyncio.create_task(waiter("stream-1", PRIORITY_STREAM)),
+            asyncio.create_task(waiter("stream-2", PRIORITY_STREAM)),
+        ]
+        await _settle()
+        assert adm.stats()["queued"] == 4
+        adm.release(0.0)
+        await asyncio.gather(*tasks)
+        assert order == ["stream-1", "stream-2", "chat-1", "chat-2"]
+        assert adm.stats()["inflight"] == 0
+
+    asyncio.run(run())
+
+
+def test_full_queue_rejects_with_429_and_retry_after():
+    async def run():
+        adm = AdmissionController(max_inflight=1, max_queue=1, queue_timeout_s=30)
+        await adm.acquire()
+        queued = asyncio.create_task(adm.acquire(PRIORITY_STREAM))
+        await _settle()
+        with pytest.raises(Overloaded) as exc:
+            await adm.acquire(PRIORITY_STREAM)
+        assert exc.value.status_code == 429 and exc.value.retry_after >= 1
+        with pytest.raises(Overloaded):
+            adm.check(PRIORITY_CHAT)
+        queued.cancel()
+
+    asyncio.run(run())
+
+
+def test_higher_priority_sheds_newest_lower_priority_waiter_with_503():
+    async def run():
+        adm = AdmissionController(max_inflight=1, max_queue=2, queue_timeout_s=30)
+        await adm.acquire()
+        old_chat = asyncio.create_task(adm.acquire(PRIORITY_CHAT))
+        new_chat = asyncio.create_task(adm.acquire(PRIORITY_CHAT))
+        await _settle()
+        stream = asyncio.create_task(adm.acquire(PRIORITY_STREAM))
+        await _settle()
+
+        with pytest.raises(Overloaded) as exc:
+            await new_chat
+        assert exc.value.status_code == 503 and exc.value.retry_after >= 1
+        assert not old_chat.done()
+        adm.release(0.0)
+        await stream
+        old_chat.cancel()
+        assert adm.stats()["rejected"] == 1
+
+    asyncio.run(run())
+
+
+def test_predicted_wait_past_deadline_rejects_with_503():
+    async def run():
+        adm = AdmissionController(max_inflight=1, max_queue=8, queue_timeout_s=1.0)
+        adm._service_s = 5.0
+        await adm.acquire()
+        with pytest.raises(Overloaded) as exc:
+            await adm.acquire()
+        assert exc.value.status_code == 503
+        assert exc.value.retry_after == 5
+
+    asyncio.run(run())
+
+
+def test_waiter_is_expired_at_queue_deadline():
+    async def run():
+        adm = AdmissionController(max_inflight=1, max_queue=8, queue_timeout_s=0.05)
+        adm._service_s = 0.01
+        await adm.acquire()
+        with pytest.raises(Overloaded) as exc:
+            await adm.acquire()
+        assert exc.value.status_code == 503 and adm.stats()["expired"] == 1
+        adm.release(0.0)
+        assert adm.stats()["inflight"] == 0
+
+    asyncio.run(run())
+
+
+def test_overloaded_maps_to_http_status_with_retry_after():
+    pytest.importorskip("fastapi")
+    api_v2 = pytest.importorskip("api_v2")
+    err = api_v2._overloaded(Overloaded(429, 7, "queue full"))
+    assert err.status_code == 429 and err.headers == {"Retry-After": "7"}
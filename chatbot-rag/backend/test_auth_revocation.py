@@ -0,0 +1,55 @@
+# backend/test_auth_revocation.py
+import os
+import subprocess
+import sys
+
+import pytest
+
+import auth
+import revocation_store
+from auth import TokenInvalid, create_access_token, verify_access_token
+
+_REVOKE_IN_OTHER_PROCESS = """
+import sys
+import auth
+sys.exit(0 if auth.revoke_token(sys.argv[1]) else 1)
+"""
+
+
+@pytest.fixture
+def shared_db(tmp_path, monkeypatch):
+    path = str(tmp_path / "users.db")
+    monkeypatch.setattr(revocation_store, "_store", revocation_store.RevocationStore(path))
+    monkeypatch.setattr(auth, "_revoked", {})
+    monkeypatch.setattr(auth, "_revoked_cursor", 0)
+    monkeypatch.setattr(auth, "_revoked_synced_at", 0.0)
+    monkeypatch.setattr(auth, "REVOCATION_SYNC_S", 0.0)
+    return path
+
+
+def _revoke_elsewhere(token: str, db_path: str) -> None:
+    env = dict(os.environ, REVOCATION_DB=db_path, JWT_SECRET=auth.SECRET_KEY)
+    here = os.path.dirname(os.path.abspath(__file__))
+    subprocess.run([sys.executable, "-c", _REVOKE_IN_OTHER_PROCESS, token], cwd=here, env=env, check=True)
+
+
+def test_logout_in_another_process_rejects_cached_token(shared_db):
+    token = create_access_token({"sub": "a@example.com", "role": "user"})
+    assert verify_access_token(token)["sub"] == "a@example.com"
+    assert verify_access_token(token)["sub"] == "a@example.com"  # now served from the cache
+
+    _revoke_elsewhere(token, shared_db)
+
+    with pytest.raises(TokenInvalid):
+        verify_access_token(token)
+
+
+def test_logout_in_another_process_rejects_uncached_token(shared_db, monkeypatch):
+    token = create_access_token({"sub": "b@example.com", "role": "user"})
+    _revoke_elsewhere(token, shared_db)
+
+    # Mirror is stale, so only the direct lookup on the cache miss can catch it
+    monkeypatch.setattr(auth, "REVOCATION_SYNC_S", 3600.0)
+    monkeypatch.setattr(auth, "_revoked_synced_at", float("inf"))
+    with pytest.raises(TokenInvalid):
+        verify_access_token(token)
@@ -0,0 +1,94 @@
+# backend/test_code_store.py
+import types
+
+import pytest
+
+import code_store
+from code_store import RateLimited, VerificationCodeStore, check_rate
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(code_store, "time", types.SimpleNamespace(time=c.time))
+    return c
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch, clock):
+    s = VerificationCodeStore(str(tmp_path / "codes.db"))
+    monkeypatch.setattr(code_store, "_store", s)
+    monkeypatch.setattr(code_store, "CODE_EMAIL_BURST", 2.0)
+    monkeypatch.setattr(code_store, "CODE_EMAIL_PER_HOUR", 3600.0)  # one token per second
+    monkeypatch.setattr(code_store, "CODE_IP_BURST", 3.0)
+    monkeypatch.setattr(code_store, "CODE_IP_PER_HOUR", 1800.0)
+    return s
+
+
+def test_code_expires_after_ttl(store, clock):
+    store.put("a@example.com", "123456", ttl_s=60)
+    clock.now += 61
+    assert not store.check("a@example.com", "123456")
+
+    store.put("a@example.com", "654321", ttl_s=60)
+    clock.now += 59
+    assert store.check("a@example.com", "654321")
+    assert not store.check("a@example.com", "654321")  # consumed
+
+
+def test_sweep_removes_expired_codes(store, clock):
+    store.put("a@example.com", "1", ttl_s=10)
+    store.put("b@example.com", "2", ttl_s=100)
+    clock.now += 50
+    store.sweep()
+    assert store.count() == 1
+
+
+def test_code_is_burned_after_max_attempts(store):
+    store.put("a@example.com", "123456")
+    for _ in range(2):
+        assert not store.check("a@example.com", "000000", max_attempts=3)
+    assert store.count() == 1
+    assert not store.check("a@example.com", "000000", max_attempts=3)
+    assert store.count() == 0
+    assert not store.check("a@example.com", "123456", max_attempts=3)
+
+
+def test_email_bucket_limits_and_refills(store, clock):
+    check_rate("a@example.com", None)
+    check_rate("A@example.com", None)  # same bucket, case-insensitive
+    with pytest.raises(RateLimited) as exc:
+        check_rate("a@example.com", None)
+    assert exc.value.key == "email:a@example.com"
+    assert exc.value.retry_after == pytest.approx(1.0)
+    clock.now += 1.0
+    check_rate("a@example.com", None)
+
+
+def test_ip_bucket_limits_across_emails(store):
+    for i in range(3):
+        check_rate(f"u{i}@example.com", "10.0.0.1")
+    with pytest.raises(RateLimited) as exc:
+        check_rate("u9@example.com", "10.0.0.1")
+    assert exc.value.key == "ip:10.0.0.1"
+    check_rate("u9@example.com", "10.0.0.2")
+
+
+def test_denied_request_charges_neither_bucket(store):
+    check_rate("a@example.com", "10.0.0.1")
+    check_rate("a@example.com", "10.0.0.1")
+    for _ in range(5):
+        with pytest.raises(RateLimited):
+            check_rate("a@example.com", "10.0.0.1")
+    # The throttled email spent nothing from the IP bucket: one token is left
+    check_rate("b@example.com", "10.0.0.1")
+    with pytest.raises(RateLimited):
+        check_rate("c@example.com", "10.0.0.1")
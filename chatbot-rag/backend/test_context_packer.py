@@ -0,0 +1,72 @@
+# backend/test_context_packer.py
+import random
+
+import pytest
+from langchain_core.documents import Document
+
+from context_packer import pack_context
+
+
+def words(text):
+    return len(text.split())
+
+
+def _doc(text, source="guide.pdf"):
+    return Document(page_content=text, metadata={"source": source})
+
+
+def _overlapping_chunks(text, size=300, overlap=80):
+    out, i = [], 0
+    while i < len(text):
+        out.append(text[i:i + size])
+        i += size - overlap
+    return out
+
+
+# Distinct words, so the only repeated spans are the ones the overlap creates
+_rng = random.Random(0)
+BODY = " ".join(f"{_rng.choice(['calm', 'slow', 'deep', 'box', 'paced'])}{i}" for i in range(400))
+
+
+def test_splitter_overlap_is_removed():
+    chunks = _overlapping_chunks(BODY)
+    packed = pack_context([_doc(c) for c in chunks], words, budget=10_000)
+    # Chunks are cut mid-word, so compare ignoring whitespace
+    assert "".join(packed.context.split()) == "".join(BODY.split())
+    assert packed.tokens_used < packed.tokens_raw
+
+
+def test_contained_chunk_is_dropped_and_other_sources_are_kept():
+    first = _doc("Box breathing: inhale four seconds, hold four, exhale four, hold four again.")
+    inner = _doc("inhale four seconds, hold four")
+    same_text_elsewhere = _doc(inner.page_content, source="other.pdf")
+    packed = pack_context([first, inner, same_text_elsewhere], words, budget=10_000)
+    assert [d.metadata["source"] for d in packed.docs] == ["guide.pdf", "other.pdf"]
+
+
+@pytest.mark.parametrize("budget", [5, 40, 120, 333])
+def test_budget_is_never_exceeded(budget):
+    rng = random.Random(budget)
+    docs = [_doc(" ".join(f"w{rng.randint(0, 999)}" for _ in range(rng.randint(5, 90))), f"s{i}") for i in range(12)]
+    packed = pack_context(docs, words, budget=budget)
+    assert packed.tokens_used <= budget
+    assert words(packed.context) <= budget
+    assert packed.tokens_used == sum(words(d.page_content) for d in packed.docs)
+
+
+def test_first_chunk_is_truncated_rather_than_dropped():
+    packed = pack_context([_doc(BODY)], words, budget=25)
+    assert 0 < packed.tokens_used <= 25
+    assert BODY.startswith(packed.context)
+
+
+def test_tokens_saved_counts_overlap_and_budget_cuts():
+    chunks = _overlapping_chunks(BODY)
+    raw = sum(words(c) for c in chunks)
+    packed = pack_context([_doc(c) for c in chunks], words, budget=10_000)
+    assert packed.tokens_raw == raw
+    assert packed.tokens_saved == raw - packed.tokens_used > 0
+
+    tight = pack_context([_doc(c) for c in chunks], words, budget=30)
+    assert tight.tokens_saved == raw - tight.tokens_used
+    assert pack_context([], words).tokens_saved == 0
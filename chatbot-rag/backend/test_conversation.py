@@ -0,0 +1,41 @@
+# backend/test_conversation.py
+from conversation import SessionMemory, is_followup
+
+
+def test_short_standalone_questions_are_not_followups():
+    for q in ("What is anxiety?", "What is mindfulness?", "How do I meditate?", "help", "What is depression?"):
+        assert not is_followup(q), q
+
+
+def test_referring_and_continuation_questions_are_followups():
+    for q in ("what about at night?", "is it normal?", "tell me more", "and at school?"):
+        assert is_followup(q), q
+
+
+def test_one_term_standalone_question_is_not_condensed():
+    mem = SessionMemory()
+    first = mem.condense("u1", "How can I sleep better?")
+    mem.remember_query("u1", "How can I sleep better?", first, [1.0, 0.0])
+
+    condensed = mem.condense("u1", "What is depression?")
+    assert not condensed.followup
+    assert condensed.query == "What is depression?"
+    assert condensed.topic_vec is None
+
+    mem.remember_query("u1", "What is depression?", condensed, [0.0, 1.0])
+    followup = mem.condense("u1", "what about at night?")
+    assert followup.followup
+    assert followup.query == "What is depression? what about at night?"
+    assert followup.topic_vec == [0.0, 1.0]
+
+
+def test_standalone_question_moves_topic_without_being_searched():
+    mem = SessionMemory()
+    first = mem.condense("u1", "How can I sleep better?")
+    mem.remember_query("u1", "How can I sleep better?", first, [1.0, 0.0])
+
+    # Rejected before retrieval, so remember_query never runs for it
+    mem.condense("u1", "What is depression?")
+    followup = mem.condense("u1", "is it normal?")
+    assert followup.query == "What is depression? is it normal?"
+    assert followup.topic_vec is None
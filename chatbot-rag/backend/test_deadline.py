@@ -0,0 +1,71 @@
+# backend/test_deadline.py
+import threading
+import time
+
+import pytest
+
+from deadline import Deadline, DeadlineGroup, RequestCancelled, check_deadline
+
+
+def test_deadline_expires():
+    d = Deadline(0.05)
+    assert not d.done and 0 < d.remaining() <= 0.05
+    d.check("retrieve")
+    time.sleep(0.06)
+    assert d.expired and d.done and d.remaining() == 0.0
+    with pytest.raises(RequestCancelled, match=r"deadline exceeded \(generate\)"):
+        d.check("generate")
+
+
+def test_no_timeout_never_expires():
+    d = Deadline(None)
+    assert d.remaining() is None and not d.done
+    assert Deadline(0).expires_at is None
+
+
+def test_cancel_from_another_thread_keeps_first_reason():
+    d = Deadline(60)
+    t = threading.Thread(target=d.cancel, args=("client disconnected",))
+    t.start()
+    t.join()
+    d.cancel("second reason")
+    assert d.done and not d.expired and d.remaining() == 0.0
+    with pytest.raises(RequestCancelled) as exc:
+        d.check()
+    assert exc.value.reason == "client disconnected"
+
+
+def test_group_is_done_only_when_every_member_is():
+    a, b = Deadline(60), Deadline(60)
+    group = DeadlineGroup([a, b])
+    a.cancel("client disconnected")
+    assert not group.done
+    group.check("generate")
+    b.cancel("client disconnected")
+    assert group.done
+    with pytest.raises(RequestCancelled, match="client disconnected"):
+        group.check("generate")
+
+
+def test_group_expiry_and_remaining_follow_the_latest_member():
+    short, long = Deadline(0.05), Deadline(60)
+    group = DeadlineGroup([short, long])
+    assert group.remaining() > 50
+    time.sleep(0.06)
+    assert short.done and not group.expired and not group.done
+    assert DeadlineGroup([short, Deadline(None)]).remaining() is None
+    assert DeadlineGroup([short]).expired
+
+
+def test_group_cancel_stops_everyone():
+    group = DeadlineGroup([Deadline(60), Deadline(60)])
+    group.cancel("shutting down")
+    assert group.done and group.remaining() == 0.0 and group.reason == "shutting down"
+
+
+def test_check_deadline_tolerates_none():
+    check_deadline(None, "retrieve")
+    d = Deadline(60)
+    d.cancel()
+    with pytest.raises(RequestCancelled):
+        check_deadline(d, "retrieve")
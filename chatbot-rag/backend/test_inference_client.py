@@ -0,0 +1,52 @@
+# backend/test_inference_client.py
+import json
+import socket
+import threading
+
+import pytest
+
+from inference_service import _HEADER, _encode, InferenceClient
+
+
+def _serve(path, replies):
+    """One-connection fake server: answers each request with replies.pop(0)(request)."""
+    srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    srv.bind(path)
+    srv.listen(4)
+
+    def _recv(conn, n):
+        buf = b""
+        while len(buf) < n:
+            chunk = conn.recv(n - len(buf))
+            if not chunk:
+                return None
+            buf += chunk
+        return buf
+
+    def _loop():
+        while replies:
+            conn, _ = srv.accept()
+            with conn:
+                while replies:
+                    head = _recv(conn, _HEADER.size)
+                    if head is None:
+                        break
+                    req = json.loads(_recv(conn, _HEADER.unpack(head)[0]))
+                    conn.sendall(_encode(replies.pop(0)(req)))
+        srv.close()
+
+    threading.Thread(target=_loop, daemon=True).start()
+
+
+def test_mismatched_response_id_drops_the_connection(tmp_path):
+    path = str(tmp_path / "inf.sock")
+    _serve(path, [
+        lambda req: {"id": req["id"] + 100, "ok": True, "result": "stale"},
+        lambda req: {"id": req["id"], "ok": True, "result": "fresh"},
+    ])
+    client = InferenceClient(path, timeout=5.0)
+
+    with pytest.raises(ConnectionError):
+        client.call("info")
+    assert client._local.sock is None
+    assert client.call("info") == "fresh"
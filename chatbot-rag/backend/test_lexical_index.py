@@ -0,0 +1,67 @@
+# backend/test_lexical_index.py
+import pytest
+from langchain_core.documents import Document
+
+from lexical_index import BM25Index, tokenize
+
+TEXTS = [
+    "Panic attacks can cause a racing heart and a tight chest.",
+    "Slow breathing exercises help calm a panic attack within minutes.",
+    "Our refund policy allows returns within thirty days of purchase.",
+    "Breathing, breathing, breathing: the breathing guide covers box breathing for sleep.",
+]
+
+
+def _index():
+    return BM25Index.build(TEXTS, [{"row": i} for i in range(len(TEXTS))], [f"c{i}" for i in range(len(TEXTS))])
+
+
+def test_tokenize_drops_stopwords_and_folds_forms():
+    assert tokenize("What are the panic attacks?") == ["panic", "attack"]
+    assert tokenize("breathing") == tokenize("breathe")
+
+
+def test_ranking_prefers_chunks_matching_more_query_terms():
+    hits = _index().search("panic attack breathing", k=4)
+    rows = [row for row, _, _ in hits]
+    assert rows[0] == 1  # the only chunk with all three terms
+    assert hits[0][2] == pytest.approx(1.0)
+    assert 2 not in rows  # no shared term, no score
+    assert [s for _, s, _ in hits] == sorted((s for _, s, _ in hits), reverse=True)
+
+
+def test_term_frequency_saturates_and_rare_terms_weigh_more():
+    index = _index()
+    (top, _, _), = index.search("refund", k=1)
+    assert top == 2
+    scores = {row: s for row, s, _ in index.search("breathing", k=4)}
+    # Repeating a term helps, but far less than linearly
+    assert scores[3] > scores[1] and scores[3] < 5 * scores[1]
+
+
+def test_empty_query_or_k_returns_nothing():
+    index = _index()
+    assert index.search("the and of", k=3) == []
+    assert index.search("panic", k=0) == []
+
+
+def test_reload_from_json_gives_same_results(tmp_path):
+    index = _index()
+    path = str(tmp_path / "bm25" / "index.json")
+    index.save(path)
+    loaded = BM25Index.load(path)
+
+    assert len(loaded) == len(index) and loaded.ids == index.ids and loaded.metadatas == index.metadatas
+    assert set(loaded.vocabulary) == set(index.vocabulary)
+    for q in ("panic attack breathing", "refund returns", "sleep"):
+        assert loaded.search(q, k=4) == index.search(q, k=4)
+    assert BM25Index.load(str(tmp_path / "missing.json")) is None
+
+
+def test_full_lexical_coverage_needs_two_query_terms():
+    chain_v2 = pytest.importorskip("chain_v2")
+    docs = [Document(page_content="x")]
+    low = [0.0]  # dense scores alone would reject this
+    assert not chain_v2.retrieval_is_relevant("relevance", low, docs, lexical_scores=[1.0], query_terms=1)
+    assert chain_v2.retrieval_is_relevant("relevance", low, docs, lexical_scores=[1.0], query_terms=2)
+    assert not chain_v2.retrieval_is_relevant("relevance", low, docs, lexical_scores=[0.5], query_terms=2)
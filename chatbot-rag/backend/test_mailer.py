@@ -0,0 +1,172 @@
+# backend/test_mailer.py
+import asyncio
+import time
+
+import pytest
+
+import mailer
+from mailer import LocalSMTPServer, Mailer, PermanentMailError
+
+
+@pytest.fixture(autouse=True)
+def fast_queue(monkeypatch):
+    monkeypatch.setattr(mailer, "MAIL_BATCH_WAIT_MS", 50.0)
+    monkeypatch.setattr(mailer, "MAIL_BACKOFF_S", 0.05)
+    monkeypatch.setattr(mailer, "MAIL_MAX_RETRIES", 3)
+
+
+async def _until(cond, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > end:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.01)
+
+
+# --- against the SMTP stand-in (needs aiosmtplib, like MAIL_BACKEND=smtp) ---
+
+def _smtp_mailer(monkeypatch, srv):
+    pytest.importorskip("aiosmtplib")
+    monkeypatch.setattr(mailer, "SMTP_HOST", srv.host)
+    monkeypatch.setattr(mailer, "SMTP_PORT", srv.port)
+    monkeypatch.setattr(mailer, "SMTP_USER", "")
+    return Mailer("smtp")
+
+
+def test_enqueued_mail_is_delivered(monkeypatch):
+    async def run():
+        async with LocalSMTPServer(port=0) as srv:
+            m = _smtp_mailer(monkeypatch, srv)
+            await m.start()
+            m.send("a@example.com", "Your code", "123456")
+            await _until(lambda: m.stats["sent"] == 1)
+            await m.stop()
+            assert len(srv.messages) == 1
+            assert srv.messages[0]["subject"] == "Your code"
+            assert srv.messages[0]["to"] == ["<a@example.com>"]
+
+    asyncio.run(run())
+
+
+def test_messages_share_one_batch_and_connection(monkeypatch):
+    async def run():
+        async with LocalSMTPServer(port=0) as srv:
+            m = _smtp_mailer(monkeypatch, srv)
+            await m.start()
+            for i in range(5):
+                m.send(f"u{i}@example.com", "hi", "body")
+            await _until(lambda: m.stats["sent"] == 5)
+            await m.stop()
+            assert m.stats["batches"] == 1
+            assert srv.sessions == 1
+            assert len(srv.messages) == 5
+
+    asyncio.run(run())
+
+
+def test_transient_failure_is_retried(monkeypatch):
+    async def run():
+        async with LocalSMTPServer(port=0, fail_next=1) as srv:
+            m = _smtp_mailer(monkeypatch, srv)
+            await m.start()
+            m.send("a@example.com", "hi", "body")
+            await _until(lambda: m.stats["sent"] == 1)
+            await m.stop()
+            assert m.stats["retried"] == 1
+            assert len(srv.messages) == 1
+
+    asyncio.run(run())
+
+
+def test_permanent_rejection_is_not_retried(monkeypatch):
+    async def run():
+        async with LocalSMTPServer(port=0, reject=["gone@example.com"]) as srv:
+            m = _smtp_mailer(monkeypatch, srv)
+            await m.start()
+            m.send("gone@example.com", "hi", "body")
+            await _until(lambda: m.stats["failed"] == 1)
+            await asyncio.sleep(0.2)
+            await m.stop()
+            assert m.stats["retried"] == 0 and m.stats["sent"] == 0
+            assert srv.messages == []
+
+    asyncio.run(run())
+
+
+# --- queue behaviour with a scripted backend (no SMTP client needed) ---
+
+class ScriptedBackend:
+    """Answers each send_batch call with the next scripted result (None = delivered)."""
+
+    def __init__(self, script=()):
+        self.script = list(script)
+        self.calls = []
+
+    async def send_batch(self, batch):
+        self.calls.append(([msg["To"] for msg in batch], time.monotonic()))
+        return [self.script.pop(0) if self.script else None for _ in batch]
+
+    async def close(self):
+        pass
+
+
+def _scripted_mailer(backend):
+    m = Mailer("console")
+    m._make_backend = lambda: backend
+    return m
+
+
+def test_queue_sends_burst_as_one_batch():
+    async def run():
+        backend = ScriptedBackend()
+        m = _scripted_mailer(backend)
+        await m.start()
+        for i in range(4):
+            m.send(f"u{i}@example.com", "hi", "body")
+        await _until(lambda: m.stats["sent"] == 4)
+        await m.stop()
+        assert len(backend.calls) == 1 and len(backend.calls[0][0]) == 4
+
+    asyncio.run(run())
+
+
+def test_queue_retries_with_exponential_backoff():
+    async def run():
+        backend = ScriptedBackend([ConnectionError("down"), ConnectionError("down"), None])
+        m = _scripted_mailer(backend)
+        await m.start()
+        m.send("a@example.com", "hi", "body")
+        await _until(lambda: m.stats["sent"] == 1)
+        await m.stop()
+        assert m.stats["retried"] == 2
+        (_, t0), (_, t1), (_, t2) = backend.calls
+        assert t1 - t0 >= 0.05 and t2 - t1 >= 0.1
+
+    asyncio.run(run())
+
+
+def test_queue_does_not_retry_permanent_errors():
+    async def run():
+        backend = ScriptedBackend([PermanentMailError("550 no such user")])
+        m = _scripted_mailer(backend)
+        await m.start()
+        m.send("a@example.com", "hi", "body")
+        await _until(lambda: m.stats["failed"] == 1)
+        await asyncio.sleep(0.2)
+        await m.stop()
+        assert len(backend.calls) == 1 and m.stats["retried"] == 0
+
+    asyncio.run(run())
+
+
+def test_queue_gives_up_after_max_retries():
+    async def run():
+        backend = ScriptedBackend([ConnectionError("down")] * 10)
+        m = _scripted_mailer(backend)
+        await m.start()
+        m.send("a@example.com", "hi", "body")
+        await _until(lambda: m.stats["failed"] == 1)
+        await m.stop()
+        assert len(backend.calls) == mailer.MAIL_MAX_RETRIES + 1
+
+    asyncio.run(run())
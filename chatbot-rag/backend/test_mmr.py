@@ -0,0 +1,48 @@
+# backend/test_mmr.py
+import numpy as np
+import pytest
+
+from mmr import mmr_order
+
+
+def _candidates(seed=0, n=12, dim=32):
+    rng = np.random.default_rng(seed)
+    q = rng.standard_normal(dim)
+    cands = rng.standard_normal((n, dim)) + 0.5 * q
+    return q, cands
+
+
+def test_lambda_one_is_relevance_order():
+    q, cands = _candidates()
+    unit = cands / np.linalg.norm(cands, axis=1, keepdims=True)
+    expected = list(np.argsort(-(unit @ (q / np.linalg.norm(q)))))
+    assert mmr_order(q, cands, lambda_mult=1.0) == expected
+    assert mmr_order(q, cands, lambda_mult=1.0, k=4) == expected[:4]
+
+
+def test_near_duplicates_of_the_top_hit_go_last():
+    q, cands = _candidates(n=8)
+    top = int(np.argmax((cands / np.linalg.norm(cands, axis=1, keepdims=True)) @ q))
+    rng = np.random.default_rng(1)
+    dupes = cands[top] + 1e-3 * rng.standard_normal((3, cands.shape[1]))
+    pool = np.vstack([cands, dupes])
+    dupe_rows = {len(cands), len(cands) + 1, len(cands) + 2}
+
+    order = mmr_order(q, pool, lambda_mult=0.5)
+    assert order[0] in dupe_rows | {top}
+    assert set(order[-3:]) <= dupe_rows | {top}
+    assert sorted(order) == list(range(len(pool)))
+
+
+def test_edge_cases():
+    assert mmr_order(np.ones(4), np.zeros((0, 4))) == []
+    # Zero vectors don't divide by zero
+    assert sorted(mmr_order(np.ones(4), [[0, 0, 0, 0], [1, 0, 0, 0]])) == [0, 1]
+    assert len(mmr_order(np.ones(4), np.eye(4), k=10)) == 4
+
+
+def test_matches_langchain_mmr():
+    utils = pytest.importorskip("langchain_community.vectorstores.utils")
+    q, cands = _candidates(seed=3)
+    expected = utils.maximal_marginal_relevance(q, list(cands), lambda_mult=0.6, k=6)
+    assert mmr_order(q, cands, lambda_mult=0.6, k=6) == expected
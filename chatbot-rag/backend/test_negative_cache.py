@@ -0,0 +1,67 @@
+# backend/test_negative_cache.py
+import numpy as np
+import pytest
+
+import negative_cache
+from lexical_index import tokenize
+from negative_cache import NegativeCache
+
+
+def _near(vec, cos, seed=0):
+    """A unit vector at exactly `cos` cosine from unit `vec`."""
+    rng = np.random.default_rng(seed)
+    r = rng.standard_normal(vec.shape[0]).astype(np.float32)
+    r -= (r @ vec) * vec
+    r /= np.linalg.norm(r)
+    return cos * vec + np.sqrt(1 - cos ** 2) * r
+
+
+@pytest.fixture
+def cache():
+    return NegativeCache(size=8, ttl_s=60.0, sim=0.95)
+
+
+def test_rejected_text_hits_after_normalization(cache):
+    cache.add("What is the weather on Mars?")
+    assert cache.has_text("what is the WEATHER on mars")
+    assert not cache.has_text("What is the weather on Venus?")
+
+
+def test_rejected_text_expires(cache, monkeypatch):
+    cache.add("What is the weather on Mars?")
+    now = negative_cache.time.time()
+    monkeypatch.setattr(negative_cache.time, "time", lambda: now + 61)
+    assert not cache.has_text("What is the weather on Mars?")
+    assert len(cache) == 0
+
+
+def test_vector_hit_at_or_above_threshold(cache):
+    v = np.zeros(16, dtype=np.float32)
+    v[0] = 1.0
+    cache.add("rejected", 3.0 * v)  # stored normalized
+    assert cache.near_vector(_near(v, 0.99))
+    assert cache.near_vector(_near(v, 0.951))
+    assert not cache.near_vector(_near(v, 0.90))
+    assert not cache.near_vector(np.zeros(16))
+
+
+def test_vocabulary_prefilter(cache):
+    cache.set_vocabulary(tokenize("refund policy shipping orders returns within thirty days"))
+    assert cache.off_topic("Which planets have volcanic mountains?")
+    # A shared 4-letter stem is enough to let the question through
+    assert not cache.off_topic("Which planets have refundable mountains?")
+    # Too few content terms to judge
+    assert not cache.off_topic("volcanic mountains")
+
+
+def test_prefilter_is_off_without_vocabulary(cache):
+    assert not cache.off_topic("Which planets have volcanic mountains?")
+
+
+def test_rebuild_resets_cached_rejections(cache):
+    v = np.ones(16, dtype=np.float32)
+    cache.add("What is the weather on Mars?", v)
+    cache.set_vocabulary(tokenize("weather reports for mars"))
+    assert not cache.has_text("What is the weather on Mars?")
+    assert not cache.near_vector(v)
+    assert len(cache) == 0
@@ -0,0 +1,81 @@
+# backend/test_quant_index.py
+import numpy as np
+import pytest
+from langchain_core.vectorstores import VectorStore
+
+from quant_index import QuantizedIndex, cosine_to_relevance
+
+
+def _unit(rng, n, dim):
+    v = rng.standard_normal((n, dim)).astype(np.float32)
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def _index(mode, n=500, dim=128, seed=0):
+    # Clusters of 10 near-duplicates, like overlapping chunks of one document
+    rng = np.random.default_rng(seed)
+    centers = _unit(rng, n // 10, dim)
+    vecs = np.repeat(centers, 10, axis=0) + 0.15 * _unit(rng, n, dim)
+    vecs = (vecs / np.linalg.norm(vecs, axis=1, keepdims=True)).astype(np.float32)
+    ids = [f"d{i}" for i in range(n)]
+    return QuantizedIndex.build(vecs, [f"text {i}" for i in ids], [{"i": i} for i in range(n)], ids, mode), vecs, rng
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_rescored_top_k_matches_brute_force(mode):
+    index, vecs, rng = _index(mode)
+    for row in rng.choice(len(vecs), 20, replace=False):
+        q = vecs[row] + 0.1 * _unit(rng, 1, vecs.shape[1])[0]
+        q /= np.linalg.norm(q)
+        sims = vecs @ q
+        expected = [int(i) for i in np.argsort(-sims)[:5]]
+        hits = index.search(q, k=5, shortlist=50)
+        assert [r for r, _ in hits] == expected
+        np.testing.assert_allclose([c for _, c in hits], sims[expected], rtol=1e-5)
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_save_load_round_trip(mode, tmp_path):
+    index, vecs, rng = _index(mode, n=100)
+    index.save(str(tmp_path))
+    loaded = QuantizedIndex.load(str(tmp_path))
+
+    assert loaded.mode == mode and len(loaded) == 100 and loaded.dim == index.dim
+    assert loaded.scale == pytest.approx(index.scale)
+    assert loaded.ids == index.ids and loaded.texts == index.texts and loaded.metadatas == index.metadatas
+    np.testing.assert_array_equal(loaded.codes, index.codes)
+    np.testing.assert_allclose(np.asarray(loaded.full), index.full)
+    q = _unit(rng, 1, vecs.shape[1])[0]
+    assert loaded.search(q, k=3, shortlist=20) == index.search(q, k=3, shortlist=20)
+
+
+def test_load_missing_index_returns_none(tmp_path):
+    assert QuantizedIndex.load(str(tmp_path)) is None
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_relevance_matches_chroma_l2_scoring(mode):
+    index, vecs, rng = _index(mode, n=50)
+    q = _unit(rng, 1, vecs.shape[1])[0]
+    for row, cos in index.search(q, k=5, shortlist=50):
+        # Chroma's "l2" space returns the squared distance; LangChain maps it to relevance
+        squared_l2 = float(np.sum((vecs[row] - q) ** 2))
+        chroma = VectorStore._euclidean_relevance_score_fn(squared_l2)
+        assert cosine_to_relevance(cos) == pytest.approx(chroma, abs=1e-5)
+
+
+def test_relevance_at_cosine_point_eight():
+    assert cosine_to_relevance(0.8) == pytest.approx(1 - 0.4 / np.sqrt(2))
+
+
+def test_relevance_matches_a_real_chroma_collection(tmp_path):
+    chromadb = pytest.importorskip("chromadb")
+    index, vecs, rng = _index("int8", n=20)
+    client = chromadb.PersistentClient(path=str(tmp_path))
+    col = client.create_collection("t")
+    col.add(ids=index.ids, embeddings=vecs.tolist(), documents=index.texts)
+    q = _unit(rng, 1, vecs.shape[1])[0]
+    res = col.query(query_embeddings=[q.tolist()], n_results=3, include=["distances"])
+    chroma = {i: VectorStore._euclidean_relevance_score_fn(d) for i, d in zip(res["ids"][0], res["distances"][0])}
+    for row, cos in index.search(q, k=3, shortlist=20):
+        assert cosine_to_relevance(cos) == pytest.approx(chroma[index.ids[row]], abs=1e-4)
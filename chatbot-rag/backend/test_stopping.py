@@ -0,0 +1,54 @@
+# backend/test_stopping.py
+import pytest
+
+from stopping import AnswerStopper, answer_complete, count_sentences
+
+
+def test_newline_after_answer_text_stops():
+    assert not answer_complete("   \n")  # leading whitespace is not an answer yet
+    assert not answer_complete("You can return it")
+    assert answer_complete("You can return it\n")
+
+
+@pytest.mark.parametrize("marker", ["RULES:", "Context:", "Question:"])
+def test_template_marker_stops(marker):
+    assert answer_complete(f"You can return it {marker}")
+
+
+def test_three_sentences_stop():
+    assert not answer_complete("One. Two.")
+    assert not answer_complete("One. Two. Three")
+    assert answer_complete("One. Two. Three.")
+    assert answer_complete("One! Two? \"Three.\" Four")
+    assert not answer_complete("One. Two. Three.", max_sentences=0)
+    assert answer_complete("Only one.", max_sentences=1)
+
+
+def test_abbreviations_and_pending_decimals_are_not_sentence_ends():
+    assert count_sentences("Bring ID, e.g. a passport. Thanks.") == 2
+    assert count_sentences("It costs 4.") == 0  # may still become 4.5
+    assert count_sentences("It costs 4.5 dollars.") == 1
+    assert count_sentences("Step 4. Done") == 1
+
+
+def test_criterion_stops_rows_independently():
+    torch = pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+
+    class CharTokenizer:
+        def decode(self, ids, skip_special_tokens=True):
+            return "".join(chr(i) for i in ids.tolist())
+
+    prompt = "Q:"
+    rows = ["Yes.\nmore text", "Well. It is. Fine. More"]
+    stopper = AnswerStopper(CharTokenizer(), prompt_len=len(prompt))
+    criterion = stopper.criterion()
+    stopped_at = [None, None]
+    for n in range(1, max(map(len, rows)) + 1):
+        ids = torch.tensor([[ord(c) for c in (prompt + r[:n]).ljust(len(prompt) + n)] for r in rows])
+        done = criterion(ids, None).tolist()
+        for i, d in enumerate(done):
+            if d and stopped_at[i] is None:
+                stopped_at[i] = n
+    assert stopped_at == [len("Yes.\n"), len("Well. It is. Fine.")]
+    assert stopper.stopped_rows == 2
@@ -0,0 +1,97 @@
+# backend/test_text_quality.py
+import random
+
+import pytest
+
+from text_quality import GIBBERISH_ABORT_MIN_CHARS, GibberishMonitor, GibberishScorer, looks_like_gibberish, score_text
+
+CLEAN = "The refund policy allows returns within thirty days of purchase, provided the item is unused."
+LONG_CLEAN = (
+    "Orders ship from our warehouse within two business days. Tracking numbers arrive by email "
+    "once the carrier scans the parcel, and international deliveries usually take between one "
+    "and three weeks depending on customs clearance in the destination country."
+)
+GIBBERISH = "xq zk pt. fr. gh. wl. mn. bv. kj. zx. qw. rt. yp. lk. jh. gf. ds. vb. nm."
+TEXTS = [
+    CLEAN,
+    GIBBERISH,
+    "  leading and trailing whitespace   \n\n",
+    "Unicode café naïve résumé — déjà vu, ünïcödé everywhere ✓ ✓ ✓",
+    "broken � bytes in the middle of a sentence",
+    "e.g. i.e. a.m. p.m. etc. vs. the the the the the the the the",
+    "",
+    "   ",
+]
+
+
+def _pieces(text, rng):
+    out, i = [], 0
+    while i < len(text):
+        n = rng.randint(1, 6)
+        out.append(text[i:i + n])
+        i += n
+    return out
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_token_by_token_feed_matches_one_shot(text):
+    rng = random.Random(0)
+    for split in (list(text), _pieces(text, rng), _pieces(text, rng)):
+        scorer = GibberishScorer()
+        for piece in split:
+            scorer.feed(piece)
+        assert scorer.score() == score_text(text)
+
+
+def test_clean_and_gibberish_text_are_told_apart():
+    assert not looks_like_gibberish(CLEAN)
+    assert looks_like_gibberish(GIBBERISH)
+    assert {"few_vowels", "short_words"} <= set(score_text(GIBBERISH).reasons())
+
+
+def _generate(monitor, text, piece=3):
+    """Feed `text` to the monitor the way decoding grows it; returns chars decoded when it stopped."""
+    for end in range(piece, len(text) + piece, piece):
+        if monitor.update(text[:end]):
+            return min(end, len(text))
+    return None
+
+
+def test_monitor_stops_gibberish_generation_early():
+    runaway = GIBBERISH * 10
+    monitor = GibberishMonitor(tokenizer=None, prompt_len=0)
+    stopped_at = _generate(monitor, runaway)
+    assert monitor.aborted
+    assert GIBBERISH_ABORT_MIN_CHARS <= stopped_at < len(GIBBERISH) + 10
+
+
+def test_monitor_lets_clean_generation_finish():
+    monitor = GibberishMonitor(tokenizer=None, prompt_len=0)
+    assert _generate(monitor, LONG_CLEAN) is None
+    assert not monitor.aborted
+
+
+def test_monitor_only_judges_the_first_line():
+    monitor = GibberishMonitor(tokenizer=None, prompt_len=0)
+    assert _generate(monitor, CLEAN + "\n" + GIBBERISH * 5) is None
+    assert not monitor.aborted
+
+
+def test_monitor_criterion_decodes_every_n_steps():
+    torch = pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+
+    class CharTokenizer:
+        def decode(self, ids, skip_special_tokens=True):
+            return "".join(chr(i) for i in ids.tolist())
+
+    prompt = "Q: ?\nA:"
+    answer = GIBBERISH * 5
+    monitor = GibberishMonitor(CharTokenizer(), prompt_len=len(prompt), every=4)
+    criterion = monitor.criterion()
+    ids = [ord(c) for c in prompt]
+    for step, ch in enumerate(answer, 1):
+        ids.append(ord(ch))
+        if criterion(torch.tensor([ids]), None):
+            break
+    assert monitor.aborted and step % 4 == 0 and step < len(answer)
@@ -0,0 +1,266 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Set
+
+# ------------------------------------------------------------------------------
+# Gibberish scoring for model output
+#
+# One translate() per chunk maps every ASCII character to a class letter, so
+# the character statistics are a handful of C-level str.count() calls rather
+# than one Python loop per statistic; only non-ASCII characters (rare) are
+# looked at individually. Word statistics come from one str.split().
+#
+# GibberishScorer.feed() accepts text in pieces (streamed tokens) and keeps
+# running counts, so a generation can be judged while it is still decoding.
+# The thresholds are the ones chain_v2._looks_like_gibberish has always used.
+# ------------------------------------------------------------------------------
+# Don't abort a generation before this much answer text exists
+GIBBERISH_ABORT_MIN_CHARS = int(os.getenv("GIBBERISH_ABORT_MIN_CHARS", "40"))
+# Decode and re-score the answer every N generated tokens
+GIBBERISH_CHECK_EVERY = int(os.getenv("GIBBERISH_CHECK_EVERY", "8"))
+
+MIN_CHARS = 12
+MAX_NON_ASCII = 0.08
+MAX_PUNCT = 0.25
+MIN_LETTERS = 0.50
+MIN_VOWELS = 0.22
+MIN_WORDS_FOR_WORD_RULES = 8
+MAX_SHORT_WORDS = 0.35
+MAX_ABBREVIATIONS = 4
+MIN_UNIQUE_WORDS = 0.55
+
+_PUNCT = ".,;:!?()[]{}<>_/\\|@#$%^&*+=~`"
+_WORD_STRIP = ".,;:!?()[]{}"
+_ABBR_RE = re.compile(r"\b\w{1,4}\.\b")
+
+# ASCII -> class: v vowel, c other letter, p punctuation, s whitespace, o other
+_CLASS_TABLE = {}
+for _i in range(128):
+    _ch = chr(_i)
+    if _ch in "aeiouAEIOU":
+        _CLASS_TABLE[_i] = "v"
+    elif _ch.isalpha():
+        _CLASS_TABLE[_i] = "c"
+    elif _ch in _PUNCT:
+        _CLASS_TABLE[_i] = "p"
+    elif _ch.isspace():
+        _CLASS_TABLE[_i] = "s"
+    else:
+        _CLASS_TABLE[_i] = "o"
+
+
+@dataclass
+class QualityScore:
+    chars: int
+    non_ascii: int
+    punct: int
+    letters: int
+    vowels: int
+    words: int
+    short_words: int
+    abbreviations: int
+    unique_words: int
+    replacement_char: bool
+
+    @property
+    def non_ascii_ratio(self) -> float:
+        return self.non_ascii / max(1, self.chars)
+
+    @property
+    def punct_ratio(self) -> float:
+        return self.punct / max(1, self.chars)
+
+    @property
+    def letter_ratio(self) -> float:
+        return self.letters / max(1, self.chars)
+
+    @property
+    def vowel_ratio(self) -> float:
+        return self.vowels / max(1, self.letters)
+
+    def reasons(self, min_chars: int = MIN_CHARS) -> List[str]:
+        """Every rule the text breaks (empty list means it looks like language)."""
+        out: List[str] = []
+        if self.chars < min_chars:
+            out.append("too_short")
+        if self.replacement_char:
+            out.append("replacement_char")
+        if self.non_ascii_ratio > MAX_NON_ASCII:
+            out.append("non_ascii")
+        if self.punct_ratio > MAX_PUNCT:
+            out.append("punctuation")
+        if self.letter_ratio < MIN_LETTERS:
+            out.append("few_letters")
+        if self.vowel_ratio < MIN_VOWELS:
+            out.append("few_vowels")
+        if self.words >= MIN_WORDS_FOR_WORD_RULES:
+            if self.short_words / self.words > MAX_SHORT_WORDS:
+                out.append("short_words")
+            if self.abbreviations >= MAX_ABBREVIATIONS:
+                out.append("abbreviations")
+            if self.unique_words / self.words < MIN_UNIQUE_WORDS:
+                out.append("repetition")
+        return out
+
+    @property
+    def is_gibberish(self) -> bool:
+        return bool(self.reasons())
+
+
+class GibberishScorer:
+    """Running QualityScore over text fed in pieces; leading/trailing whitespace is ignored."""
+
+    __slots__ = (
+        "_chars", "_trailing_ws", "_non_ascii", "_punct", "_letters", "_vowels",
+        "_words", "_short", "_abbr", "_seen", "_partial", "_replacement",
+    )
+
+    def __init__(self, text: str = ""):
+        self._chars = 0
+        self._trailing_ws = 0
+        self._non_ascii = 0
+        self._punct = 0
+        self._letters = 0
+        self._vowels = 0
+        self._words = 0
+        self._short = 0
+        self._abbr = 0
+        self._seen: Set[str] = set()
+        self._partial = ""
+        self._replacement = False
+        if text:
+            self.feed(text)
+
+    def feed(self, text: str) -> None:
+        if not text:
+            return
+        if self._chars == 0:
+            text = text.lstrip()
+            if not text:
+                return
+
+        classes = text.translate(_CLASS_TABLE)
+        vowels = classes.count("v")
+        letters = vowels + classes.count("c")
+        punct = classes.count("p")
+        ascii_count = letters + punct + classes.count("s") + classes.count("o")
+        self._punct += punct
+        if ascii_count < len(text):
+            for ch in text:
+                if ord(ch) > 127:
+                    self._non_ascii += 1
+                    if ch.isalpha():
+                        letters += 1
+                    elif ch == "\ufffd":
+                        self._replacement = True
+        self._vowels += vowels
+        self._letters += letters
+        self._chars += len(text)
+
+        stripped = text.rstrip()
+        self._trailing_ws = self._trailing_ws + len(text) if not stripped else len(text) - len(stripped)
+
+        words = (self._partial + text).split()
+        if text[-1].isspace():
+            self._partial = ""
+        else:
+            self._partial = words.pop() if words else ""
+        for w in words:
+            self._add_word(w)
+
+    def _add_word(self, w: str) -> None:
+        self._words += 1
+        if len(w.strip(_WORD_STRIP)) <= 2:
+            self._short += 1
+        if "." in w:
+            self._abbr += len(_ABBR_RE.findall(w))
+        self._seen.add(w)
+
+    def score(self) -> QualityScore:
+        words, short, abbr, unique = self._words, self._short, self._abbr, len(self._seen)
+        w = self._partial
+        if w:
+            words += 1
+            short += len(w.strip(_WORD_STRIP)) <= 2
+            abbr += len(_ABBR_RE.findall(w)) if "." in w else 0
+            unique += w not in self._seen
+        return QualityScore(
+            chars=self._chars - self._trailing_ws,
+            non_ascii=self._non_ascii,
+            punct=self._punct,
+            letters=self._letters,
+            vowels=self._vowels,
+            words=words,
+            short_words=short,
+            abbreviations=abbr,
+            unique_words=unique,
+            replacement_char=self._replacement,
+        )
+
+    def should_abort(self, min_chars: int = GIBBERISH_ABORT_MIN_CHARS) -> bool:
+        """True once there is enough text to judge and it already reads as gibberish."""
+        score = self.score()
+        return score.chars >= min_chars and score.is_gibberish
+
+
+def score_text(text: Optional[str]) -> QualityScore:
+    return GibberishScorer(text or "").score()
+
+
+def looks_like_gibberish(text: Optional[str]) -> bool:
+    return score_text(text).is_gibberish
+
+
+class GibberishMonitor:
+    """
+    Watches one generate() call through a StoppingCriteria and stops it once the
+    answer (the first line, as _finalize_answer keeps it) already reads as
+    gibberish, instead of decoding to GEN_MAX_NEW_TOKENS and rejecting it then.
+    """
+
+    def __init__(self, tokenizer, prompt_len: int, every: int = GIBBERISH_CHECK_EVERY):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.every = max(1, every)
+        self.scorer = GibberishScorer()
+        self.aborted = False
+        self._fed = ""
+        self._settled = False
+        self._steps = 0
+
+    def update(self, text: str) -> bool:
+        """Score the answer decoded so far; True means stop generating."""
+        if self._settled:
+            return False
+        t = text.lstrip()
+        head, newline, _ = t.partition("\n")
+        if head.endswith("\ufffd") and not newline:
+            return False  # mid multi-byte character; wait for the rest
+        if head.startswith(self._fed):
+            self.scorer.feed(head[len(self._fed):])
+        else:
+            self.scorer = GibberishScorer(head)
+        self._fed = head
+        if self.scorer.should_abort():
+            self.aborted = True
+            return True
+        # Past the first line nothing else is kept, so a clean line is final
+        self._settled = bool(newline)
+        return False
+
+    def criterion(self):
+        from transformers import StoppingCriteria  # type: ignore
+
+        monitor = self
+
+        class _GibberishCriteria(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                monitor._steps += 1
+                if monitor._steps % monitor.every:
+                    return False
+                text = monitor.tokenizer.decode(input_ids[0, monitor.prompt_len:], skip_special_tokens=True)
+                return monitor.update(text)
+
+        return _GibberishCriteria()
+
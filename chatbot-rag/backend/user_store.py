@@ -0,0 +1,277 @@
+import os
+import json
+import queue
+import sqlite3
+import logging
+import argparse
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Iterator
+
+logger = logging.getLogger("RAG_USERS")
+
+# ------------------------------------------------------------------------------
+# User store
+#
+#   USER_STORE=sqlite (default)  users.db in WAL mode; lookups hit the email
+#                                primary-key index, registrations are single
+#                                INSERTs, so workers can't lose each other's writes
+#   USER_STORE=json              the legacy users.json file
+#
+# On first open the SQLite store imports users.json once (recorded in the meta
+# table; the file is left in place). `python user_store.py migrate` does the
+# same by hand.
+# ------------------------------------------------------------------------------
+USER_STORE = os.getenv("USER_STORE", "sqlite").lower()
+USERS_FILE = os.getenv("USERS_FILE", "users.json")
+USERS_DB = os.getenv("USERS_DB", "users.db")
+USERS_DB_POOL_SIZE = int(os.getenv("USERS_DB_POOL_SIZE", "4"))
+
+_FIELDS = ("email", "hashed_password", "role", "created_at")
+
+
+class UserStore(ABC):
+    """Backend interface; user records are dicts with _FIELDS."""
+
+    @abstractmethod
+    def get(self, email: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    def exists(self, email: str) -> bool:
+        return self.get(email) is not None
+
+    @abstractmethod
+    def create(self, user: Dict[str, Any]) -> bool:
+        """Insert a new user; False if the email is already taken."""
+
+    @abstractmethod
+    def upsert(self, user: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def all_users(self) -> Dict[str, Dict[str, Any]]:
+        ...
+
+    def count(self) -> int:
+        return len(self.all_users())
+
+
+class JsonUserStore(UserStore):
+    """users.json, parsed once and re-read only when the file changes."""
+
+    def __init__(self, path: str = USERS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._users: Dict[str, Dict[str, Any]] = {}
+        self._mtime: Optional[float] = None
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            self._users, self._mtime = {}, None
+            return self._users
+        if mtime != self._mtime:
+            try:
+                with open(self.path, "r") as f:
+                    self._users = json.load(f)
+            except json.JSONDecodeError:
+                self._users = {}
+            self._mtime = mtime
+        return self._users
+
+    def _save(self, users: Dict[str, Dict[str, Any]]) -> None:
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(users, f, indent=2)
+        os.replace(tmp, self.path)
+        self._mtime = os.path.getmtime(self.path)
+
+    def get(self, email: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            user = self._load().get(email)
+            return dict(user) if user else None
+
+    def create(self, user: Dict[str, Any]) -> bool:
+        with self._lock:
+            users = self._load()
+            if user["email"] in users:
+                return False
+            users[user["email"]] = dict(user)
+            self._save(users)
+            return True
+
+    def upsert(self, user: Dict[str, Any]) -> None:
+        with self._lock:
+            users = self._load()
+            users[user["email"]] = dict(user)
+            self._save(users)
+
+    def all_users(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {k: dict(v) for k, v in self._load().items()}
+
+
+class SQLiteUserStore(UserStore):
+    # Constant SQL strings: sqlite3 keeps each connection's compiled statements
+    # in its statement cache, so these are prepared once per pooled connection.
+    _SELECT = "SELECT email, hashed_password, role, created_at FROM users WHERE email = ?"
+    _EXISTS = "SELECT 1 FROM users WHERE email = ?"
+    _INSERT = "INSERT INTO users (email, hashed_password, role, created_at) VALUES (?, ?, ?, ?)"
+    _UPSERT = (
+        "INSERT INTO users (email, hashed_password, role, created_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(email) DO UPDATE SET hashed_password = excluded.hashed_password, "
+        "role = excluded.role, created_at = excluded.created_at"
+    )
+    _IMPORT = "INSERT OR IGNORE INTO users (email, hashed_password, role, created_at) VALUES (?, ?, ?, ?)"
+
+    def __init__(self, path: str = USERS_DB, pool_size: int = USERS_DB_POOL_SIZE, legacy_json: Optional[str] = USERS_FILE):
+        self.path = path
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        with self._schema_conn() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS users (
+                    email TEXT PRIMARY KEY,
+                    hashed_password TEXT NOT NULL,
+                    role TEXT NOT NULL DEFAULT 'user',
+                    created_at TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+                """
+            )
+        for _ in range(max(1, pool_size)):
+            self._pool.put(self._connect())
+        if legacy_json:
+            self.migrate_from_json(legacy_json)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Pooled connections move between request threads; each is used by one at a time
+        conn = sqlite3.connect(self.path, timeout=10.0, check_same_thread=False, isolation_level=None, cached_statements=64)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=10000")
+        return conn
+
+    @contextmanager
+    def _schema_conn(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _conn(self) -> Iterator[sqlite3.Connection]:
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @staticmethod
+    def _row(user: Dict[str, Any]):
+        return (user["email"], user["hashed_password"], user.get("role", "user"), user.get("created_at", ""))
+
+    def get(self, email: str) -> Optional[Dict[str, Any]]:
+        with self._conn() as conn:
+            row = conn.execute(self._SELECT, (email,)).fetchone()
+        return dict(zip(_FIELDS, row)) if row else None
+
+    def exists(self, email: str) -> bool:
+        with self._conn() as conn:
+            return conn.execute(self._EXISTS, (email,)).fetchone() is not None
+
+    def create(self, user: Dict[str, Any]) -> bool:
+        try:
+            with self._conn() as conn:
+                conn.execute(self._INSERT, self._row(user))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def upsert(self, user: Dict[str, Any]) -> None:
+        with self._conn() as conn:
+            conn.execute(self._UPSERT, self._row(user))
+
+    def all_users(self) -> Dict[str, Dict[str, Any]]:
+        with self._conn() as conn:
+            rows = conn.execute("SELECT email, hashed_password, role, created_at FROM users").fetchall()
+        return {r[0]: dict(zip(_FIELDS, r)) for r in rows}
+
+    def count(self) -> int:
+        with self._conn() as conn:
+            return int(conn.execute("SELECT COUNT(*) FROM users").fetchone()[0])
+
+    def migrate_from_json(self, json_path: str, force: bool = False) -> int:
+        """Import users.json once (INSERT OR IGNORE: existing rows win). Returns rows added."""
+        if not os.path.exists(json_path):
+            return 0
+        key = f"migrated:{os.path.abspath(json_path)}"
+        with self._conn() as conn:
+            if not force and conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+                return 0
+            try:
+                with open(json_path, "r") as f:
+                    users = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning("⚠️ [Users] Could not read %s for migration: %s", json_path, e)
+                return 0
+
+            # One transaction, so concurrently starting workers import it exactly once
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if not force and conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+                    conn.execute("ROLLBACK")
+                    return 0
+                before = conn.total_changes
+                conn.executemany(
+                    self._IMPORT,
+                    [self._row({"email": email, **u}) for email, u in users.items() if u.get("hashed_password")],
+                )
+                added = conn.total_changes - before
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, datetime('now'))", (key,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        logger.info("✅ [Users] Migrated %d/%d users from %s into %s.", added, len(users), json_path, self.path)
+        return added
+
+
+_store: Optional[UserStore] = None
+_store_lock = threading.Lock()
+
+
+def get_user_store() -> UserStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if USER_STORE == "json":
+                    _store = JsonUserStore(USERS_FILE)
+                else:
+                    _store = SQLiteUserStore(USERS_DB, legacy_json=USERS_FILE)
+                logger.info("👤 [Users] Using %s store.", type(_store).__name__)
+    return _store
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="User store maintenance.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    mig = sub.add_parser("migrate", help="import users.json into the SQLite store")
+    mig.add_argument("--json", default=USERS_FILE)
+    mig.add_argument("--db", default=USERS_DB)
+    mig.add_argument("--force", action="store_true", help="re-import even if already migrated")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.cmd == "migrate":
+        store = SQLiteUserStore(args.db, pool_size=1, legacy_json=None)
+        added = store.migrate_from_json(args.json, force=args.force)
+        print(f"added {added} users; {store.count()} total in {args.db}")
+
+
+if __name__ == "__main__":
+    main()